@@ -1,6 +1,9 @@
 #!/bin/bash
 
 scp -p bontstowersme:var-sme/env.sh ./env.sh.copy
+# persdata.json is only as fresh as the last '!sme dev export'
 scp -p bontstowersme:var-sme/persdata.json ./
+scp -p bontstowersme:var-sme/persdata.smeb ./
+scp -p bontstowersme:var-sme/persdata.journal ./
 scp -p bontstowersme:var-sme/config.json ./
 scp -p bontstowersme:var-sme/weights.json ./
@@ -2,12 +2,29 @@ use pyo3::prelude::*;
 use pyo3::wrap_pyfunction;
 
 // use chrono::prelude::*;
-use chrono::{LocalResult, NaiveDateTime, Offset, TimeZone, Utc};
+use chrono::{DateTime, LocalResult, NaiveDateTime, Offset, TimeZone, Utc};
 use chrono_tz::Tz;
+use once_cell::sync::Lazy;
+use std::collections::HashMap;
+use std::sync::Mutex;
 
 static _TIMEFMT: &str = "%Y-%m-%d %H:%M:%S";
 static _TIMEFMTSHORT: &str = "%a %H:%M";
 
+// Timezone strings come from pilots, so there are few distinct ones, but
+// still put a limit on them
+static _TZ_CACHE_MAX: usize = 4096;
+
+#[derive(Clone, Copy, Debug, PartialEq)]
+enum ParsedTz {
+    Named(Tz),
+    // seconds east of UTC
+    Fixed(i32),
+    Invalid,
+}
+
+static TZ_CACHE: Lazy<Mutex<HashMap<String, ParsedTz>>> = Lazy::new(|| Mutex::new(HashMap::new()));
+
 fn mod_init() {}
 
 pub fn sme_time_now_impl() -> u32 {
@@ -44,22 +61,8 @@ pub fn sme_time_from_string(time_str: &str) -> PyResult<u32> {
 }
 
 pub fn sme_time_is_valid_timezone_impl(tz_str: &str) -> bool {
-    match tz_str.parse::<Tz>() {
-        Ok(_) => true,
-        Err(_) => {
-            if tz_str.len() >= 4 {
-                let prefix = tz_str[..3].to_lowercase();
-
-                match prefix.as_str() {
-                    "utc" | "gmt" => tz_str[3..].parse::<i32>().is_ok(),
-                    "fof" => tz_str[3..].parse::<i32>().is_ok(),
-                    _ => false,
-                }
-            } else {
-                false
-            }
-        }
-    }
+    // The same parse, and cache, as conversion uses
+    parse_tz_cached(tz_str) != ParsedTz::Invalid
 }
 
 #[pyfunction]
@@ -67,59 +70,119 @@ pub fn sme_time_is_valid_timezone(tz_str: &str) -> PyResult<bool> {
     Ok(sme_time_is_valid_timezone_impl(tz_str))
 }
 
-fn format_tz_result(time_str: &String, sorting_factor: i32) -> String {
-    format!("{}{},{}", &time_str[..2], &time_str[3..], sorting_factor)
+fn format_tz_result(display: &str, sorting_factor: i32) -> String {
+    format!("{},{}", display, sorting_factor)
 }
 
-pub fn sme_time_convert_to_timezone_impl(time_ob: u32, tz_str: &str) -> Option<String> {
+fn format_tz_display(time_str: &str) -> String {
+    // Two letter day names
+    format!("{}{}", &time_str[..2], &time_str[3..])
+}
+
+fn utc_datetime(secs: i64) -> Option<DateTime<Utc>> {
+    match Utc.timestamp_opt(secs, 0) {
+        LocalResult::Single(sdt) => Some(sdt),
+        LocalResult::Ambiguous(adt, _) => Some(adt),
+        _ => None,
+    }
+}
+
+fn parse_tz(tz_str: &str) -> ParsedTz {
     match tz_str.parse::<Tz>() {
-        Ok(tz) => {
-            let dt = match Utc.timestamp_opt(time_ob as i64, 0) {
-                LocalResult::Single(sdt) => Some(sdt),
-                LocalResult::Ambiguous(adt, _) => Some(adt),
-                _ => None,
-            }?
-            .with_timezone(&tz);
-
-            Some(format_tz_result(
-                &dt.format(_TIMEFMTSHORT).to_string(),
-                dt.offset().fix().local_minus_utc(),
-            ))
-        }
+        Ok(tz) => ParsedTz::Named(tz),
         Err(_) => {
-            if tz_str.len() >= 4 {
+            if tz_str.len() >= 4 && tz_str.is_char_boundary(3) {
                 let prefix = tz_str[..3].to_lowercase();
 
-                let offset: i32 = match prefix.as_str() {
+                let offset: Option<i32> = match prefix.as_str() {
                     // seconds
-                    "utc" | "gmt" => Some(tz_str[3..].parse::<i32>().ok()? * 3600_i32),
-                    "fof" => Some(tz_str[3..].parse::<i32>().ok()? * 60_i32),
+                    "utc" | "gmt" => tz_str[3..]
+                        .parse::<i32>()
+                        .ok()
+                        .and_then(|hrs| hrs.checked_mul(3600_i32)),
+                    "fof" => tz_str[3..]
+                        .parse::<i32>()
+                        .ok()
+                        .and_then(|mins| mins.checked_mul(60_i32)),
                     _ => None,
-                }?;
+                };
 
                 match offset {
                     // Check the offset in seconds is within -12hr ... 12hr
-                    -43200..=43200 => {
-                        let dt = match Utc.timestamp_opt(time_ob as i64 + offset as i64, 0) {
-                            LocalResult::Single(sdt) => Some(sdt),
-                            LocalResult::Ambiguous(adt, _) => Some(adt),
-                            _ => None,
-                        }?;
-
-                        Some(format_tz_result(
-                            &dt.format(_TIMEFMTSHORT).to_string(),
-                            offset,
-                        ))
-                    }
-                    _ => None,
+                    Some(secs @ -43200..=43200) => ParsedTz::Fixed(secs),
+                    _ => ParsedTz::Invalid,
                 }
             } else {
-                None
+                ParsedTz::Invalid
             }
         }
     }
 }
 
+fn parse_tz_cached(tz_str: &str) -> ParsedTz {
+    let cached = TZ_CACHE
+        .lock()
+        .ok()
+        .and_then(|cache| cache.get(tz_str).copied());
+
+    match cached {
+        Some(parsed) => parsed,
+        None => {
+            // Parsed without holding the lock
+            let parsed = parse_tz(tz_str);
+
+            if let Ok(mut cache) = TZ_CACHE.lock() {
+                if cache.len() < _TZ_CACHE_MAX {
+                    cache.insert(tz_str.to_string(), parsed);
+                }
+            }
+
+            parsed
+        }
+    }
+}
+
+fn convert_parsed_tz(time_ob: u32, parsed: ParsedTz) -> Option<(String, i32)> {
+    match parsed {
+        ParsedTz::Named(tz) => {
+            let dt = utc_datetime(time_ob as i64)?.with_timezone(&tz);
+
+            Some((
+                format_tz_display(&dt.format(_TIMEFMTSHORT).to_string()),
+                dt.offset().fix().local_minus_utc(),
+            ))
+        }
+        ParsedTz::Fixed(offset) => {
+            let dt = utc_datetime(time_ob as i64 + offset as i64)?;
+
+            Some((
+                format_tz_display(&dt.format(_TIMEFMTSHORT).to_string()),
+                offset,
+            ))
+        }
+        ParsedTz::Invalid => None,
+    }
+}
+
+pub fn sme_time_convert_to_timezone_impl(time_ob: u32, tz_str: &str) -> Option<String> {
+    let (display, offset) = convert_parsed_tz(time_ob, parse_tz_cached(tz_str))?;
+
+    Some(format_tz_result(&display, offset))
+}
+
+pub fn sme_time_convert_to_timezone_batch_impl(
+    time_ob: u32,
+    tz_list: &[String],
+) -> Vec<(String, i32)> {
+    tz_list
+        .iter()
+        .map(|tz_str| {
+            convert_parsed_tz(time_ob, parse_tz_cached(tz_str))
+                .unwrap_or_else(|| ("".to_string(), 0))
+        })
+        .collect()
+}
+
 #[pyfunction]
 pub fn sme_time_convert_to_timezone(time_ob: u32, tz_str: &str) -> PyResult<String> {
     Ok(match sme_time_convert_to_timezone_impl(time_ob, tz_str) {
@@ -128,6 +191,16 @@ pub fn sme_time_convert_to_timezone(time_ob: u32, tz_str: &str) -> PyResult<Stri
     })
 }
 
+// One (display, offset) per timezone string, ("", 0) for a bad one
+#[pyfunction]
+pub fn sme_time_convert_to_timezone_batch(
+    py: Python<'_>,
+    time_ob: u32,
+    tz_list: Vec<String>,
+) -> PyResult<Vec<(String, i32)>> {
+    Ok(py.allow_threads(|| sme_time_convert_to_timezone_batch_impl(time_ob, &tz_list)))
+}
+
 pub fn sme_time_pymodule(m: &Bound<'_, PyModule>) -> PyResult<()> {
     mod_init();
 
@@ -136,6 +209,7 @@ pub fn sme_time_pymodule(m: &Bound<'_, PyModule>) -> PyResult<()> {
     m.add_wrapped(wrap_pyfunction!(sme_time_from_string))?;
     m.add_wrapped(wrap_pyfunction!(sme_time_is_valid_timezone))?;
     m.add_wrapped(wrap_pyfunction!(sme_time_convert_to_timezone))?;
+    m.add_wrapped(wrap_pyfunction!(sme_time_convert_to_timezone_batch))?;
 
     Ok(())
 }
@@ -168,6 +242,15 @@ mod sme_time_tests {
         assert!(!sme_time_is_valid_timezone_impl("MiddleEarth/Hobbiton"));
     }
 
+    #[test]
+    fn test_sme_time_is_valid_timezone_offset() {
+        assert!(sme_time_is_valid_timezone_impl("utc-5"));
+        assert!(sme_time_is_valid_timezone_impl("fof-300"));
+        assert!(!sme_time_is_valid_timezone_impl("utc+13"));
+        assert!(!sme_time_is_valid_timezone_impl("é+05:00"));
+        assert!(!sme_time_is_valid_timezone_impl("gé+5"));
+    }
+
     #[test]
     fn test_sme_time_convert_to_timezone_tz_succeed() {
         assert_eq!(
@@ -183,4 +266,43 @@ mod sme_time_tests {
             Some("Mo 18:48,-18000".to_string())
         )
     }
+
+    #[test]
+    fn test_sme_time_convert_to_timezone_fail() {
+        assert_eq!(
+            sme_time_convert_to_timezone_impl(1608594507_u32, "utc+13"),
+            None
+        );
+        assert_eq!(
+            sme_time_convert_to_timezone_impl(1608594507_u32, "MiddleEarth/Hobbiton"),
+            None
+        );
+    }
+
+    #[test]
+    fn test_sme_time_convert_to_timezone_batch() {
+        let tz_list = vec![
+            "America/New_York".to_string(),
+            "fof-300".to_string(),
+            "MiddleEarth/Hobbiton".to_string(),
+            "America/New_York".to_string(),
+        ];
+
+        assert_eq!(
+            sme_time_convert_to_timezone_batch_impl(1608594507_u32, &tz_list),
+            vec![
+                ("Mo 18:48".to_string(), -18000),
+                ("Mo 18:48".to_string(), -18000),
+                ("".to_string(), 0),
+                ("Mo 18:48".to_string(), -18000),
+            ]
+        );
+    }
+
+    #[test]
+    fn test_sme_time_parse_tz_cached() {
+        assert_eq!(parse_tz_cached("gmt+10"), ParsedTz::Fixed(36000));
+        assert_eq!(parse_tz_cached("gmt+10"), ParsedTz::Fixed(36000));
+        assert!(TZ_CACHE.lock().unwrap().contains_key("gmt+10"));
+    }
 }
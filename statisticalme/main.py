@@ -18,7 +18,7 @@
 # along with StatisticalMe.  If not, see <https://www.gnu.org/licenses/>.
 
 import logging
-import re
+import os
 import sys
 import time
 from pathlib import Path
@@ -27,6 +27,7 @@ import discord
 
 import statisticalme.statisticalme as smer
 
+from . import sme_storage, sme_table
 from .responder import MainCommand
 
 smer.sme_utils_loadenv("var/env.sh")
@@ -55,25 +56,18 @@ logger.info("App starting; logger ready")
 dev_author_env = smer.sme_utils_getenv("STATISTICALME_DEV_AUTHORS")
 ok_channels_env = smer.sme_utils_getenv("STATISTICALME_OK_CHANNELS")
 
+# Optional, one of: json, sqlite
+storage_env = os.environ.get("STATISTICALME_STORAGE", "json")
+# Optional, seconds to gather changes into one save
+save_window_env = os.environ.get("STATISTICALME_SAVE_WINDOW", "2.0")
+
 dev_author_list = [int(aa) for aa in dev_author_env.split(",")]
-mainc = MainCommand(dev_author_list, ok_channels_env)
-
-devecho_match = re.compile(r"\s*!sme\s+dev\s+echo\b", re.IGNORECASE)
-devping_match = re.compile(r"\s*!sme\s+dev\s+ping\b", re.IGNORECASE)
-
-alias_matches = [
-    (re.compile(r"\s*!sme\b", re.IGNORECASE), []),
-    (re.compile(r"\s*!gt\b", re.IGNORECASE), ["tech", "list"]),
-    (re.compile(r"\s*!away\b", re.IGNORECASE), ["time", "away"]),
-    (re.compile(r"\s*!back\b", re.IGNORECASE), ["time", "back"]),
-    (re.compile(r"\s*!checkin\b", re.IGNORECASE), ["time", "checkin"]),
-    (re.compile(r"\s*!dead\b", re.IGNORECASE), ["ws", "ship", "dead"]),
-    (re.compile(r"\s*!ship\b", re.IGNORECASE), ["ws", "ship"]),
-    (re.compile(r"\s*!st\b", re.IGNORECASE), ["tech", "set"]),
-    (re.compile(r"\s*!tr\b", re.IGNORECASE), ["tech", "report"]),
-    (re.compile(r"\s*!time\s+set\b", re.IGNORECASE), ["time"]),  # keeps the 'set'
-    (re.compile(r"\s*!time\b", re.IGNORECASE), ["time", "list"]),
-]
+mainc = MainCommand(
+    dev_author_list,
+    ok_channels_env,
+    storage=sme_storage.storage_from_name(storage_env, "var"),
+    save_window=float(save_window_env),
+)
 
 
 class SmeClient(discord.Client):
@@ -86,12 +80,22 @@ class SmeClient(discord.Client):
         #     au=str(message.author), ch=str(message.channel), co=str(message.content)))
 
         return_message_list = []
+        ctx = None
+
+        guild_id = None
+        if message.guild is not None:
+            guild_id = message.guild.id
 
-        if devecho_match.match(message.clean_content):
+        route = mainc.alias_router.route(message.clean_content, guild_id)
+        if route is not None:
             logger.info(
                 f"Client event on_message author={str(message.author)} channel={str(message.channel)} content={str(message.content)}"
             )
 
+        if route is None:
+            pass
+            # await mainc.on_unused_message(message)
+        elif route[0] == "echo":
             if message.author.id in dev_author_list:
                 msg_list = [
                     "Content:",
@@ -103,38 +107,27 @@ class SmeClient(discord.Client):
                 ]
                 # print('ECHO msg_list "{}"'.format(msg_list))
                 return_message_list = ["\n".join(msg_list)]
-        elif devping_match.match(message.clean_content):
-            logger.info(
-                f"Client event on_message author={str(message.author)} channel={str(message.channel)} content={str(message.content)}"
-            )
-
+        elif route[0] == "ping":
             if message.author.id in dev_author_list:
                 return_message_list = ["Pong"]
         else:
-            pre_list = None
-
-            for a_match, a_list in alias_matches:
-                if a_match.match(message.clean_content):
-                    pre_list = a_list
-                    break
-
-            if pre_list is not None:
-                logger.info(
-                    f"Client event on_message author={str(message.author)} channel={str(message.channel)} content={str(message.content)}"
-                )
-
-                params = smer.sme_utils_shellwords(message.content)
-                msg_list = await mainc.on_message(
-                    pre_list + params[1:], message.author, message.channel
-                )
-                return_message_list = return_message_list + msg_list
-            # else:
-            #     await mainc.on_unused_message(message)
+            pre_list = route[1]
+
+            ctx = mainc.request_context(message.author, message.channel)
+
+            time_start = time.perf_counter()
+            params = smer.sme_utils_shellwords(message.content)
+            ctx.add_time("parse", time.perf_counter() - time_start)
+
+            msg_list = await mainc.on_message(ctx, pre_list + params[1:])
+            return_message_list = return_message_list + msg_list
+
+        time_start = time.perf_counter()
 
         if return_message_list is not None:
             if len(return_message_list) == 1:
                 rarg = return_message_list[0]
-                if rarg[:23] == "dented-control-message:":
+                if isinstance(rarg, str) and rarg[:23] == "dented-control-message:":
                     return_message_list.pop()
                     rarg_command = rarg[23:]
 
@@ -149,8 +142,34 @@ class SmeClient(discord.Client):
 
             if len(return_message_list) > 0:
                 for mm in return_message_list:
-                    if len(mm) > 0:
-                        await message.channel.send(mm)
+                    if isinstance(mm, sme_table.Attachment):
+                        mainc.dispatcher.enqueue(message.channel, mm.content, file=mm)
+                    elif len(mm) > 0:
+                        mainc.dispatcher.enqueue(message.channel, mm)
+
+        if ctx is not None:
+            mainc.request_sent(ctx, time.perf_counter() - time_start)
+
+    async def on_member_join(self, member):
+        mainc.member_join(member)
+
+    async def on_member_remove(self, member):
+        mainc.member_remove(member)
+
+    async def on_member_update(self, before, after):
+        mainc.member_update(before, after)
+
+    async def on_user_update(self, before, after):
+        mainc.user_update(before, after)
+
+    async def on_guild_role_create(self, role):
+        mainc.role_create(role)
+
+    async def on_guild_role_update(self, before, after):
+        mainc.role_update(before, after)
+
+    async def on_guild_role_delete(self, role):
+        mainc.role_delete(role)
 
     async def on_ready(self):
         logger.info("Client event on_ready")
@@ -16,11 +16,11 @@
 # along with StatisticalMe.  If not, see <https://www.gnu.org/licenses/>.
 
 import copy
-import json
 import logging
-import math
+import os
 import re
 import sys
+import time
 import traceback
 
 import aiohttp
@@ -29,13 +29,69 @@ from discord.ext import tasks
 
 import statisticalme.statisticalme as smer
 
-from . import sme_paramparse, sme_table, sme_tech
+from . import (
+    sme_context,
+    sme_dispatch,
+    sme_names,
+    sme_paramparse,
+    sme_persist,
+    sme_roles,
+    sme_roster,
+    sme_router,
+    sme_score,
+    sme_snapshot,
+    sme_stats,
+    sme_storage,
+    sme_table,
+    sme_tech,
+)
 
 logger = logging.getLogger("StatisticalMe")
 teh = sme_tech.TechHandler()
 
+# Cargo points by level, for cargo bay extension and transport
+cargo_cbe = (0, 1, 2, 3, 5, 7, 9, 12, 15, 19, 25, 31, 52)
+cargo_ts = (0, 1, 2, 3, 4, 5, 8)
+
+
+def total_cargo(cbe, ts):
+    totalcargo = 0
+
+    if cbe < len(cargo_cbe):
+        totalcargo += cargo_cbe[cbe]
+    if ts < len(cargo_ts):
+        totalcargo += cargo_ts[ts]
+
+    return totalcargo
+
+
+# Stats worked out from tech levels, kept by the roster next to them
+derived_columns = [
+    sme_roster.DerivedColumn(
+        "totalcargo",
+        "Total Cargo",
+        [teh.get_tech_index("cargobayextension"), teh.get_tech_index("transport")],
+        total_cargo,
+    ),
+    sme_roster.DerivedColumn(
+        "relics",
+        "Relics",
+        [teh.get_tech_index("cargobayextension"), teh.get_tech_index("transport")],
+        lambda cbe, ts: total_cargo(cbe, ts) // 4,
+    ),
+]
+
+for dc in derived_columns:
+    teh.register_derived(dc.name, dc.label)
+
 bs_support_count = [0, 0, 1, 2, 3, 4, 5]
 
+# Each level includes those below it
+auth_level_none = 0
+auth_level_watcher = 1
+auth_level_chief = 2
+auth_level_dev = 3
+
 
 def is_int(value):
     try:
@@ -54,20 +110,38 @@ def is_float(value):
 
 
 class MainCommand:
-    def __init__(self, dev_author_list, ok_channels):
+    def __init__(
+        self,
+        dev_author_list,
+        ok_channels,
+        storage=None,
+        save_window=2.0,
+        dispatcher=None,
+        time_source=None,
+        background_autostart=True,
+    ):
         logger.debug("MainCommand __init__")
 
         self.dev_author_list = dev_author_list
         self.ok_channels = ok_channels.split(",")
 
-        self.time_now = smer.sme_time_now()
+        # Replay and benchmarks swap in a virtual clock, and run the
+        # background ticks themselves
+        self.time_source = time_source
+        if self.time_source is None:
+            self.time_source = smer.sme_time_now
+
+        self.time_now = self.time_source()
         self.time_up = self.time_now
 
+        self.background_autostart = background_autostart
         self.background_update_started = False
 
         self.aiohttp_session = aiohttp.ClientSession()
 
         self.current_guild = None
+        self.role_index = sme_roles.RoleIndex()
+        self.name_index = sme_names.NameIndex()
 
         self.timeparse_match1 = re.compile(r"(\d+)([dhm])")
         self.timeparse_match2 = re.compile(r"(\d+):(\d+):(\d+)")
@@ -75,41 +149,68 @@ class MainCommand:
         self.timeparse_match4 = re.compile(r"(\d+)d(\d+)h(\d+)m")
         self.ws_name_match = re.compile(r"-([a-zA-Z]+\d*)$")
 
+        self.storage = storage
+        if self.storage is None:
+            self.storage = sme_storage.JsonStorage("var")
+
+        self.persist = sme_persist.PersistWorker(
+            self.persist_snapshot, self.persist_done, save_window=save_window
+        )
+
         # Load configuration/non-pilot data
-        self.config_filepath = "var/config.json"
         self.flag_config_dirty = False
         self.groups = dict()
         self.ws = dict()
+        self.aliases = dict()
+        self.alias_router = sme_router.AliasRouter()
         self.config_load()
 
+        # White Star board state. Losing some only means a board gets posted
+        # again, so it is kept apart from config and saved now and then.
+        self.flag_wsstate_dirty = False
+        self.wsstate_interval = 300
+        self.wsstate_next_save = self.time_now + self.wsstate_interval
+        self.ws_state = dict()
+        self.ws_board_content = dict()
+        self.wsstate_load()
+
+        self.weights = dict()
+        self.scorer = sme_score.ScoreEngine(teh, self.weights, self.player_derived_get)
+        self.weights_load()
+
         # Load persistant/pilot data
-        self.persdata_filepath = "var/persdata.json"
+        self.flag_persdata_open = False
         self.flag_persdata_dirty = False
-        self.players = dict()
+        self.roster = sme_roster.Roster(len(teh.tech_keys))
+        self.roster.set_derived(derived_columns)
         self.persdata_load()
 
         # Even if a dev group is saved and loaded, we do not use it and we overwrite it.
         self.groups_protected = ["dev"]
-        self.groups_next_refresh_all = self.time_now
+        # Each group definition resolved to (member ids, role ids, named),
+        # and which groups each role is in. Kept current from guild events.
+        self.group_defs = dict()
+        self.groups_by_role = dict()
         self.group_set("dev", " ".join([f"<@!{mm}>" for mm in dev_author_list]))
 
-        self.messages_out = list()
+        self.stats = sme_stats.LatencyStats()
 
-        logger.debug(f"{ok_channels=}")
+        # Handlers queue their messages here and get on with it
+        self.dispatcher = dispatcher
+        if self.dispatcher is None:
+            self.dispatcher = sme_dispatch.OutboundDispatcher()
+        if self.dispatcher.stats is None:
+            self.dispatcher.stats = self.stats
 
-        self.weights = dict()
-        try:
-            with open("var/weights.json", "r") as fh:
-                loaded = json.load(fh)
-
-                if "weights" in loaded:
-                    self.weights = copy.copy(loaded["weights"])
-        except Exception:
-            logger.debug("Exception reading weights file")
+        logger.debug(f"{ok_channels=}")
 
         self.dev_parser = sme_paramparse.CommandParse(title="StatisticalMe Dev")
         self.dev_parser.add_command("info", False, self.dev_command_info)
         self.dev_parser.add_command("save", False, self.dev_command_save)
+        self.dev_parser.add_command("export", False, self.dev_command_export)
+        self.dev_parser.add_command("weights", False, self.dev_command_weights)
+        self.dev_parser.add_command("stats", False, self.dev_command_stats)
+        self.dev_parser.add_command("profile", False, self.dev_command_profile)
         self.dev_parser.add_command("roleprint", False, self.dev_command_roleprint)
         self.dev_parser.add_command("techlist", False, self.dev_command_techlist)
         self.dev_parser.add_command("purge1", False, self.dev_command_purge1)
@@ -157,6 +258,17 @@ class MainCommand:
         self.subparser_time.add_command("back", False, self.command_time_back)
         self.subparser_time.add_command("checkin", False, self.command_time_checkin)
 
+        self.subparser_alias = sme_paramparse.CommandParse(title="StatisticalMe alias")
+        self.subparser_alias.add_command(
+            "add", False, self.command_alias_add, auth_fn=self.auth_chief
+        )
+        self.subparser_alias.add_command(
+            "remove", False, self.command_alias_remove, auth_fn=self.auth_chief
+        )
+        self.subparser_alias.add_command(
+            "list", False, self.command_alias_list, auth_fn=self.auth_watcher
+        )
+
         self.subparser_pilot = sme_paramparse.CommandParse(title="StatisticalMe pilot")
         self.subparser_pilot.add_command("lastup", False, self.command_pilot_lastup)
 
@@ -178,6 +290,7 @@ class MainCommand:
         self.ord_parser.add_command(
             "pilot", True, self.subparser_pilot, auth_fn=self.auth_chief
         )
+        self.ord_parser.add_command("alias", True, self.subparser_alias)
         self.ord_parser.add_command(
             "score", False, self.command_score, auth_fn=self.auth_watcher
         )
@@ -188,138 +301,299 @@ class MainCommand:
             "clear", False, self.command_clear, auth_fn=self.auth_chief
         )
 
-        self.current_author = None
-        self.current_channel = None
-
         logger.info("object MainCommand built")
 
     def post_guild_init(self):
-        self.time_now = smer.sme_time_now()
+        self.time_now = self.time_source()
         self.group_refresh_all()
         self.opportunistic_save()
         self.opportunistic_background_update_start()
 
     def set_guild(self, p_guild):
         self.current_guild = p_guild
+        self.role_index.build(p_guild)
+        self.name_index.build(p_guild)
         self.post_guild_init()
 
     def config_load(self):
         try:
-            with open(self.config_filepath, "r") as fh:
-                loaded = json.load(fh)
+            loaded = self.storage.config_load()
 
-                if "groups" in loaded:
-                    self.groups = copy.copy(loaded["groups"])
+            if "groups" in loaded:
+                self.groups = copy.copy(loaded["groups"])
 
-                if "ws" in loaded:
-                    self.ws = copy.copy(loaded["ws"])
+                # Saved as lists
+                for grp in self.groups.values():
+                    grp["members"] = set(grp.get("members", list()))
 
-                self.flag_config_dirty = False
+            if "ws" in loaded:
+                self.ws = copy.copy(loaded["ws"])
+
+            if "aliases" in loaded:
+                self.aliases = copy.copy(loaded["aliases"])
+
+                for guild_key, guild_aliases in self.aliases.items():
+                    self.alias_router.set_guild_aliases(int(guild_key), guild_aliases)
+
+            self.flag_config_dirty = False
         except Exception:
             logger.debug("Exception reading config file")
 
-    def config_save(self):
-        with open(self.config_filepath, "w") as fh:
-            json.dump({"groups": self.groups, "ws": self.ws}, fh)
+    def weights_load(self):
+        try:
+            loaded = self.storage.weights_load()
 
-            self.flag_config_dirty = False
+            if "weights" in loaded:
+                self.weights = copy.copy(loaded["weights"])
+        except Exception:
+            logger.debug("Exception reading weights file")
 
-    def persdata_load(self):
+        self.scorer.set_weights(self.weights)
+
+    def wsstate_load(self):
         try:
-            with open(self.persdata_filepath, "r") as fh:
-                loaded = json.load(fh)
+            self.ws_state = copy.copy(self.storage.wsstate_load())
+        except Exception:
+            logger.debug("Exception reading ws state file")
 
-                ltk = loaded["tech_keys"]
+        # Older config kept board state in with each White Star
+        for ws_name, ws_struct in self.ws.items():
+            board = dict()
+            for key in ["message", "pilot_order", "old_content", "dirty"]:
+                if key in ws_struct:
+                    board[key] = ws_struct.pop(key)
+                    self.flag_config_dirty = True
+
+            if ws_name not in self.ws_state and (
+                "message" in board or "pilot_order" in board
+            ):
+                self.ws_state[ws_name] = {
+                    "message": board.get("message", 0),
+                    "pilot_order": board.get("pilot_order"),
+                }
+                self.flag_wsstate_dirty = True
 
-                if ltk == teh.tech_keys:
-                    self.players = copy.copy(loaded["players"])
-                else:
-                    logger.info("Massaging persistant data for new tech list")
+        if self.flag_config_dirty:
+            logger.info("Moved White Star board state out of config")
 
-                    self.players = dict()
-                    unk_tech = set()
+    def ws_board(self, ws_name):
+        if ws_name not in self.ws_state:
+            self.ws_state[ws_name] = {"message": 0, "pilot_order": None}
 
-                    for loaded_pkey, loaded_p in loaded["players"].items():
-                        self.players[loaded_pkey] = copy.copy(loaded_p)
+        return self.ws_state[ws_name]
 
-                        loaded_tech = self.players[loaded_pkey]["tech"]
-                        self.players[loaded_pkey]["tech"] = [0] * len(teh.tech_keys)
+    def ws_board_forget(self, ws_name):
+        self.ws_board_content.pop(ws_name, None)
 
-                        for index in range(len(loaded_tech)):
-                            key = ltk[index]
+        if self.ws_state.pop(ws_name, None) is not None:
+            self.flag_wsstate_dirty = True
 
-                            if teh.get_tech_index(key) >= 0:
-                                self.player_tech_set(
-                                    loaded_pkey, key, loaded_tech[index]
-                                )
-                            else:
-                                unk_tech.add(key)
+    def persdata_load(self):
+        flag_massaged = False
+
+        try:
+            loaded = self.storage.persdata_load(teh.tech_keys)
+
+            flag_snapshot = isinstance(loaded, sme_snapshot.SnapshotReader)
+            if flag_snapshot:
+                ltk = loaded.tech_keys
+            else:
+                ltk = loaded["tech_keys"]
+
+            remap = None
+            if ltk != teh.tech_keys:
+                logger.info("Massaging persistant data for new tech list")
 
-                    if len(unk_tech) > 0:
-                        logger.debug(f"Unknown techs {unk_tech} in persistant data")
+                remap = list()
+                unk_tech = set()
+
+                for index, key in enumerate(ltk):
+                    tech_index = teh.get_tech_index(key)
+
+                    if tech_index >= 0 and not teh.is_derived(key):
+                        remap.append((tech_index, index))
+                    else:
+                        unk_tech.add(key)
 
-                    self.persdata_save()
+                if len(unk_tech) > 0:
+                    logger.debug(f"Unknown techs {unk_tech} in persistant data")
 
-                self.flag_persdata_dirty = False
+                flag_massaged = True
+
+            if flag_snapshot:
+                self.roster = sme_roster.Roster.from_snapshot(
+                    len(teh.tech_keys), loaded, remap=remap
+                )
+            else:
+                self.roster = sme_roster.Roster.from_players(
+                    len(teh.tech_keys), loaded["players"], remap=remap
+                )
         except Exception:
             logger.debug("Exception reading persdata file")
-            self.players = dict()
+            self.roster = sme_roster.Roster(len(teh.tech_keys))
+
+        self.roster.set_derived(derived_columns)
+
+        # Changes made since the last snapshot. Storage is not open for records
+        # yet, so applying these does not record them again.
+        replay_count = 0
+        for record in self.storage.persdata_replay():
+            try:
+                self.persdata_record_apply(record)
+                replay_count += 1
+            except (KeyError, TypeError, ValueError):
+                logger.warning(f"Skipping bad journal record {record}")
+
+        if replay_count > 0:
+            logger.info(f"Replayed {replay_count} persistant data journal records")
+
+        self.storage.persdata_open()
+        self.flag_persdata_open = True
+
+        if flag_massaged or replay_count > 0:
+            self.persdata_save()
 
     def persdata_save(self):
-        with open(self.persdata_filepath, "w") as fh:
-            json.dump({"tech_keys": teh.tech_keys, "players": self.players}, fh)
+        # Only for before the event loop runs, otherwise use persist.flush()
+        self.flag_persdata_dirty = True
+        self.persist.flush_now(force=True)
+
+    def persdata_record(self, record):
+        if self.flag_persdata_open:
+            self.storage.persdata_record(record)
+
+        self.flag_persdata_dirty = True
+
+    def persdata_record_apply(self, record):
+        op = record["op"]
 
+        if op == "tech":
+            self.player_tech_set(record["pid"], record["key"], record["val"])
+        elif op == "info":
+            self.player_info_set(record["pid"], record["key"], record["val"])
+        elif op == "drop":
+            self.player_remove(record["pid"])
+        else:
+            raise ValueError(f"Unknown record op {op}")
+
+    def persist_snapshot(self, force):
+        writes = list()
+        flags = list()
+
+        if self.flag_config_dirty or force:
+            writes += self.storage.config_snapshot(
+                {
+                    "groups": self.groups_snapshot(),
+                    "ws": self.ws,
+                    "aliases": self.aliases,
+                }
+            )
+            self.flag_config_dirty = False
+            flags.append("config")
+
+        if force or (
+            self.flag_wsstate_dirty and self.wsstate_next_save <= self.time_now
+        ):
+            writes += self.storage.wsstate_snapshot(self.ws_state)
+            self.flag_wsstate_dirty = False
+            self.wsstate_next_save = self.time_now + self.wsstate_interval
+            flags.append("wsstate")
+
+        if force or (self.flag_persdata_dirty and self.storage.persdata_compact_due()):
+            writes += self.storage.persdata_snapshot(teh.tech_keys, self.roster)
             self.flag_persdata_dirty = False
+            flags.append("persdata")
+
+        return (writes, flags)
+
+    def persist_done(self, flags, ok):
+        self.storage.writes_done()
+
+        if flags is None:
+            # The snapshot failed part way, so any of it may be unsaved
+            flags = ["config", "wsstate", "persdata"]
+
+        if ok:
+            if "persdata" in flags:
+                self.storage.persdata_saved()
+        else:
+            # Try again next time around
+            if "config" in flags:
+                self.flag_config_dirty = True
+
+            if "wsstate" in flags:
+                self.flag_wsstate_dirty = True
+
+            if "persdata" in flags:
+                self.flag_persdata_dirty = True
 
     def opportunistic_save(self):
-        if self.flag_config_dirty:
-            self.config_save()
+        if (
+            self.flag_config_dirty
+            or (self.flag_wsstate_dirty and self.wsstate_next_save <= self.time_now)
+            or (self.flag_persdata_dirty and self.storage.persdata_compact_due())
+        ):
+            self.persist.request()
+
+    def players_not_updated_since(self, time_str):
+        updated = self.storage.players_updated_since(time_str)
+
+        found = list()
+        for pkey in self.roster:
+            if updated is None:
+                lup_str = self.player_info_get(pkey, "last_tech_update")
+                if lup_str is None or lup_str < time_str:
+                    found.append(pkey)
+            elif pkey not in updated:
+                found.append(pkey)
 
-        if self.flag_persdata_dirty:
-            self.persdata_save()
+        return found
+
+    def auth_level(self, ctx):
+        # Worked out once per request, however many parsers ask
+        if ctx.auth_level is None:
+            level = auth_level_none
+
+            if self.group_contains_member("dev", ctx.author.id):
+                level = auth_level_dev
+            elif self.group_contains_member("auth_chief", ctx.author.id):
+                level = auth_level_chief
+            elif self.group_contains_member("auth_watcher", ctx.author.id):
+                level = auth_level_watcher
 
-    def auth_dev(self):
-        return self.group_contains_member("dev", self.current_author.id)
+            ctx.auth_level = level
 
-    def auth_chief(self):
-        allowed = False
+        return ctx.auth_level
 
-        if self.auth_dev():
-            allowed = True
-        elif self.group_contains_member("auth_chief", self.current_author.id):
-            allowed = True
+    def auth_dev(self, ctx):
+        return self.auth_level(ctx) >= auth_level_dev
 
-        return allowed
+    def auth_chief(self, ctx):
+        return self.auth_level(ctx) >= auth_level_chief
 
-    def auth_watcher(self):
-        allowed = False
+    def auth_watcher(self, ctx):
+        return self.auth_level(ctx) >= auth_level_watcher
 
-        if self.auth_dev():
-            allowed = True
-        elif self.auth_chief():
-            allowed = True
-        elif self.group_contains_member("auth_watcher", self.current_author.id):
-            allowed = True
+    def request_context(self, p_author, p_channel):
+        self.time_now = self.time_source()
 
-        return allowed
+        return sme_context.RequestContext(
+            p_author, p_channel, self.current_guild, self.time_now
+        )
 
-    async def on_message(self, p_content, p_author, p_channel):
+    async def on_message(self, ctx, p_content):
         return_list = []
 
-        self.time_now = smer.sme_time_now()
-        self.current_author = p_author
-        self.current_channel = p_channel
+        time_start = time.perf_counter()
+        timed_before = sum(ctx.timings.values())
 
         try:
-            if self.groups_next_refresh_all < self.time_now:
-                self.group_refresh_all()
-
-            return_list = return_list + await self.ord_parser.do_command(p_content)
+            return_list = return_list + await self.ord_parser.do_command(ctx, p_content)
 
             if len(return_list) < 1:
-                if self.group_contains_member("dev", self.current_author.id):
+                if self.auth_dev(ctx):
                     return_list = ["Pardon, my liege?"]
-                elif self.group_contains_member("auth_chief", self.current_author.id):
+                elif self.auth_chief(ctx):
                     return_list = ["Excuse me chief?"]
                 else:
                     return_list = ["Say what?"]
@@ -333,56 +607,157 @@ class MainCommand:
             tbe = traceback.TracebackException(exc_type, exc_value, exc_tb)
             logger.error("on_message exception\n" + "".join(tbe.format()))
 
-            if self.group_contains_member("dev", self.current_author.id):
+            if self.auth_dev(ctx):
                 return_list = ["The sky fell, my liege"]
-            elif self.group_contains_member("auth_chief", self.current_author.id):
+            elif self.auth_chief(ctx):
                 return_list = ["Sorry about that chief"]
             else:
                 return_list = ["Oh crap"]
 
-        # Opportunistic send out messages queued
-        if len(self.messages_out) > 0:
-            await self.send_out_messages()
+        self.opportunistic_save()
 
-        self.current_author = None
-        self.current_channel = None
+        self.stats.record_request(
+            ctx, time.perf_counter() - time_start, timed_before=timed_before
+        )
 
-        self.opportunistic_save()
+        return return_list
+
+    def request_sent(self, ctx, secs):
+        ctx.add_time("send", secs)
+        self.stats.record(ctx.path_name(), "send", ctx.timings["send"])
+
+    def draw_table(self, ctx, header, data_align, data, flag_csv=False):
+        time_start = time.perf_counter()
+        return_list = sme_table.draw(
+            header, data_align, data, flag_csv=flag_csv, flag_attach=ctx.attach_ok
+        )
+        ctx.add_time("render", time.perf_counter() - time_start)
 
         return return_list
 
     def queue_msg_for_send_out(self, who_ob, msg_str):
-        self.messages_out.append((who_ob, msg_str))
+        if (who_ob is not None) and (msg_str is not None) and (len(msg_str) > 0):
+            self.dispatcher.enqueue(who_ob, msg_str)
 
-    async def send_out_messages(self):
-        while len(self.messages_out) > 0:
-            who_ob, msg_str = self.messages_out.pop()
-            if (who_ob is not None) and (msg_str is not None) and (len(msg_str) > 0):
-                await who_ob.send(msg_str)
-
-    async def dev_command_info(self, params):
+    async def dev_command_info(self, ctx, params):
         info_str = "StatisticalMe"
         info_str += "\nversion: 23.1.0"
         info_str += "\nnotes:"
         info_str += "\n  - discord.py 2.3"
         info_str += "\nuptime: {ut}".format(
-            ut=self.timedelta_as_string(self.time_now - self.time_up)
+            ut=self.timedelta_as_string(ctx.time_now - self.time_up)
         )
+        for ll in (
+            self.persist.info_lines()
+            + self.scorer.info_lines()
+            + self.role_index.info_lines()
+            + self.name_index.info_lines()
+            + self.dispatcher.info_lines()
+        ):
+            info_str += "\n" + ll
 
         return [info_str]
 
-    async def dev_command_save(self, params):
-        self.config_save()
-        self.persdata_save()
+    async def dev_command_save(self, ctx, params):
+        await self.persist.flush(force=True)
         return ["App and pilot data saved"]
 
-    async def dev_command_roleprint(self, params):
+    async def dev_command_export(self, ctx, params):
+        nbytes = await self.persist.write(
+            self.storage.persdata_export(teh.tech_keys, self.roster)
+        )
+        return [f"Pilot data exported as JSON, {nbytes} bytes"]
+
+    async def dev_command_weights(self, ctx, params):
+        self.weights_load()
+        return ["Weights reloaded: {}".format(", ".join(sorted(self.weights)))]
+
+    async def dev_command_stats(self, ctx, params):
+        return_list = []
+
+        if "reset" in params:
+            self.stats.reset()
+            return_list.append("Stats reset")
+        else:
+            rows = self.stats.rows()
+
+            if rows:
+                return_list += self.draw_table(
+                    ctx,
+                    ["Command", "phase", "n", "p50ms", "p95ms", "p99ms"],
+                    ["l", "l", "r", "r", "r", "r"],
+                    rows,
+                )
+            else:
+                return_list.append("No stats yet")
+
+        return return_list
+
+    async def dev_command_profile(self, ctx, params):
+        # Runs one command under cProfile, eg: !sme dev profile 30 score +detail
+        # Only imported here, so nothing else ever pays for it.
+        import cProfile
+        import pstats
+
+        return_list = []
+
+        top_n = 20
+        if len(params) > 0 and params[0].isdigit():
+            top_n = max(1, int(params[0]))
+            params = params[1:]
+
+        if len(params) < 1:
+            return ["Pardon my liege? Profile which command?"]
+
+        # The profiled command is not timed as part of this one
+        path_len = len(ctx.path)
+
+        profiler = cProfile.Profile()
+        time_start = time.perf_counter()
+        profiler.enable()
+        try:
+            command_list = await self.ord_parser.do_command(ctx, params)
+        finally:
+            profiler.disable()
+        time_total = time.perf_counter() - time_start
+
+        command_path = ".".join(ctx.path[path_len:]) or "-"
+        del ctx.path[path_len:]
+
+        pstat = pstats.Stats(profiler)
+        rows = list()
+        for func, (cc, nc, tt, ct, callers) in sorted(
+            pstat.stats.items(), key=lambda item: item[1][3], reverse=True
+        )[:top_n]:
+            filename, line, funcname = func
+            if line > 0:
+                func_str = f"{os.path.basename(filename)}:{line}({funcname})"
+            else:
+                func_str = funcname
+
+            ncalls = str(nc) if cc == nc else f"{nc}/{cc}"
+            rows.append([func_str, ncalls, f"{tt * 1000.0:.1f}", f"{ct * 1000.0:.1f}"])
+
+        return_list.append(
+            f"Profiled {command_path}: {time_total * 1000.0:.1f}ms,"
+            f" {len(command_list)} messages out"
+        )
+        return_list += self.draw_table(
+            ctx,
+            ["Function", "calls", "totms", "cumms"],
+            ["l", "r", "r", "r"],
+            rows,
+        )
+
+        return return_list
+
+    async def dev_command_roleprint(self, ctx, params):
         return_list = []
 
         who_list = list()
         role_list = list()
         return_list = return_list + self.parse_who(
-            params, who_list, role_list=role_list
+            params, who_list, role_list=role_list, ctx=ctx
         )
 
         if len(role_list) > 0:
@@ -395,7 +770,8 @@ class MainCommand:
                 if role is not None:
                     msg_list.append(f"  name: {role.name}")
                     member_names = [
-                        self.member_name_from_id(memb.id) for memb in role.members
+                        self.member_name_from_id(memb_id)
+                        for memb_id in self.role_index.member_ids(role.id)
                     ]
                     msg_list.append("  members: " + ", ".join(member_names))
 
@@ -405,12 +781,12 @@ class MainCommand:
 
         return return_list
 
-    async def dev_command_techlist(self, params):
+    async def dev_command_techlist(self, ctx, params):
         return ["Valid tech names: " + ", ".join(teh.tech_keys)]
 
-    async def dev_command_purge1(self, params):
+    async def dev_command_purge1(self, ctx, params):
         delete_player_list = list()
-        len_all = len(self.players)
+        len_all = len(self.roster)
 
         flag_yes = False
         flag_name = False
@@ -421,10 +797,10 @@ class MainCommand:
         if "--name" in params:
             flag_name = True
 
-        for pkey, pdata in self.players.items():
+        for pkey in self.roster:
             flag_remove = True
 
-            if pdata["tech"] != [0] * len(teh.tech_keys):
+            if any(self.roster.tech_row(self.roster.row_of(pkey))):
                 flag_remove = False
 
             # ii = pdata["info"]
@@ -449,12 +825,15 @@ class MainCommand:
 
             if flag_yes:
                 for pkey in delete_player_list:
-                    del self.players[pkey]
+                    self.player_remove(pkey)
 
         return [return_str]
 
-    async def dev_command_quit(self, params):
-        self.opportunistic_save()
+    async def dev_command_quit(self, ctx, params):
+        # Board state too, even if not due
+        self.wsstate_next_save = ctx.time_now
+        await self.persist.flush()
+        await self.dispatcher.drain(timeout=10.0)
         return ["dented-control-message:quit"]
 
     def member_from_id(self, p_id):
@@ -468,18 +847,7 @@ class MainCommand:
         return memb
 
     def member_name_from_id(self, p_id):
-        name = None
-
-        memb = self.member_from_id(p_id)
-
-        if memb is not None:
-            try:
-                name = memb.nick
-            except AttributeError:
-                pass
-
-            if name is None:
-                name = memb.name
+        name = self.name_index.display_name(int(p_id))
 
         if name is None:
             name = ""
@@ -489,11 +857,32 @@ class MainCommand:
     def member_from_name(self, p_name):
         memb = None
 
-        if self.current_guild is not None:
-            memb = self.current_guild.get_member_named(str(p_name))
+        memb_id = self.name_index.resolve(str(p_name))
+        if memb_id is not None:
+            memb = self.member_from_id(memb_id)
 
         return memb
 
+    def member_not_found(self, p_name):
+        r_str = f"Member {p_name} not found"
+
+        suggest_list = self.name_index.suggest(str(p_name))
+        if len(suggest_list) < 1:
+            # Ambiguous prefixes are near misses too
+            suggest_list = sorted(
+                [
+                    self.member_name_from_id(memb_id)
+                    for memb_id in self.name_index.prefix(str(p_name), limit=5)
+                ]
+            )
+
+        if len(suggest_list) > 0:
+            r_str += ", did you mean " + ", ".join(
+                ["?!" + name for name in suggest_list]
+            )
+
+        return r_str
+
     def role_from_id(self, p_id):
         role = None
 
@@ -511,13 +900,14 @@ class MainCommand:
         return role
 
     def group_set(self, group_name, group_def):
-        self.groups[group_name] = {"defn": str(group_def), "members": list()}
+        self.groups[group_name] = {"defn": str(group_def), "members": set()}
 
         self.group_refresh(group_name)
 
     def group_remove(self, group_name):
         if group_name in self.groups:
             del self.groups[group_name]
+            self.group_index_set(group_name, None)
 
     def group_exists(self, group_name):
         found = False
@@ -526,27 +916,173 @@ class MainCommand:
 
         return found
 
+    def group_index_set(self, group_name, group_def):
+        old_def = self.group_defs.pop(group_name, None)
+        if old_def is not None:
+            for role_id in old_def[1]:
+                names = self.groups_by_role[role_id]
+                names.discard(group_name)
+                if len(names) < 1:
+                    del self.groups_by_role[role_id]
+
+        if group_def is not None:
+            self.group_defs[group_name] = group_def
+            for role_id in group_def[1]:
+                self.groups_by_role.setdefault(role_id, set()).add(group_name)
+
+    def group_members_build(self, group_name, grp):
+        # Returns True if the members changed
+        if group_name == "dev":
+            group_def = (set(self.dev_author_list), set(), False)
+            members = set(self.dev_author_list)
+        else:
+            tokens = grp["defn"].split(" ")
+            memb_list = list()
+            role_list = list()
+            self.parse_who(tokens, list(), memb_list=memb_list, role_list=role_list)
+
+            # Mentioned members count even while not in the guild, so they
+            # are back in on rejoining
+            memb_ids = set(memb_list)
+            for tt in tokens:
+                if (
+                    tt[0:2] == "<@"
+                    and tt[-1:] == ">"
+                    and tt[2:-1].lstrip("!").isdigit()
+                ):
+                    memb_ids.add(int(tt[2:-1].lstrip("!")))
+
+            # Name tokens can resolve differently after a rename
+            named = any([tt[0:2] in ["?!", "?&"] for tt in tokens])
+            group_def = (memb_ids, set(role_list), named)
+
+            members = set(memb_list)
+            for role_id in role_list:
+                members.update(self.role_index.member_ids(role_id))
+
+            self.roster.ensure_rows([str(memb_id) for memb_id in members])
+
+        self.group_index_set(group_name, group_def)
+
+        flag_changed = members != grp["members"]
+        grp["members"] = members
+
+        return flag_changed
+
     def group_refresh(self, group_name):
         if group_name in self.groups:
-            grp = self.groups[group_name]
-            if group_name == "dev":
-                grp["members"] = copy.copy(self.dev_author_list)
-            else:
-                grp["members"] = list()
-                self.parse_who(grp["defn"].split(" "), grp["members"])
-
-            self.flag_config_dirty = True
+            if self.group_members_build(group_name, self.groups[group_name]):
+                self.flag_config_dirty = True
 
     def group_refresh_all(self):
+        # Only on startup, or after something events can not follow
         for group_name, grp in self.groups.items():
-            if group_name == "dev":
-                grp["members"] = copy.copy(self.dev_author_list)
-            else:
-                grp["members"] = list()
-                self.parse_who(grp["defn"].split(" "), grp["members"])
+            if self.group_members_build(group_name, grp):
+                self.flag_config_dirty = True
+
+    def group_refresh_named(self):
+        for group_name, group_def in list(self.group_defs.items()):
+            if group_def[2]:
+                self.group_refresh(group_name)
+
+    def group_member_add(self, group_name, memb_id):
+        members = self.groups[group_name]["members"]
+
+        if memb_id not in members:
+            members.add(memb_id)
+            if str(memb_id) not in self.roster:
+                self.ensure_player_created(memb_id)
+
+            self.flag_config_dirty = True
+
+    def group_member_discard(self, group_name, memb_id):
+        members = self.groups[group_name]["members"]
+
+        if memb_id in members:
+            members.discard(memb_id)
+            self.flag_config_dirty = True
+
+    def is_current_guild(self, guild):
+        return self.current_guild is not None and guild.id == self.current_guild.id
+
+    def member_update(self, before, after):
+        # Gateway event, changes to a member's roles or names
+        if not self.is_current_guild(after.guild):
+            return
 
-        self.flag_config_dirty = True
-        self.groups_next_refresh_all = self.time_now + 20
+        roles_before = set([role.id for role in before.roles])
+        roles_after = set([role.id for role in after.roles])
+
+        self.role_index.member_update(after.id, roles_before, roles_after)
+
+        for role_id in roles_after - roles_before:
+            for group_name in list(self.groups_by_role.get(role_id, ())):
+                self.group_member_add(group_name, after.id)
+
+        for role_id in roles_before - roles_after:
+            for group_name in list(self.groups_by_role.get(role_id, ())):
+                memb_ids, role_ids, _ = self.group_defs[group_name]
+                if after.id not in memb_ids and roles_after.isdisjoint(role_ids):
+                    self.group_member_discard(group_name, after.id)
+
+        if before.name != after.name or before.nick != after.nick:
+            self.name_index.member_set(after)
+            self.group_refresh_named()
+
+    def user_update(self, before, after):
+        # Gateway event, changes to account names. Not per guild.
+        memb = self.member_from_id(after.id)
+
+        if memb is not None:
+            self.name_index.member_set(memb)
+            self.group_refresh_named()
+
+    def member_join(self, member):
+        if not self.is_current_guild(member.guild):
+            return
+
+        role_ids = set([role.id for role in member.roles])
+        self.role_index.member_join(member.id, role_ids)
+        self.name_index.member_set(member)
+
+        for group_name, group_def in list(self.group_defs.items()):
+            if group_name != "dev" and (
+                member.id in group_def[0] or not role_ids.isdisjoint(group_def[1])
+            ):
+                self.group_member_add(group_name, member.id)
+
+        self.group_refresh_named()
+
+    def member_remove(self, member):
+        if not self.is_current_guild(member.guild):
+            return
+
+        self.role_index.member_remove(
+            member.id, set([role.id for role in member.roles])
+        )
+        self.name_index.member_remove(member.id)
+
+        for group_name in list(self.group_defs):
+            if group_name != "dev":
+                self.group_member_discard(group_name, member.id)
+
+    def role_create(self, role):
+        if self.is_current_guild(role.guild):
+            self.role_index.role_create(role.id)
+            self.group_refresh_named()
+
+    def role_update(self, before, after):
+        if self.is_current_guild(after.guild) and before.name != after.name:
+            self.group_refresh_named()
+
+    def role_delete(self, role):
+        if self.is_current_guild(role.guild):
+            self.role_index.role_delete(role.id)
+
+            for group_name in list(self.groups_by_role.get(role.id, ())):
+                self.group_refresh(group_name)
+
+            self.group_refresh_named()
 
     def group_contains_member(self, group_name, memb_id):
         found = False
@@ -557,94 +1093,122 @@ class MainCommand:
 
         return found
 
+    def groups_snapshot(self):
+        # Members are sets here, lists when saved
+        return {
+            group_name: {"defn": grp["defn"], "members": sorted(grp["members"])}
+            for group_name, grp in self.groups.items()
+        }
+
     def parse_who(
-        self, param_list, who_list, memb_list=None, role_list=None, other=None
+        self,
+        param_list,
+        who_list,
+        memb_list=None,
+        role_list=None,
+        other=None,
+        ctx=None,
     ):
         return_list = []
+        time_start = time.perf_counter()
 
-        who_set = list()
+        who_set = self.who_resolve(
+            param_list, return_list, memb_list, role_list, other, ctx
+        )
+        self.who_ensure(who_set, who_list, ctx)
+
+        if ctx is not None:
+            ctx.add_time("parse", time.perf_counter() - time_start)
+
+        return return_list
+
+    def who_resolve(
+        self,
+        param_list,
+        return_list,
+        memb_list=None,
+        role_list=None,
+        other=None,
+        ctx=None,
+    ):
+        # Member ids from mentions and names, in a dict used as an ordered
+        # set. Roles are added a whole role at a time.
+        time_start = time.perf_counter()
+
+        who_set = dict()
+        memb_set = None
+        role_set = None
+
+        if memb_list is not None:
+            memb_set = dict.fromkeys(memb_list)
+            memb_count = len(memb_set)
+        if role_list is not None:
+            role_set = dict.fromkeys(role_list)
+            role_count = len(role_set)
 
         for value in param_list:
+            memb = None
+            role = None
+
             if value[0:3] == "<@!" and value[3].isdigit() and value[-1] == ">":
                 memb = self.member_from_id(int(value[3:-1]))
-                if memb is not None:
-                    if memb_list is not None:
-                        if memb.id not in memb_list:
-                            memb_list.append(memb.id)
-                    else:
-                        if memb.id not in who_set:
-                            who_set.append(memb.id)
             elif value[0:2] == "<@" and value[2].isdigit() and value[-1] == ">":
                 memb = self.member_from_id(int(value[2:-1]))
-                if memb is not None:
-                    if memb_list is not None:
-                        if memb.id not in memb_list:
-                            memb_list.append(memb.id)
-                    else:
-                        if memb.id not in who_set:
-                            who_set.append(memb.id)
             elif value[0:3] == "<@&" and value[3].isdigit() and value[-1] == ">":
                 role = self.role_from_id(int(value[3:-1]))
-                if role is not None:
-                    if role_list is not None:
-                        if role.id not in role_list:
-                            role_list.append(role.id)
-                    else:
-                        for memb in role.members:
-                            if memb.id not in who_set:
-                                who_set.append(memb.id)
             elif value[0:2] == "?!":
                 memb = self.member_from_name(value[2:])
-                if memb is not None:
-                    if memb_list is not None:
-                        if memb.id not in memb_list:
-                            memb_list.append(memb.id)
-                    else:
-                        if memb.id not in who_set:
-                            who_set.append(memb.id)
+                if memb is None:
+                    return_list.append(self.member_not_found(value[2:]))
             elif value[0:2] == "?&":
                 role = self.role_from_name(value[2:])
-                if role is not None:
-                    if role_list is not None:
-                        if role.id not in role_list:
-                            role_list.append(role.id)
-                    else:
-                        for memb in role.members:
-                            if memb.id not in who_set:
-                                who_set.append(memb.id)
             else:
                 if other is not None:
                     other.append(value)
 
-        # People
-        for who in who_set:
-            if str(who) not in self.players:
-                self.ensure_player_created(who)
+            if memb is not None:
+                if memb_set is not None:
+                    memb_set[memb.id] = None
+                else:
+                    who_set[memb.id] = None
+            elif role is not None:
+                if role_set is not None:
+                    role_set[role.id] = None
+                else:
+                    who_set.update(dict.fromkeys(self.role_index.member_ids(role.id)))
+
+        if memb_set is not None:
+            memb_list.extend(list(memb_set)[memb_count:])
+        if role_set is not None:
+            role_list.extend(list(role_set)[role_count:])
 
-            who_list.append(who)
+        if ctx is not None:
+            ctx.add_time("parse.who", time.perf_counter() - time_start)
 
-        # logger.debug(f"parse_who() return_list {return_list}")
-        # logger.debug(f"parse_who() who_list {who_list}")
-        # if memb_list is not None:
-        #     logger.debug(f"parse_who() memb_list {memb_list}")
-        # if role_list is not None:
-        #     logger.debug(f"parse_who() role_list {role_list}")
-        # if other is not None:
-        #     logger.debug(f"parse_who() other {other}")
+        return who_set
 
-        return return_list
+    def who_ensure(self, who_set, who_list, ctx=None):
+        # People, with rows made for any not seen before all at once
+        time_start = time.perf_counter()
+
+        self.roster.ensure_rows([str(who) for who in who_set])
+        who_list.extend(who_set)
 
-    def parse_who_what_int(self, param_list, who_list, what_list, int_list, other=None):
+        if ctx is not None:
+            ctx.add_time("parse.players", time.perf_counter() - time_start)
+
+    def parse_who_what_int(
+        self, param_list, who_list, what_list, int_list, other=None, ctx=None
+    ):
         return_list = []
+        time_start = time.perf_counter()
 
-        who_set = list()
         other_list = list()
 
-        return_list = return_list + self.parse_who(
-            param_list, who_set, other=other_list
-        )
+        who_set = self.who_resolve(param_list, return_list, other=other_list, ctx=ctx)
 
-        what_set = list()
+        time_what = time.perf_counter()
+        what_set = dict()
 
         for value in other_list:
             if is_int(value):
@@ -655,23 +1219,13 @@ class MainCommand:
                 what = smer.sme_utils_normalize_caseless(value)
                 what_rangelist = teh.tech_key_range_list(what)
                 if what_rangelist:
-                    for tt in what_rangelist:
-                        if tt not in what_set:
-                            what_set.append(tt)
+                    what_set.update(dict.fromkeys(what_rangelist))
                 else:
                     if what[0:2] == "--" or what[0:1] == "+":
                         if other is not None:
                             other.append(what)
                     else:
-                        if what not in what_set:
-                            what_set.append(what)
-
-        # People
-        for who in who_set:
-            if str(who) not in self.players:
-                self.ensure_player_created(who)
-
-            who_list.append(who)
+                        what_set[what] = None
 
         # Tech
         for what in what_set:
@@ -680,92 +1234,76 @@ class MainCommand:
             else:
                 return_list.append(f"Tech {what} not found")
 
-        # logger.debug(f"parse_who_what_int() return_list {return_list}")
-        # logger.debug(f"parse_who_what_int() who_list {who_list}")
-        # logger.debug(f"parse_who_what_int() what_list {what_list}")
-        # logger.debug(f"parse_who_what_int() int_list {int_list}")
-        # if other is not None:
-        #     logger.debug(f"parse_who_what_int() other {other}")
+        if ctx is not None:
+            ctx.add_time("parse.what", time.perf_counter() - time_what)
+
+        self.who_ensure(who_set, who_list, ctx)
+
+        if ctx is not None:
+            ctx.add_time("parse", time.perf_counter() - time_start)
 
         return return_list
 
     def ensure_player_created(self, p_playerid):
-        playerid = str(p_playerid)
-        if playerid not in self.players:
-            self.players[playerid] = {"tech": [0] * len(teh.tech_keys), "info": dict()}
+        return self.roster.ensure_row(str(p_playerid))
 
     def player_tech_get(self, p_playerid, techname):
-        playerid = str(p_playerid)
+        row = self.roster.row_of(str(p_playerid))
         r_value = 0
 
-        if playerid in self.players:
-            p = self.players[playerid]
-
-            if "tech" in p:
-                pt = p["tech"]
+        if row >= 0:
+            tech_index = teh.get_tech_index(techname)
 
-                if techname == "relics" or techname == "totalcargo":
-                    ti_cbe = teh.get_tech_index("cargobayextension")
-                    ti_ts = teh.get_tech_index("transport")
-
-                    if ti_cbe >= 0 and ti_ts >= 0:
-                        totalcargo = 0
-                        val_cbe = pt[ti_cbe]
-                        if val_cbe > 0 and val_cbe <= 12:
-                            score_cbe = [1, 2, 3, 5, 7, 9, 12, 15, 19, 25, 31, 52]
-                            totalcargo += score_cbe[val_cbe - 1]
-
-                        val_ts = pt[ti_ts]
-                        if val_ts > 0 and val_ts <= 6:
-                            score_ts = [1, 2, 3, 4, 5, 8]
-                            totalcargo += score_ts[val_ts - 1]
-
-                        r_value = int(totalcargo)
-                        if techname == "relics":
-                            r_value = int(totalcargo / 4)
-                else:
-                    tech_index = teh.get_tech_index(techname)
-
-                    if tech_index >= 0:
-                        r_value = pt[tech_index]
+            if teh.is_derived(techname):
+                r_value = self.roster.derived_get(row, techname)
+            elif tech_index >= 0:
+                r_value = self.roster.tech_get(row, tech_index)
 
         return r_value
 
+    def player_derived_get(self, row, techname):
+        return self.roster.derived_get(row, techname)
+
     def player_tech_set(self, p_playerid, techname, techvalue):
         playerid = str(p_playerid)
         tech_index = teh.get_tech_index(techname)
 
-        if tech_index >= 0 and tech_index < 9900:
-            self.ensure_player_created(playerid)
-            pt = self.players[playerid]["tech"]
-            pt[tech_index] = int(techvalue)
-
-            self.flag_persdata_dirty = True
+        if tech_index >= 0 and not teh.is_derived(techname):
+            row = self.ensure_player_created(playerid)
+            self.roster.tech_set(row, tech_index, sme_roster.clamp_level(techvalue))
+            self.scorer.invalidate(playerid)
+
+            self.persdata_record(
+                {
+                    "op": "tech",
+                    "pid": playerid,
+                    "key": teh.tech_keys[tech_index],
+                    "val": sme_roster.clamp_level(techvalue),
+                }
+            )
 
     def player_info_get(self, p_playerid, infoname):
-        playerid = str(p_playerid)
-        r_value = None
-
-        if playerid in self.players:
-            p = self.players[playerid]
-
-            if "info" in p:
-                pi = p["info"]
+        return self.roster.info_get(self.roster.row_of(str(p_playerid)), infoname)
 
-                if infoname in pi:
-                    r_value = pi[infoname]
+    def player_info_set(self, p_playerid, infoname, infovalue):
+        playerid = str(p_playerid)
+        row = self.ensure_player_created(playerid)
+        self.roster.info_set(row, infoname, infovalue)
 
-        return r_value
+        self.persdata_record(
+            {"op": "info", "pid": playerid, "key": infoname, "val": infovalue}
+        )
 
-    def player_info_set(self, p_playerid, infoname, infovalue):
+    def player_remove(self, p_playerid):
         playerid = str(p_playerid)
-        self.ensure_player_created(playerid)
-        pi = self.players[playerid]["info"]
-        pi[infoname] = infovalue
 
-        self.flag_persdata_dirty = True
+        if playerid in self.roster:
+            self.roster.remove(playerid)
+            self.scorer.invalidate(playerid)
 
-    async def command_group_add(self, params):
+            self.persdata_record({"op": "drop", "pid": playerid})
+
+    async def command_group_add(self, ctx, params):
         return_list = []
 
         who_list_scratch = list()
@@ -778,6 +1316,7 @@ class MainCommand:
             memb_list=memb_list,
             role_list=role_list,
             other=other_list,
+            ctx=ctx,
         )
 
         if other_list and (memb_list or role_list):
@@ -796,7 +1335,7 @@ class MainCommand:
 
         return return_list
 
-    async def command_group_remove(self, params):
+    async def command_group_remove(self, ctx, params):
         return_list = []
 
         if params:
@@ -809,7 +1348,7 @@ class MainCommand:
 
         return return_list
 
-    async def command_group_list(self, params):
+    async def command_group_list(self, ctx, params):
         return_list = []
 
         group_strs = list()
@@ -823,6 +1362,7 @@ class MainCommand:
                 who_list_scratch,
                 memb_list=memb_list,
                 role_list=role_list,
+                ctx=ctx,
             )
 
             group_strs.append(
@@ -839,7 +1379,86 @@ class MainCommand:
 
         return return_list
 
-    async def command_rolemem_add(self, params):
+    async def command_alias_add(self, ctx, params):
+        return_list = []
+
+        if len(params) >= 2:
+            alias_name = params[0].lstrip("!").lower()
+            pre_list = params[1:]
+
+            if not self.alias_router.is_alias_name_ok(alias_name):
+                return_list.append(
+                    f"Crap: Alias name {alias_name} is taken or is not lowercase"
+                    " letters and digits"
+                )
+            elif (
+                smer.sme_utils_normalize_caseless(pre_list[0])
+                not in self.ord_parser.params
+            ):
+                return_list.append(
+                    "Crap: Alias must start with one of {}".format(
+                        list(self.ord_parser.params)
+                    )
+                )
+            else:
+                guild_key = str(self.current_guild.id)
+                guild_aliases = self.aliases.setdefault(guild_key, dict())
+                guild_aliases[alias_name] = pre_list
+                self.alias_router.set_guild_aliases(
+                    self.current_guild.id, guild_aliases
+                )
+                self.flag_config_dirty = True
+
+                return_list.append(f"Alias !{alias_name} is: {' '.join(pre_list)}")
+        else:
+            return_list.append("Crap: Need an alias name and a command")
+
+        return return_list
+
+    async def command_alias_remove(self, ctx, params):
+        return_list = []
+
+        guild_key = str(self.current_guild.id)
+        guild_aliases = self.aliases.get(guild_key, dict())
+
+        for pp in params:
+            alias_name = pp.lstrip("!").lower()
+
+            if alias_name in guild_aliases:
+                del guild_aliases[alias_name]
+                return_list.append(f"Alias !{alias_name} removed")
+                self.flag_config_dirty = True
+            else:
+                return_list.append(f"Crap: No alias !{alias_name}")
+
+        if len(guild_aliases) < 1:
+            self.aliases.pop(guild_key, None)
+
+        self.alias_router.set_guild_aliases(self.current_guild.id, guild_aliases)
+
+        return return_list
+
+    async def command_alias_list(self, ctx, params):
+        return_list = []
+
+        guild_aliases = self.aliases.get(str(self.current_guild.id), dict())
+
+        if guild_aliases:
+            return_list += self.draw_table(
+                ctx,
+                ["Alias", "Command"],
+                ["l", "l"],
+                [
+                    [f"!{alias_name}", " ".join(pre_list)]
+                    for alias_name, pre_list in sorted(guild_aliases.items())
+                ],
+            )
+        else:
+            return_list.append("No aliases")
+
+        return return_list
+
+    async def command_rolemem_add(self, ctx, params):
         return_list = []
 
         who_list_scratch = list()
@@ -850,6 +1469,7 @@ class MainCommand:
             who_list_scratch,
             memb_list=memb_list,
             role_list=role_list,
+            ctx=ctx,
         )
 
         if len(role_list) > 0 and len(memb_list) > 0:
@@ -886,7 +1506,12 @@ class MainCommand:
                         msg_list.append(f"Role: {role.name}")
                         msg_list.append(
                             "  members: "
-                            + " ".join([f"<@!{memb.id}>" for memb in role.members])
+                            + " ".join(
+                                [
+                                    f"<@!{memb_id}>"
+                                    for memb_id in self.role_index.member_ids(role.id)
+                                ]
+                            )
                         )
 
                 return_list.append("\n".join(msg_list))
@@ -897,7 +1522,7 @@ class MainCommand:
 
         return return_list
 
-    async def command_rolemem_remove(self, params):
+    async def command_rolemem_remove(self, ctx, params):
         return_list = []
 
         who_list_scratch = list()
@@ -908,6 +1533,7 @@ class MainCommand:
             who_list_scratch,
             memb_list=memb_list,
             role_list=role_list,
+            ctx=ctx,
         )
 
         if len(role_list) > 0 and len(memb_list) > 0:
@@ -940,7 +1566,7 @@ class MainCommand:
 
         return return_list
 
-    async def command_rolemem_list(self, params):
+    async def command_rolemem_list(self, ctx, params):
         return_list = []
 
         who_list_scratch = list()
@@ -949,6 +1575,7 @@ class MainCommand:
             params,
             who_list_scratch,
             role_list=role_list,
+            ctx=ctx,
         )
 
         if len(role_list) > 0:
@@ -958,7 +1585,8 @@ class MainCommand:
                 if role is not None:
                     msg_list.append(f"Role: {role.name}")
                     member_names = [
-                        self.member_name_from_id(memb.id) for memb in role.members
+                        self.member_name_from_id(memb_id)
+                        for memb_id in self.role_index.member_ids(role.id)
                     ]
                     member_names.sort()
                     msg_list.append("  members: " + ", ".join(member_names))
@@ -1087,7 +1715,11 @@ class MainCommand:
         return needed
 
     def opportunistic_background_update_start(self):
-        if not self.background_update_started and self.test_background_update_needed():
+        if (
+            self.background_autostart
+            and not self.background_update_started
+            and self.test_background_update_needed()
+        ):
             self.background_update_all.start()
             self.background_update_started = True
 
@@ -1100,7 +1732,11 @@ class MainCommand:
     async def background_update_all(self):
         # logger.debug('MEGAFONE background_update_all, counts: ws {wc}'.format(wc=len(self.ws)))
 
-        self.time_now = smer.sme_time_now()
+        time_start = time.perf_counter()
+        ctx = self.request_context(None, None)
+        ctx.path.append("background")
+        # Boards are built from table text
+        ctx.attach_ok = False
 
         # Update WhiteStars
         ws_over = list()
@@ -1112,14 +1748,14 @@ class MainCommand:
 
                     ws_time_str = ""
 
-                    if (nova_time + 30) < self.time_now:
+                    if (nova_time + 30) < ctx.time_now:
                         ws_struct["done"] = True
                         self.flag_config_dirty = True
                         ws_time_str = "over"
                         ws_over.append(ws_name)
                     else:
                         # Resolves to a minute, so add 30s here to cause a round up.
-                        ws_time = nova_time + 30 - self.time_now
+                        ws_time = nova_time + 30 - ctx.time_now
                         ws_time_str = self.timedelta_as_string(ws_time)
 
                     new_content = f"```\nNova time {ws_time_str}\n"
@@ -1142,33 +1778,33 @@ class MainCommand:
 
                         new_content += ", ".join(role_list) + "\n"
 
+                    ws_board = self.ws_board(ws_name)
+
                     if all_role > 0:
                         all_role_str = f"<@&{all_role}>"
 
                         newcont2 = await self.command_time_list(
-                            [all_role_str], ws_info=ws_struct
+                            ctx, [all_role_str], ws_info=ws_struct, ws_board=ws_board
                         )
                         if newcont2 and newcont2[0][:3] == "```":
                             new_content += newcont2[0][3:-3]
 
                         newcont2 = self.nicommand_ws_shiplist(
-                            [all_role_str], ws_info=ws_struct
+                            ctx, [all_role_str], ws_info=ws_struct, ws_board=ws_board
                         )
                         if newcont2 and newcont2[0][:3] == "```":
                             new_content += newcont2[0][3:-3]
 
                     new_content += "```"
 
-                    if (
-                        "old_content" not in ws_struct
-                        or new_content != ws_struct["old_content"]
-                    ):
-                        ws_struct["old_content"] = new_content
-                        self.flag_config_dirty = True
+                    if new_content != self.ws_board_content.get(ws_name):
+                        self.ws_board_content[ws_name] = new_content
 
                         chan_ob = self.current_guild.get_channel(ws_struct["channel"])
                         if chan_ob is not None:
-                            msg_id = ws_struct["message"]
+                            time_send = time.perf_counter()
+
+                            msg_id = ws_board["message"]
 
                             msg_ob = None
                             if msg_id > 0:
@@ -1180,14 +1816,12 @@ class MainCommand:
                             if msg_ob is None:
                                 msg_ob = await chan_ob.send(new_content)
                                 msg_id = msg_ob.id
-                                ws_struct["message"] = msg_id
-                                self.flag_config_dirty = True
+                                ws_board["message"] = msg_id
+                                self.flag_wsstate_dirty = True
                             else:
                                 await msg_ob.edit(content=new_content)
 
-                            if "dirty" in ws_struct:
-                                del ws_struct["dirty"]
-                                self.flag_config_dirty = True
+                            ctx.add_time("send", time.perf_counter() - time_send)
                         else:
                             ws_struct["done"] = True
                             self.flag_config_dirty = True
@@ -1217,22 +1851,24 @@ class MainCommand:
                     + "".join(tbe.format())
                 )
 
-        # Opportunistic send out messages queued
-        if len(self.messages_out) > 0:
-            await self.send_out_messages()
-
         self.opportunistic_save()
 
-    async def command_ws_add(self, params):
+        self.stats.record_request(ctx, time.perf_counter() - time_start)
+        if "send" in ctx.timings:
+            self.request_sent(ctx, 0.0)
+
+    async def command_ws_add(self, ctx, params):
         return_list = []
 
         who_list_scratch = list()
         other_list = list()
         role_list = list()
-        self.parse_who(params, who_list_scratch, role_list=role_list, other=other_list)
+        self.parse_who(
+            params, who_list_scratch, role_list=role_list, other=other_list, ctx=ctx
+        )
 
         ws_name = None
-        wsname_match = self.ws_name_match.search(str(self.current_channel))
+        wsname_match = self.ws_name_match.search(str(ctx.channel))
 
         if other_list and wsname_match:
             ws_name = wsname_match.group(1)
@@ -1255,7 +1891,7 @@ class MainCommand:
                 if len(role_list) >= 2:
                     all_role = role_list[1]
 
-                nova_time = self.time_now + nova_timedelta
+                nova_time = ctx.time_now + nova_timedelta
 
                 self.ws[ws_name] = {
                     # inputs
@@ -1263,14 +1899,13 @@ class MainCommand:
                     "all_role": all_role,
                     "nova_time": smer.sme_time_as_string(int(nova_time)),
                     # other state
-                    "old_content": "",
                     "assist_group": assist_group,
-                    "channel": self.current_channel.id,
-                    "message": 0,
+                    "channel": ctx.channel.id,
                     "greens": {},
                     "reds": {},
                     "done": False,
                 }
+                self.ws_board_forget(ws_name)
 
                 return_list.append(f"WhiteStar {ws_name} added")
                 self.flag_config_dirty = True
@@ -1279,15 +1914,15 @@ class MainCommand:
 
         return return_list
 
-    async def command_ws_remove(self, params):
+    async def command_ws_remove(self, ctx, params):
         return_list = []
 
         who_list_scratch = list()
         role_list = list()
-        self.parse_who(params, who_list_scratch, role_list=role_list)
+        self.parse_who(params, who_list_scratch, role_list=role_list, ctx=ctx)
 
         ws_name = None
-        wsname_match = self.ws_name_match.search(str(self.current_channel))
+        wsname_match = self.ws_name_match.search(str(ctx.channel))
 
         if wsname_match:
             ws_name = wsname_match.group(1)
@@ -1303,6 +1938,7 @@ class MainCommand:
             self.group_remove(ws_struct["assist_group"])
 
             del self.ws[ws_name]
+            self.ws_board_forget(ws_name)
 
             self.opportunistic_background_update_stop()
 
@@ -1311,7 +1947,7 @@ class MainCommand:
 
         return return_list
 
-    async def command_ws_list(self, params):
+    async def command_ws_list(self, ctx, params):
         ws_strlist = []
 
         for ws_name, ws_struct in self.ws.items():
@@ -1321,11 +1957,11 @@ class MainCommand:
 
             ws_time_str = ""
 
-            if (nova_time + 30) < self.time_now:
+            if (nova_time + 30) < ctx.time_now:
                 ws_time_str = "over"
             else:
                 # Resolves to a minute, so add 30s here to cause a round up.
-                ws_time = nova_time + 30 - self.time_now
+                ws_time = nova_time + 30 - ctx.time_now
                 ws_time_str = self.timedelta_as_string(ws_time)
 
             str_list.append("\t{:3}, Nova time: {}".format(ws_name, ws_time_str))
@@ -1349,15 +1985,15 @@ class MainCommand:
 
         return ["WhiteStar list:\n" + "\n".join(ws_strlist)]
 
-    async def command_ws_roles(self, params):
+    async def command_ws_roles(self, ctx, params):
         return_list = []
 
         who_list_scratch = list()
         role_list = list()
-        self.parse_who(params, who_list_scratch, role_list=role_list)
+        self.parse_who(params, who_list_scratch, role_list=role_list, ctx=ctx)
 
         ws_name = None
-        wsname_match = self.ws_name_match.search(str(self.current_channel))
+        wsname_match = self.ws_name_match.search(str(ctx.channel))
 
         if wsname_match and len(role_list) >= 2:
             ws_name = wsname_match.group(1)
@@ -1379,17 +2015,17 @@ class MainCommand:
 
         return return_list
 
-    async def command_ws_ship(self, params):
+    async def command_ws_ship(self, ctx, params):
         return_list = []
 
         who_list_good = list()
         other_list = list()
         return_list = return_list + self.parse_who(
-            params, who_list_good, other=other_list
+            params, who_list_good, other=other_list, ctx=ctx
         )
 
         ws_name = None
-        wsname_match = self.ws_name_match.search(str(self.current_channel))
+        wsname_match = self.ws_name_match.search(str(ctx.channel))
 
         if wsname_match:
             ws_name = wsname_match.group(1)
@@ -1410,8 +2046,8 @@ class MainCommand:
 
                 ws_reds = ws_struct["reds"]
 
-                # if not self.auth_chief():
-                #     who_list_good = [self.current_author.id]
+                # if not self.auth_chief(ctx):
+                #     who_list_good = [ctx.author.id]
 
                 time_list = list()
                 s_cmd = None
@@ -1443,7 +2079,7 @@ class MainCommand:
                 if len(who_list_good) > 0:
                     s_friend = who_list_good[0]
                 elif s_enemy is None:
-                    s_friend = self.current_author.id
+                    s_friend = ctx.author.id
 
                 # logger.debug('MEGAFONE ship what {sc} {ss} {st}'.format(sc=s_cmd, ss=s_shiptype, st=s_timertype))
                 # logger.debug('MEGAFONE ship who {sf} {se}'.format(sf=s_friend, se=s_enemy))
@@ -1502,7 +2138,7 @@ class MainCommand:
                                 }
 
                                 if s_timertype is not None and s_timertype == "ago":
-                                    open_time = self.time_now - given_time
+                                    open_time = ctx.time_now - given_time
                                 else:
                                     if s_cmd == "timer":
                                         # Command timer has a different default timertype
@@ -1513,13 +2149,13 @@ class MainCommand:
                                             open_time = nova_time - given_time
                                         else:
                                             # Default timertype: in
-                                            open_time = self.time_now + given_time
+                                            open_time = ctx.time_now + given_time
                                     else:
                                         if (
                                             s_timertype is not None
                                             and s_timertype == "hence"
                                         ):
-                                            open_time = self.time_now + given_time
+                                            open_time = ctx.time_now + given_time
                                         else:
                                             # Default timertype: at, nova
                                             open_time = nova_time - given_time
@@ -1575,36 +2211,39 @@ class MainCommand:
 
         return return_list
 
-    def nicommand_ws_shiplist(self, params, ws_info=None):
+    def nicommand_ws_shiplist(self, ctx, params, ws_info=None, ws_board=None):
         return_list = []
 
         # who_list_good = list()
-        # return_list = return_list + self.parse_who(params, who_list_good)
+        # return_list = return_list + self.parse_who(params, who_list_good, ctx=ctx)
 
         # if ws_info is None:
         #     if len(who_list_good) == 0:
-        #         who_list_good = [self.current_author.id]
+        #         who_list_good = [ctx.author.id]
 
-        #     if not str(self.current_channel) in self.ok_channels and not self.auth_chief():
-        #         who_list_good = [self.current_author.id]
+        #     if not str(ctx.channel) in self.ok_channels and not self.auth_chief(ctx):
+        #         who_list_good = [ctx.author.id]
 
-        if ws_info is not None and "pilot_order" in ws_info:
+        if (
+            ws_info is not None
+            and ws_board is not None
+            and ws_board.get("pilot_order") is not None
+        ):
             # Friends, greens
             green_list = []
             if "greens" in ws_info:
                 ws_greens = ws_info["greens"]
-                for pkey in ws_info["pilot_order"]:
-                    if pkey not in ws_greens:
-                        ws_greens[pkey] = {
-                            "bship": "",
-                            "bdelay": "",
-                            "sship": "",
-                            "sdelay": "",
-                        }
-                        self.flag_config_dirty = True
-
+                no_ship = {
+                    "bship": "",
+                    "bdelay": "",
+                    "sship": "",
+                    "sdelay": "",
+                }
+                for pkey in ws_board["pilot_order"]:
                     pilot_name = self.member_name_from_id(pkey)
-                    user_info = self.list_one_pilot(pilot_name, ws_greens[pkey])
+                    user_info = self.list_one_pilot(
+                        ctx, pilot_name, ws_greens.get(pkey, no_ship)
+                    )
                     green_list.append(user_info)
 
             # Enemies, reds
@@ -1615,28 +2254,29 @@ class MainCommand:
                 red_pilots = list(ws_reds.keys())
                 red_pilots.sort()
                 for pilot_name in red_pilots:
-                    user_info = self.list_one_pilot(pilot_name, ws_reds[pilot_name])
+                    user_info = self.list_one_pilot(
+                        ctx, pilot_name, ws_reds[pilot_name]
+                    )
                     red_list.append(user_info)
 
             if green_list or red_list:
                 t_header = ["Ships", "BS", "Supp"]
                 t_align = ["l", "l", "l"]
 
-                return_list += sme_table.draw(t_header, t_align, green_list + red_list)
+                return_list += self.draw_table(
+                    ctx, t_header, t_align, green_list + red_list
+                )
 
         return return_list
 
-    def list_one_pilot(self, pilot_name, pilot_data):
+    def list_one_pilot(self, ctx, pilot_name, pilot_data):
         b_delay = ""
         b_until_str = pilot_data["bdelay"]
         if b_until_str is not None and len(b_until_str) > 2:
             away_until = smer.sme_time_from_string(b_until_str)
-            if self.time_now < away_until:
-                td = away_until - self.time_now
+            if ctx.time_now < away_until:
+                td = away_until - ctx.time_now
                 b_delay = self.timedelta_as_string2(td + 15)
-            else:
-                pilot_data["bdelay"] = ""
-                self.flag_config_dirty = True
 
         b_ship = pilot_data["bship"]
         if len(b_ship) == 0 and len(b_delay) == 0:
@@ -1646,12 +2286,9 @@ class MainCommand:
         s_until_str = pilot_data["sdelay"]
         if s_until_str is not None and len(s_until_str) > 2:
             away_until = smer.sme_time_from_string(s_until_str)
-            if self.time_now < away_until:
-                td = away_until - self.time_now
+            if ctx.time_now < away_until:
+                td = away_until - ctx.time_now
                 s_delay = self.timedelta_as_string2(td + 15)
-            else:
-                pilot_data["sdelay"] = ""
-                self.flag_config_dirty = True
 
         s_ship = pilot_data["sship"]
         if len(s_ship) == 0 and len(s_delay) == 0:
@@ -1667,24 +2304,38 @@ class MainCommand:
             "{:1.1} {:>5}".format(s_ship, s_delay),
         ]
 
-    async def command_tech_set(self, params):
+    async def command_tech_set(self, ctx, params):
         return_list = []
 
         who_list_good = list()
         what_list_good = list()
         value_list = list()
         return_list = return_list + self.parse_who_what_int(
-            params, who_list_good, what_list_good, value_list
+            params, who_list_good, what_list_good, value_list, ctx=ctx
         )
 
         if len(who_list_good) == 0:
-            who_list_good = [self.current_author.id]
+            who_list_good = [ctx.author.id]
 
-        if str(self.current_channel) not in self.ok_channels and not self.auth_chief():
-            who_list_good = [self.current_author.id]
+        if str(ctx.channel) not in self.ok_channels and not self.auth_chief(ctx):
+            who_list_good = [ctx.author.id]
+
+        bad_value_list = [
+            val
+            for val in value_list
+            if val < sme_roster.level_min or val > sme_roster.level_max
+        ]
 
         if len(who_list_good) > 0 and len(what_list_good) > 0:
-            if len(value_list) == len(what_list_good):
+            if len(bad_value_list) > 0:
+                return_list.append(
+                    "Value(s) {bl} not in range {lo} to {hi}".format(
+                        bl=bad_value_list,
+                        lo=sme_roster.level_min,
+                        hi=sme_roster.level_max,
+                    )
+                )
+            elif len(value_list) == len(what_list_good):
                 old_value_list = list()
 
                 for who in who_list_good:
@@ -1692,7 +2343,7 @@ class MainCommand:
                         who, "last_name", self.member_name_from_id(who)
                     )
 
-                    from_str = smer.sme_time_as_string(self.time_now)
+                    from_str = smer.sme_time_as_string(ctx.time_now)
                     self.player_info_set(who, "last_tech_update", from_str)
 
                     for what, val in zip(what_list_good, value_list):
@@ -1711,8 +2362,6 @@ class MainCommand:
                             nl=value_list, ol=old_value_list
                         )
                     )
-
-                self.persdata_save()
             else:
                 return_list.append(
                     "Got {go} value(s) when I expected {ex}".format(
@@ -1722,7 +2371,7 @@ class MainCommand:
 
         return return_list
 
-    async def command_tech_report(self, params):
+    async def command_tech_report(self, ctx, params):
         return_list = []
 
         who_list_good = list()
@@ -1730,14 +2379,14 @@ class MainCommand:
         value_list = list()
         other_list = list()
         return_list = return_list + self.parse_who_what_int(
-            params, who_list_good, what_list_good, value_list, other=other_list
+            params, who_list_good, what_list_good, value_list, other=other_list, ctx=ctx
         )
 
         if len(who_list_good) == 0:
-            who_list_good = [self.current_author.id]
+            who_list_good = [ctx.author.id]
 
-        if str(self.current_channel) not in self.ok_channels and not self.auth_chief():
-            who_list_good = [self.current_author.id]
+        if str(ctx.channel) not in self.ok_channels and not self.auth_chief(ctx):
+            who_list_good = [ctx.author.id]
 
         flag_csv = False
         if "--csv" in other_list or "+csv" in other_list:
@@ -1756,7 +2405,8 @@ class MainCommand:
                 user_list.sort(key=lambda x: x[1], reverse=True)
 
             what_names = [teh.get_tech_name(what) for what in what_list_good]
-            return_list += sme_table.draw(
+            return_list += self.draw_table(
+                ctx,
                 ["User"] + what_names,
                 ["l"] + ["r"] * len(what_list_good),
                 user_list,
@@ -1765,7 +2415,7 @@ class MainCommand:
 
         return return_list
 
-    async def command_tech_list(self, params):
+    async def command_tech_list(self, ctx, params):
         # sometimes known as !gt or tech get
         return_list = []
 
@@ -1774,14 +2424,14 @@ class MainCommand:
         value_list = list()
         other_list = list()
         return_list = return_list + self.parse_who_what_int(
-            params, who_list_good, what_list_good, value_list, other=other_list
+            params, who_list_good, what_list_good, value_list, other=other_list, ctx=ctx
         )
 
         if len(who_list_good) == 0:
-            who_list_good = [self.current_author.id]
+            who_list_good = [ctx.author.id]
 
-        if str(self.current_channel) not in self.ok_channels and not self.auth_chief():
-            who_list_good = [self.current_author.id]
+        if str(ctx.channel) not in self.ok_channels and not self.auth_chief(ctx):
+            who_list_good = [ctx.author.id]
 
         flag_csv = False
         if "--csv" in other_list or "+csv" in other_list:
@@ -1796,9 +2446,15 @@ class MainCommand:
         if len(who_list_good) > 0 and len(what_list_good) > 0:
             user_list = []
 
+            rows = [self.roster.row_of(str(who)) for who in who_list_good]
+
             last_tech_key = ""
             for what in what_list_good:
-                row_data = [self.player_tech_get(who, what) for who in who_list_good]
+                tech_index = teh.get_tech_index(what)
+                if teh.is_derived(what):
+                    row_data = self.roster.derived_column(what, rows)
+                else:
+                    row_data = self.roster.column(tech_index, rows)
                 if row_data != ([0] * len(row_data)) or flag_csv:
                     if flag_csv:
                         prefix = ""
@@ -1811,7 +2467,8 @@ class MainCommand:
                     last_tech_key = what
 
             who_names = [self.member_name_from_id(wh) for wh in who_list_good]
-            return_list += sme_table.draw(
+            return_list += self.draw_table(
+                ctx,
                 ["Tech"] + who_names,
                 ["l"] + ["r"] * len(who_list_good),
                 user_list,
@@ -1820,20 +2477,20 @@ class MainCommand:
 
         return return_list
 
-    async def command_time_set(self, params):
+    async def command_time_set(self, ctx, params):
         return_list = []
 
         who_list_good = list()
         other_list = list()
         return_list = return_list + self.parse_who(
-            params, who_list_good, other=other_list
+            params, who_list_good, other=other_list, ctx=ctx
         )
 
         if len(who_list_good) == 0:
-            who_list_good = [self.current_author.id]
+            who_list_good = [ctx.author.id]
 
-        if str(self.current_channel) not in self.ok_channels and not self.auth_chief():
-            who_list_good = [self.current_author.id]
+        if str(ctx.channel) not in self.ok_channels and not self.auth_chief(ctx):
+            who_list_good = [ctx.author.id]
 
         if len(who_list_good) > 0:
             if len(other_list) > 0:
@@ -1851,17 +2508,17 @@ class MainCommand:
 
         return return_list
 
-    async def command_time_get(self, params):
+    async def command_time_get(self, ctx, params):
         return_list = []
 
         who_list_good = list()
-        return_list = return_list + self.parse_who(params, who_list_good)
+        return_list = return_list + self.parse_who(params, who_list_good, ctx=ctx)
 
         if len(who_list_good) == 0:
-            who_list_good = [self.current_author.id]
+            who_list_good = [ctx.author.id]
 
-        if str(self.current_channel) not in self.ok_channels and not self.auth_chief():
-            who_list_good = [self.current_author.id]
+        if str(ctx.channel) not in self.ok_channels and not self.auth_chief(ctx):
+            who_list_good = [ctx.author.id]
 
         if len(who_list_good) > 0:
             user_list = []
@@ -1874,52 +2531,61 @@ class MainCommand:
                     ]
                 )
 
-            return_list += sme_table.draw(["User", "timezone"], ["l", "l"], user_list)
+            return_list += self.draw_table(
+                ctx, ["User", "timezone"], ["l", "l"], user_list
+            )
 
         return return_list
 
-    async def command_time_list(self, params, ws_info=None):
+    async def command_time_list(self, ctx, params, ws_info=None, ws_board=None):
         return_list = []
 
         who_list_good = list()
-        return_list = return_list + self.parse_who(params, who_list_good)
+        return_list = return_list + self.parse_who(params, who_list_good, ctx=ctx)
 
         if ws_info is None:
             if len(who_list_good) == 0:
-                who_list_good = [self.current_author.id]
+                who_list_good = [ctx.author.id]
 
-            if (
-                str(self.current_channel) not in self.ok_channels
-                and not self.auth_chief()
-            ):
-                who_list_good = [self.current_author.id]
+            if str(ctx.channel) not in self.ok_channels and not self.auth_chief(ctx):
+                who_list_good = [ctx.author.id]
 
         if len(who_list_good) > 0:
             user_list = []
 
+            # All the timezones in one call
+            tz_strs = dict()
             for pkey in who_list_good:
-                timestr = "timeless"
-                t_sorting = int(0)
                 tz_str = self.player_info_get(pkey, "timezone")
                 if tz_str is not None:
-                    try:
-                        converted0, converted1 = str(
-                            smer.sme_time_convert_to_timezone(self.time_now, tz_str)
-                        ).split(",")
-                        if len(converted0) > 0 and len(converted1) > 0:
-                            timestr = str(converted0)
-                            t_sorting = int(converted1)
-                    except ValueError:
-                        pass
+                    tz_strs[pkey] = str(tz_str)
+
+            converted = dict(
+                zip(
+                    tz_strs.keys(),
+                    smer.sme_time_convert_to_timezone_batch(
+                        ctx.time_now, list(tz_strs.values())
+                    ),
+                )
+            )
+
+            for pkey in who_list_good:
+                timestr = "timeless"
+                t_sorting = int(0)
+                if pkey in converted:
+                    converted0, converted1 = converted[pkey]
+                    if len(converted0) > 0:
+                        timestr = converted0
+                        t_sorting = converted1
 
                 away_result = ""
                 away_msg_str = ""
                 away_until_str = self.player_info_get(pkey, "away_until")
                 if away_until_str is not None and len(away_until_str) > 2:
                     away_until = smer.sme_time_from_string(away_until_str)
-                    if self.time_now < away_until:
+                    if ctx.time_now < away_until:
                         (td_days, td_secs) = self.timedelta_to_days_secs(
-                            away_until - self.time_now
+                            away_until - ctx.time_now
                         )
                         if td_days >= 1:
                             away_result = away_result + f"{td_days}d "
@@ -1980,34 +2646,34 @@ class MainCommand:
                 t_align = ["l", "l", "r", "l"]
                 t_user_list = [[ee[0], ee[1], ee[2], ee[5]] for ee in user_list]
 
-            return_list += sme_table.draw(t_header, t_align, t_user_list)
+            return_list += self.draw_table(ctx, t_header, t_align, t_user_list)
 
-            if ws_info is not None and "pilot_order" not in ws_info:
-                ws_info["pilot_order"] = [pi[4] for pi in user_list]
-                ws_info["dirty"] = True
+            if ws_board is not None and ws_board.get("pilot_order") is None:
+                ws_board["pilot_order"] = [pi[4] for pi in user_list]
+                self.flag_wsstate_dirty = True
 
         return return_list
 
-    async def command_time_away(self, params):
+    async def command_time_away(self, ctx, params):
         return_list = []
 
         who_list_good = list()
         other_list = list()
         return_list = return_list + self.parse_who(
-            params, who_list_good, other=other_list
+            params, who_list_good, other=other_list, ctx=ctx
         )
 
         away_player_id = 0
-        if self.auth_chief():
+        if self.auth_chief(ctx):
             if len(who_list_good) == 0:
-                away_player_id = self.current_author.id
+                away_player_id = ctx.author.id
             elif len(who_list_good) == 1:
                 away_player_id = who_list_good[0]
             else:
                 return_list.append("Sorry about that chief. Can only do one.")
         else:
             if len(who_list_good) == 0:
-                away_player_id = self.current_author.id
+                away_player_id = ctx.author.id
             else:
                 return_list.append("Oh crap. Will only work on self.")
 
@@ -2015,10 +2681,10 @@ class MainCommand:
             delay = float(other_list[0])
 
             if delay <= 36.0:
-                from_str = smer.sme_time_as_string(self.time_now)
+                from_str = smer.sme_time_as_string(ctx.time_now)
                 self.player_info_set(away_player_id, "away_from", from_str)
 
-                until_time = self.time_now + (delay * 3600)
+                until_time = ctx.time_now + (delay * 3600)
                 until_str = smer.sme_time_as_string(int(until_time))
                 self.player_info_set(away_player_id, "away_until", until_str)
 
@@ -2035,45 +2701,45 @@ class MainCommand:
 
         return return_list
 
-    async def command_time_back(self, params):
+    async def command_time_back(self, ctx, params):
         return_list = []
 
         who_list_good = list()
         other_list = list()
         return_list = return_list + self.parse_who(
-            params, who_list_good, other=other_list
+            params, who_list_good, other=other_list, ctx=ctx
         )
 
         if len(who_list_good) > 0:
             return_list.append("Oh crap. Will only work on self.")
         else:
-            self.player_info_set(self.current_author.id, "away_from", "")
-            self.player_info_set(self.current_author.id, "away_until", "")
-            self.player_info_set(self.current_author.id, "away_msg", "")
+            self.player_info_set(ctx.author.id, "away_from", "")
+            self.player_info_set(ctx.author.id, "away_until", "")
+            self.player_info_set(ctx.author.id, "away_msg", "")
 
             return_list.append("OK")
 
         return return_list
 
-    async def command_time_checkin(self, params):
+    async def command_time_checkin(self, ctx, params):
         return_list = []
         return_ok = False
 
         who_list_good = list()
         other_list = list()
         return_list = return_list + self.parse_who(
-            params, who_list_good, other=other_list
+            params, who_list_good, other=other_list, ctx=ctx
         )
 
-        if not self.auth_chief():
+        if not self.auth_chief(ctx):
             who_list_good = list()
             return_list.append("Only for chiefs")
 
         if len(who_list_good) > 0:
             delay = 1
-            from_str = smer.sme_time_as_string(self.time_now)
-            until_str = smer.sme_time_as_string(int(self.time_now + (delay * 3600)))
-            instigator_name = self.member_name_from_id(self.current_author.id)
+            from_str = smer.sme_time_as_string(ctx.time_now)
+            until_str = smer.sme_time_as_string(int(ctx.time_now + (delay * 3600)))
+            instigator_name = self.member_name_from_id(ctx.author.id)
             who_list_away = list()
 
             for pkey in who_list_good:
@@ -2081,7 +2747,7 @@ class MainCommand:
                 away_until_str = self.player_info_get(pkey, "away_until")
                 if away_until_str is not None and len(away_until_str) > 2:
                     away_until = smer.sme_time_from_string(away_until_str)
-                    if self.time_now < away_until:
+                    if ctx.time_now < away_until:
                         flag_away = True
 
                 if flag_away:
@@ -2114,28 +2780,45 @@ class MainCommand:
 
         return return_list
 
-    async def command_pilot_lastup(self, params):
+    async def command_pilot_lastup(self, ctx, params):
         return_list = []
 
         who_list_good = list()
         other_list = list()
         return_list = return_list + self.parse_who(
-            params, who_list_good, other=other_list
+            params, who_list_good, other=other_list, ctx=ctx
         )
 
-        if len(who_list_good) == 0:
-            who_list_good = [self.current_author.id]
+        flag_older = "--older" in other_list or "+older" in other_list
+
+        if len(who_list_good) == 0 and not flag_older:
+            who_list_good = [ctx.author.id]
 
         if "--not" in other_list or "+not" in other_list:
             all_who = set()
-            for pkey in self.players:
+            for pkey in self.roster:
                 all_who.add(int(pkey))
 
             who_set = set(who_list_good)
             who_list_good = list(all_who - who_set)
 
-        if str(self.current_channel) not in self.ok_channels and not self.auth_chief():
-            who_list_good = [self.current_author.id]
+        if flag_older:
+            # eg: pilot lastup +older 30d
+            older_timedelta = self.timedelta_from_strings(
+                [oo for oo in other_list if oo[0:2] != "--" and oo[0:1] != "+"]
+            )
+            older_str = smer.sme_time_as_string(int(ctx.time_now - older_timedelta))
+            older_set = set(
+                int(pkey) for pkey in self.players_not_updated_since(older_str)
+            )
+
+            if len(who_list_good) > 0:
+                who_list_good = [who for who in who_list_good if who in older_set]
+            else:
+                who_list_good = list(older_set)
+
+        if str(ctx.channel) not in self.ok_channels and not self.auth_chief(ctx):
+            who_list_good = [ctx.author.id]
 
         if len(who_list_good) > 0:
             user_list = []
@@ -2145,9 +2828,9 @@ class MainCommand:
                 lup_was_str = self.player_info_get(pkey, "last_tech_update")
                 if lup_was_str is not None and len(lup_was_str) > 2:
                     lup_was = smer.sme_time_from_string(lup_was_str)
-                    if self.time_now > lup_was:
+                    if ctx.time_now > lup_was:
                         (td_days, td_secs) = self.timedelta_to_days_secs(
-                            self.time_now - lup_was
+                            ctx.time_now - lup_was
                         )
                         if td_days >= 1:
                             lup_result = lup_result + float(td_days)
@@ -2158,26 +2841,26 @@ class MainCommand:
 
             user_list.sort(key=lambda x: x[1], reverse=True)
 
-            return_list += sme_table.draw(
-                ["User", "days since update"], ["l", "l"], user_list
+            return_list += self.draw_table(
+                ctx, ["User", "days since update"], ["l", "l"], user_list
             )
 
         return return_list
 
-    async def command_score(self, params):
+    async def command_score(self, ctx, params):
         return_list = []
 
         who_list_good = list()
         other_list = list()
         return_list = return_list + self.parse_who(
-            params, who_list_good, other=other_list
+            params, who_list_good, other=other_list, ctx=ctx
         )
 
         if len(who_list_good) == 0:
-            who_list_good = [self.current_author.id]
+            who_list_good = [ctx.author.id]
 
-        if str(self.current_channel) not in self.ok_channels and not self.auth_chief():
-            who_list_good = [self.current_author.id]
+        if str(ctx.channel) not in self.ok_channels and not self.auth_chief(ctx):
+            who_list_good = [ctx.author.id]
 
         score_key = "210918"
         flag_detail = False
@@ -2194,567 +2877,29 @@ class MainCommand:
                     flagged_whotruncated = True
                     del who_list_good[4:]
 
-        flag_wspoints210918 = False
-        if score_key == "210918":
-            flag_wspoints210918 = True
-
-        flag_wspoints201206 = False
-        if score_key == "201206":
-            flag_wspoints201206 = True
-
-        ww = self.weights[score_key]
-
         user_list = []
 
         t_header = ["User", score_key]
 
-        for pkey in who_list_good:
-            pp = self.players[str(pkey)]
-            ppt = pp["tech"]
-            accum = 0
-
-            try:
-                if flag_wspoints201206:
-                    faccum = list()
-                    detail_aa = []
-                    detail_mi = []
-                    detail_s1 = []
-                    detail_s2 = []
-                    detail_we = []
-                    detail_sh = []
-
-                    # relics, entrust, dispatch, data, relicdrone
-                    for tkey in ["relics", "entrust", "dispatch", "dart", "relicdrone"]:
-                        if tkey in ww:
-                            tweights = ww[tkey]
-                            tval = self.player_tech_get(pkey, tkey)
-                            if tval > 0:
-                                score = tweights[tval - 1]
-                                faccum.append(float(score))
-                                if flag_detail:
-                                    detail_aa.append(f"{tkey} {score}")
-
-                    # mining
-                    otherminingtech = list()
-                    ml1 = teh.tech_key_range_list("mining")
-                    for mtkey in ml1:
-                        score = 0
-                        if mtkey in ww:
-                            tweights = ww[mtkey]
-                            tval = self.player_tech_get(pkey, mtkey)
-                            if tval > 0:
-                                score = tweights[tval - 1]
-
-                        if score > 0:
-                            otherminingtech.append([mtkey, score])
-
-                    if len(otherminingtech) > 0:
-                        otherminingtech.sort(key=lambda x: x[1], reverse=True)
-                        minerlvl = self.player_tech_get(pkey, "miner")
-                        mcount = 0
-                        if minerlvl >= 2 and minerlvl <= 6:
-                            mcount = minerlvl - 1
-
-                        fscore = float(0.0)
-
-                        mmax = len(otherminingtech)
-                        mhi = mcount
-                        if mhi > mmax:
-                            mhi = mmax
-
-                        for zz in range(0, mhi):
-                            iscore = float(otherminingtech[zz][1])
-                            fscore += iscore
-                            if flag_detail:
-                                detail_mi.append(
-                                    "{tn} {ts}".format(
-                                        tn=otherminingtech[zz][0], ts=iscore
-                                    )
-                                )
-
-                        if mcount < mmax:
-                            mhi = mcount * 2 - 2
-                            if mhi > mmax:
-                                mhi = mmax
-
-                            for zz in range(mcount, mhi):
-                                iscore = float(otherminingtech[zz][1]) * 0.5
-                                fscore += iscore
-                                if flag_detail:
-                                    detail_mi.append(
-                                        "{tn} {ts}".format(
-                                            tn=otherminingtech[zz][0], ts=iscore
-                                        )
-                                    )
-
-                        faccum.append(fscore)
-
-                    # support
-                    bslvl = self.player_tech_get(pkey, "bs")
-                    if bslvl >= 2 and bslvl <= 6:
-                        scount = bslvl - 1
-
-                        techlist = teh.tech_key_range_list("support")
-
-                        supporttech = list()
-                        for tkey in techlist:
-                            score = 0
-                            if tkey in ww:
-                                tweights = ww[tkey]
-                                tval = self.player_tech_get(pkey, tkey)
-                                if tval > 0:
-                                    score = tweights[tval - 1]
-
-                            if score > 0:
-                                supporttech.append([tkey, score])
-
-                        if len(supporttech) > 0:
-                            supporttech.sort(key=lambda x: x[1], reverse=True)
-
-                            fscore = float(0.0)
-
-                            smax = len(supporttech)
-                            shi = scount
-                            if shi > smax:
-                                shi = smax
-
-                            for zz in range(0, shi):
-                                iscore = float(supporttech[zz][1])
-                                fscore += iscore
-                                if flag_detail:
-                                    detail_s1.append(
-                                        "{tn} {ts}".format(
-                                            tn=supporttech[zz][0], ts=iscore
-                                        )
-                                    )
-
-                            if scount < smax:
-                                shi = scount * 2
-                                if shi > smax:
-                                    shi = smax
-
-                                for zz in range(scount, shi):
-                                    iscore = float(supporttech[zz][1]) * 0.75
-                                    fscore += iscore
-                                    if flag_detail:
-                                        detail_s1.append(
-                                            "{tn} {ts}".format(
-                                                tn=supporttech[zz][0], ts=iscore
-                                            )
-                                        )
-
-                                if (scount * 2) < smax:
-                                    for zz in range(scount * 2, smax):
-                                        iscore = float(supporttech[zz][1]) * 0.25
-                                        fscore += iscore
-                                        if flag_detail:
-                                            detail_s2.append(
-                                                "{tn} {ts}".format(
-                                                    tn=supporttech[zz][0], ts=iscore
-                                                )
-                                            )
-
-                            faccum.append(fscore)
-
-                    # weapons
-                    wl1 = teh.tech_key_range_list("weapon")
-                    techlist = [t for t in wl1 if t not in ["dart"]]
-                    weapontech = list()
-                    for tkey in techlist:
-                        score = 0
-                        if tkey in ww:
-                            tweights = ww[tkey]
-                            tval = self.player_tech_get(pkey, tkey)
-                            if tval > 0:
-                                score = tweights[tval - 1]
-
-                        if score > 0:
-                            weapontech.append([tkey, score])
-
-                    if len(weapontech) > 0:
-                        weapontech.sort(key=lambda x: x[1], reverse=True)
-                        got_first = False
-                        wt2 = list()
-
-                        for weapon_tuple in weapontech:
-                            skey = weapon_tuple[0]
-
-                            if skey in ["battery", "laser"]:
-                                if not got_first:
-                                    wt2.append(weapon_tuple)
-                                    got_first = True
-
-                            else:
-                                wt2.append(weapon_tuple)
-
-                        whi = 3
-                        if whi > len(wt2):
-                            whi = len(wt2)
-
-                        if 0 < whi:
-                            iscore = float(wt2[0][1])
-                            fscore = iscore
-                            if flag_detail:
-                                detail_we.append(
-                                    "{tn} {ts}".format(tn=wt2[0][0], ts=iscore)
-                                )
-
-                            if 1 < whi:
-                                iscore = float(wt2[1][1]) * 0.75
-                                fscore += iscore
-                                if flag_detail:
-                                    detail_we.append(
-                                        "{tn} {ts}".format(tn=wt2[1][0], ts=iscore)
-                                    )
-
-                                if 2 < whi:
-                                    iscore = float(wt2[2][1]) * 0.5
-                                    fscore += iscore
-                                    if flag_detail:
-                                        detail_we.append(
-                                            "{tn} {ts}".format(tn=wt2[2][0], ts=iscore)
-                                        )
-
-                            faccum.append(fscore)
-
-                    # shields
-                    techlist = teh.tech_key_range_list("shield")
-                    shieldtech = list()
-                    for tkey in techlist:
-                        score = 0
-                        if tkey in ww:
-                            tweights = ww[tkey]
-                            tval = self.player_tech_get(pkey, tkey)
-                            if tval > 0:
-                                score = tweights[tval - 1]
-
-                        if score > 0:
-                            shieldtech.append([tkey, score])
-
-                    if len(shieldtech) > 0:
-                        shieldtech.sort(key=lambda x: x[1], reverse=True)
-                        gotmain = False
-                        gotareadelta = False
-                        st2 = list()
-
-                        for ss in shieldtech:
-                            skey = ss[0]
-
-                            if skey in ["passiveshield", "omegashield", "mirrorshield"]:
-                                if not gotmain:
-                                    st2.append(ss)
-                                    gotmain = True
-
-                            elif skey in ["areashield", "deltashield"]:
-                                if not gotareadelta:
-                                    st2.append(ss)
-                                    gotareadelta = True
-                                else:
-                                    st2.append([skey, ss[1] * 0.5])
-
-                            elif skey in ["blastshield"]:
-                                st2.append(ss)
-
-                        fscore = float(0.0)
-
-                        for ss in st2:
-                            iscore = float(ss[1])
-                            fscore += iscore
-                            if flag_detail:
-                                detail_sh.append(
-                                    "{tn} {ts}".format(tn=ss[0], ts=iscore)
-                                )
-
-                        faccum.append(fscore)
-
-                    #
-                    faccum.append(0.5)
-                    accum = int(math.floor(math.fsum(faccum)))
-                elif flag_wspoints210918:
-                    faccum = list()
-                    detail_aa = []
-                    detail_mi = []
-                    detail_s1 = []
-                    detail_s2 = []
-                    detail_we = []
-                    detail_sh = []
-
-                    # relics, entrust, dispatch, data, relicdrone
-                    for tkey in ["relics", "entrust", "dispatch", "dart", "relicdrone"]:
-                        if tkey in ww:
-                            tweights = ww[tkey]
-                            tval = self.player_tech_get(pkey, tkey)
-                            if tval > 0:
-                                score = tweights[tval - 1]
-                                if tkey == "dart":
-                                    # Special bonus for dart
-                                    score = 50
-
-                                faccum.append(float(score))
-                                if flag_detail:
-                                    detail_aa.append(
-                                        "{tk} {sc}".format(tk=tkey, sc=score)
-                                    )
-
-                    # mining
-                    otherminingtech = list()
-                    ml1 = teh.tech_key_range_list("mining")
-                    for mtkey in ml1:
-                        score = 0
-                        if mtkey in ww:
-                            tweights = ww[mtkey]
-                            tval = self.player_tech_get(pkey, mtkey)
-                            if tval > 0:
-                                score = tweights[tval - 1]
-
-                        if score > 0:
-                            otherminingtech.append([mtkey, score])
-
-                    if len(otherminingtech) > 0:
-                        otherminingtech.sort(key=lambda x: x[1], reverse=True)
-                        minerlvl = self.player_tech_get(pkey, "miner")
-                        mcount = 0
-                        if minerlvl >= 2 and minerlvl <= 6:
-                            mcount = minerlvl - 1
-
-                        fscore = float(0.0)
-
-                        mmax = len(otherminingtech)
-                        mhi = mcount
-                        if mhi > mmax:
-                            mhi = mmax
-
-                        for zz in range(0, mhi):
-                            iscore = float(otherminingtech[zz][1])
-                            fscore += iscore
-                            if flag_detail:
-                                detail_mi.append(
-                                    "{tn} {ts}".format(
-                                        tn=otherminingtech[zz][0], ts=iscore
-                                    )
-                                )
-
-                        if mcount < mmax:
-                            mhi = mcount * 2 - 2
-                            if mhi > mmax:
-                                mhi = mmax
-
-                            for zz in range(mcount, mhi):
-                                iscore = float(otherminingtech[zz][1]) * 0.5
-                                fscore += iscore
-                                if flag_detail:
-                                    detail_mi.append(
-                                        "{tn} {ts}".format(
-                                            tn=otherminingtech[zz][0], ts=iscore
-                                        )
-                                    )
-
-                        faccum.append(fscore)
-
-                    # support
-                    bslvl = self.player_tech_get(pkey, "bs")
-                    if bslvl >= 2 and bslvl <= 6:
-                        scount = bslvl - 1
-
-                        techlist = teh.tech_key_range_list("support")
-
-                        supporttech = list()
-                        for tkey in techlist:
-                            score = 0
-                            if tkey in ww:
-                                tweights = ww[tkey]
-                                tval = self.player_tech_get(pkey, tkey)
-                                if tval > 0:
-                                    score = tweights[tval - 1]
-
-                            if score > 0:
-                                supporttech.append([tkey, score])
-
-                        if len(supporttech) > 0:
-                            supporttech.sort(key=lambda x: x[1], reverse=True)
-
-                            fscore = float(0.0)
-
-                            smax = len(supporttech)
-                            shi = scount
-                            if shi > smax:
-                                shi = smax
-
-                            for zz in range(0, shi):
-                                iscore = float(supporttech[zz][1])
-                                fscore += iscore
-                                if flag_detail:
-                                    detail_s1.append(
-                                        "{tn} {ts}".format(
-                                            tn=supporttech[zz][0], ts=iscore
-                                        )
-                                    )
-
-                            if scount < smax:
-                                shi = scount * 2
-                                if shi > smax:
-                                    shi = smax
-
-                                for zz in range(scount, shi):
-                                    iscore = float(supporttech[zz][1]) * 0.75
-                                    fscore += iscore
-                                    if flag_detail:
-                                        detail_s1.append(
-                                            "{tn} {ts}".format(
-                                                tn=supporttech[zz][0], ts=iscore
-                                            )
-                                        )
-
-                                if (scount * 2) < smax:
-                                    for zz in range(scount * 2, smax):
-                                        iscore = float(supporttech[zz][1]) * 0.25
-                                        fscore += iscore
-                                        if flag_detail:
-                                            detail_s2.append(
-                                                "{tn} {ts}".format(
-                                                    tn=supporttech[zz][0], ts=iscore
-                                                )
-                                            )
-
-                            faccum.append(fscore)
-
-                    # weapons
-                    wl1 = teh.tech_key_range_list("weapon")
-                    weapontech = list()
-                    for tkey in wl1:
-                        score = 0
-                        if tkey in ww:
-                            tweights = ww[tkey]
-                            tval = self.player_tech_get(pkey, tkey)
-                            if tval > 0:
-                                score = tweights[tval - 1]
-
-                        if score > 0:
-                            weapontech.append([tkey, score])
-
-                    if len(weapontech) > 0:
-                        weapontech.sort(key=lambda x: x[1], reverse=True)
-                        got_first = False
-                        wt2 = list()
-
-                        for weapon_tuple in weapontech:
-                            skey = weapon_tuple[0]
-
-                            if skey in ["battery", "laser"]:
-                                if not got_first:
-                                    wt2.append(weapon_tuple)
-                                    got_first = True
-
-                            else:
-                                wt2.append(weapon_tuple)
-
-                        whi = 3
-                        if whi > len(wt2):
-                            whi = len(wt2)
-
-                        if 0 < whi:
-                            iscore = float(wt2[0][1])
-                            fscore = iscore
-                            if flag_detail:
-                                detail_we.append(
-                                    "{tn} {ts}".format(tn=wt2[0][0], ts=iscore)
-                                )
-
-                            if 1 < whi:
-                                iscore = float(wt2[1][1]) * 0.75
-                                fscore += iscore
-                                if flag_detail:
-                                    detail_we.append(
-                                        "{tn} {ts}".format(tn=wt2[1][0], ts=iscore)
-                                    )
-
-                                if 2 < whi:
-                                    iscore = float(wt2[2][1]) * 0.5
-                                    fscore += iscore
-                                    if flag_detail:
-                                        detail_we.append(
-                                            "{tn} {ts}".format(tn=wt2[2][0], ts=iscore)
-                                        )
-
-                            faccum.append(fscore)
-
-                    # shields
-                    techlist = teh.tech_key_range_list("shield")
-                    shieldtech = list()
-                    for tkey in techlist:
-                        score = 0
-                        if tkey in ww:
-                            tweights = ww[tkey]
-                            tval = self.player_tech_get(pkey, tkey)
-                            if tval > 0:
-                                score = tweights[tval - 1]
-
-                        if score > 0:
-                            shieldtech.append([tkey, score])
-
-                    if len(shieldtech) > 0:
-                        shieldtech.sort(key=lambda x: x[1], reverse=True)
-                        gotmain = False
-                        gotareadelta = False
-                        st2 = list()
-
-                        for ss in shieldtech:
-                            skey = ss[0]
-
-                            if skey in ["passiveshield", "omegashield", "mirrorshield"]:
-                                if not gotmain:
-                                    st2.append(ss)
-                                    gotmain = True
-
-                            elif skey in ["areashield", "deltashield"]:
-                                if not gotareadelta:
-                                    st2.append(ss)
-                                    gotareadelta = True
-                                else:
-                                    st2.append([skey, ss[1] * 0.5])
-
-                            elif skey in ["blastshield"]:
-                                st2.append(ss)
-
-                        fscore = float(0.0)
-
-                        for ss in st2:
-                            iscore = float(ss[1])
-                            fscore += iscore
-                            if flag_detail:
-                                detail_sh.append(
-                                    "{tn} {ts}".format(tn=ss[0], ts=iscore)
-                                )
-
-                        faccum.append(fscore)
-
-                    #
-                    faccum.append(0.5)
-                    accum = int(math.floor(math.fsum(faccum)))
-                else:
-                    for tindex in range(len(ppt)):
-                        tval = ppt[tindex]
-
-                        if tval > 0:
-                            tkey = teh.tech_keys[tindex]
-
-                            if tkey in ww:
-                                tweights = ww[tkey]
-                                accum += tweights[tval - 1]
-            except IndexError:
-                accum = 0
+        scores = self.scorer.score_players(
+            self.roster,
+            score_key,
+            [str(pkey) for pkey in who_list_good],
+            flag_detail=flag_detail,
+        )
 
+        for pkey, (accum, detail) in zip(who_list_good, scores):
             if flag_detail and accum > 0:
                 olist = list()
                 olist.append(
                     "`| {nm}` {ac}".format(nm=self.member_name_from_id(pkey), ac=accum)
                 )
-                olist.append("`|     :` " + ", ".join(detail_aa))
-                olist.append("`|   mi:` " + ", ".join(detail_mi))
-                olist.append("`|   su:` " + ", ".join(detail_s1))
-                olist.append("`|   su:` " + ", ".join(detail_s2))
-                olist.append("`|   we:` " + ", ".join(detail_we))
-                olist.append("`|   sh:` " + ", ".join(detail_sh))
+                olist.append("`|     :` " + ", ".join(detail["aa"]))
+                olist.append("`|   mi:` " + ", ".join(detail["mi"]))
+                olist.append("`|   su:` " + ", ".join(detail["s1"]))
+                olist.append("`|   su:` " + ", ".join(detail["s2"]))
+                olist.append("`|   we:` " + ", ".join(detail["we"]))
+                olist.append("`|   sh:` " + ", ".join(detail["sh"]))
                 return_list.append("\n".join(olist))
             else:
                 user_list.append([self.member_name_from_id(pkey), accum])
@@ -2765,29 +2910,29 @@ class MainCommand:
             if len(t_header) == 2:
                 t_header[1] = "Score"
 
-            return_list += sme_table.draw(t_header, ["l", "r"], user_list)
+            return_list += self.draw_table(ctx, t_header, ["l", "r"], user_list)
 
         if flagged_whotruncated:
             return_list.append("Only showing 4 pilots")
 
         return return_list
 
-    async def command_msgme(self, params):
+    async def command_msgme(self, ctx, params):
         return_list = []
 
-        self.queue_msg_for_send_out(self.current_author, "You rang?")
+        self.queue_msg_for_send_out(ctx.author, "You rang?")
 
         return_list.append("OK")
 
         return return_list
 
-    async def command_clear(self, params):
+    async def command_clear(self, ctx, params):
         return_list = []
 
         who_list_good = list()
         other_list = list()
         return_list = return_list + self.parse_who(
-            params, who_list_good, other=other_list
+            params, who_list_good, other=other_list, ctx=ctx
         )
 
         count_clear = 1
@@ -2828,7 +2973,7 @@ class MainCommand:
 
         found_after = None
         if count_after > 0:
-            old_msgs = await self.current_channel.history(
+            old_msgs = await ctx.channel.history(
                 limit=int(count_after + 1), oldest_first=True
             ).flatten()
 
@@ -2845,11 +2990,11 @@ class MainCommand:
             # chunk_size = 96
             # keep_going = True
             # while keep_going:
-            #     old_msgs = await self.current_channel.purge(limit=chunk_size, after=found_after)
+            #     old_msgs = await ctx.channel.purge(limit=chunk_size, after=found_after)
             #     if len(old_msgs) < chunk_size:
             #         keep_going = False
         if count_clear > 0:
-            await self.current_channel.purge(limit=count_clear + 1, after=found_after)
+            await ctx.channel.purge(limit=count_clear + 1, after=found_after)
 
         if len(return_list) < 1:
             return_list.append("dented-control-message:no-reply")
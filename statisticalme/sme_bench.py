@@ -0,0 +1,310 @@
+# This file is part of StatisticalMe discord bot.
+#
+# Copyright 2019 by Antony Suter
+#
+# StatisticalMe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# StatisticalMe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with StatisticalMe.  If not, see <https://www.gnu.org/licenses/>.
+
+# Scaling benchmark. Builds synthetic guilds and pilot data at increasing
+# fractions of a full size guild, and times the main commands at each.
+#
+#   python -m statisticalme.sme_bench [--scales 0.1,0.5,1] [--repeat 5]
+#   python -m statisticalme.sme_bench --budget score=50 --budget ws.board=20
+#
+# Budgets are milliseconds, checked at the largest scale. Any over budget
+# and the exit status is 1.
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import statisticalme.statisticalme as smer
+
+from . import sme_dispatch, sme_replay, sme_storage
+from .responder import MainCommand, teh
+
+logger = logging.getLogger("StatisticalMe")
+
+bench_timezones = [
+    "UTC",
+    "Europe/London",
+    "Europe/Berlin",
+    "America/New_York",
+    "America/Los_Angeles",
+    "Asia/Tokyo",
+    "Australia/Sydney",
+]
+
+# (name, message), all run by a dev in an ok channel. {pilots} is the role
+# every tracked pilot has.
+bench_commands = [
+    ("tech.list", "!sme tech list {pilots} +all"),
+    ("tech.report", "!sme tech report {pilots} miner bs relics"),
+    ("score", "!sme score {pilots}"),
+    ("time.list", "!sme time list {pilots}"),
+    ("pilot.lastup", "!sme pilot lastup +not"),
+]
+
+
+class BenchWorld:
+    # One synthetic guild and its data, in a temporary var directory
+    def __init__(self, members, roles, pilots, seed=1):
+        self.rng = random.Random(seed)
+        self.time_start = 1700000000
+        self.var_dir = tempfile.mkdtemp(prefix="sme-bench-")
+
+        self.dev_id = 1
+        self.guild = sme_replay.FakeGuild()
+        self.dev = self.guild.add_member("dev", member_id=self.dev_id)
+        self.channel = self.guild.add_channel("bench")
+        self.ws_channel = self.guild.add_channel("ws-bench")
+
+        self.members = [self.guild.add_member(f"pilot{nn}") for nn in range(members)]
+        self.pilots = self.members[: min(pilots, members)]
+
+        self.pilot_role = self.guild.add_role("pilots", self.pilots)
+        self.chief_role = self.guild.add_role("chiefs", self.pilots[:10])
+        self.watcher_role = self.guild.add_role("watchers", self.pilots[:30])
+        self.ws_lead_role = self.guild.add_role("ws-bench-lead", self.pilots[:3])
+        self.ws_role = self.guild.add_role("ws-bench", self.pilots[:15])
+
+        # The rest are of mixed sizes, mostly small
+        other_roles = list()
+        for nn in range(max(0, roles - 5)):
+            size = min(members, int(self.rng.paretovariate(1.2) * 5))
+            other_roles.append(
+                self.guild.add_role(f"role{nn}", self.rng.sample(self.members, size))
+            )
+
+        groups = {
+            "auth_chief": {"defn": self.chief_role.mention, "members": []},
+            "auth_watcher": {"defn": self.watcher_role.mention, "members": []},
+            "pilots": {"defn": self.pilot_role.mention, "members": []},
+        }
+        for nn, role in enumerate(other_roles[:20]):
+            groups[f"group{nn}"] = {"defn": role.mention, "members": []}
+
+        self.write_json("config.json", {"groups": groups, "ws": {}, "aliases": {}})
+        self.write_json("weights.json", {"weights": self.weights()})
+        self.write_json(
+            "persdata.json",
+            {
+                "tech_keys": teh.tech_keys,
+                "players": {str(pp.id): self.player() for pp in self.pilots},
+            },
+        )
+
+    def write_json(self, filename, data):
+        with open(os.path.join(self.var_dir, filename), "w") as fh:
+            json.dump(data, fh)
+
+    def weights(self):
+        tkeys = teh.tech_keys + ["relics", "entrust", "dispatch", "dart", "relicdrone"]
+        ww = {tkey: [(nn + 1) * 10 for nn in range(12)] for tkey in tkeys}
+
+        return {"201206": ww, "210918": ww}
+
+    def player(self):
+        rng = self.rng
+
+        info = {
+            "timezone": rng.choice(bench_timezones),
+            "last_tech_update": smer.sme_time_as_string(
+                self.time_start - rng.randrange(60 * 86400)
+            ),
+        }
+        if rng.random() < 0.1:
+            info["away_until"] = smer.sme_time_as_string(
+                self.time_start + rng.randrange(3 * 86400)
+            )
+            info["away_msg"] = "away"
+
+        return {
+            "tech": [rng.randrange(11) for _ in teh.tech_keys],
+            "info": info,
+        }
+
+    async def start(self):
+        clock = sme_replay.VirtualClock(self.time_start)
+
+        self.mainc = MainCommand(
+            [self.dev_id],
+            self.channel.name,
+            storage=sme_storage.JsonStorage(self.var_dir),
+            save_window=3600.0,
+            dispatcher=sme_dispatch.OutboundDispatcher(rate=None),
+            time_source=clock,
+            background_autostart=False,
+        )
+        self.mainc.set_guild(self.guild)
+        self.driver = sme_replay.ReplayDriver(self.mainc, self.guild, clock)
+
+        await self.driver.command(
+            self.dev,
+            self.ws_channel,
+            f"!sme ws add 2d {self.ws_lead_role.mention} {self.ws_role.mention}",
+        )
+
+    async def stop(self):
+        await self.mainc.aiohttp_session.close()
+        shutil.rmtree(self.var_dir, ignore_errors=True)
+
+    async def time_one(self, name, message):
+        mainc = self.mainc
+        time_start = time.perf_counter()
+
+        if name == "groups.refresh":
+            mainc.group_refresh_all()
+        elif name == "ws.board":
+            await self.driver.tick()
+        else:
+            if name == "score":
+                # Score the pilots, not the cache
+                mainc.scorer.set_weights(mainc.weights)
+
+            await self.driver.command(
+                self.dev, self.channel, message.format(pilots=self.pilot_role.mention)
+            )
+            await mainc.dispatcher.drain()
+
+        return time.perf_counter() - time_start
+
+
+async def bench_scale(args, scale, names):
+    world = BenchWorld(
+        max(1, int(args.members * scale)),
+        max(5, int(args.roles * scale)),
+        max(1, int(args.pilots * scale)),
+        seed=args.seed,
+    )
+    r_dict = dict()
+
+    try:
+        await world.start()
+
+        for name, message in names:
+            samples = [await world.time_one(name, message) for _ in range(args.repeat)]
+            r_dict[name] = statistics.median(samples)
+    finally:
+        await world.stop()
+
+    return (len(world.members), len(world.pilots), r_dict)
+
+
+async def bench_run(args):
+    names = bench_commands + [("groups.refresh", None), ("ws.board", None)]
+    if args.only is not None:
+        names = [nm for nm in names if nm[0] in args.only]
+
+    results = list()
+    for scale in args.scales:
+        results.append(await bench_scale(args, scale, names))
+
+    return ([name for name, _ in names], results)
+
+
+def growth(results, name):
+    # The exponent k in time ~ pilots^k, from the smallest to largest scale
+    n0, t0 = results[0][1], results[0][2][name]
+    n1, t1 = results[-1][1], results[-1][2][name]
+
+    if n1 <= n0 or t0 <= 0.0 or t1 <= 0.0:
+        return "-"
+
+    return f"{math.log(t1 / t0) / math.log(n1 / n0):.2f}"
+
+
+def report_lines(names, results, flag_csv=False):
+    header = ["Command"] + [f"{pilots}p/{members}m" for members, pilots, _ in results]
+    header.append("growth")
+
+    rows = list()
+    for name in names:
+        rows.append(
+            [name]
+            + [f"{r_dict[name] * 1000.0:.1f}" for _, _, r_dict in results]
+            + [growth(results, name)]
+        )
+
+    if flag_csv:
+        return [",".join(row) for row in [header] + rows]
+
+    return smer.sme_table_render(header, ["l"] + ["r"] * (len(header) - 1), rows)
+
+
+def budget_check(budgets, results):
+    # Returns the failures at the largest scale
+    r_list = list()
+    r_dict = results[-1][2]
+
+    for name, budget_ms in budgets.items():
+        if name not in r_dict:
+            r_list.append(f"FAIL {name}: not benchmarked")
+        elif r_dict[name] * 1000.0 > budget_ms:
+            r_list.append(
+                f"FAIL {name}: {r_dict[name] * 1000.0:.1f}ms over {budget_ms:.1f}ms"
+            )
+
+    return r_list
+
+
+def main_function(argv=None):
+    parser = argparse.ArgumentParser(description="Scaling benchmark")
+    parser.add_argument("--members", type=int, default=20000)
+    parser.add_argument("--roles", type=int, default=200)
+    parser.add_argument("--pilots", type=int, default=5000)
+    parser.add_argument("--scales", default="0.05,0.1,0.25,0.5,1.0")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--only", help="comma separated command names")
+    parser.add_argument("--csv", action="store_true")
+    parser.add_argument(
+        "--budget", action="append", default=[], help="name=ms, may repeat"
+    )
+    args = parser.parse_args(argv)
+
+    args.scales = sorted(float(ss) for ss in args.scales.split(","))
+    if args.only is not None:
+        args.only = args.only.split(",")
+
+    budgets = dict()
+    for bb in args.budget:
+        name, budget_ms = bb.split("=", 1)
+        budgets[name] = float(budget_ms)
+
+    names, results = asyncio.run(bench_run(args))
+
+    for ll in report_lines(names, results, flag_csv=args.csv):
+        print(ll)
+
+    failures = budget_check(budgets, results)
+    for ll in failures:
+        print(ll)
+
+    if budgets and not failures:
+        print("Budgets met")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_function())
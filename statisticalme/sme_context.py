@@ -0,0 +1,43 @@
+# This file is part of StatisticalMe discord bot.
+#
+# Copyright 2019 by Antony Suter
+#
+# StatisticalMe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# StatisticalMe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with StatisticalMe.  If not, see <https://www.gnu.org/licenses/>.
+
+
+class RequestContext:
+    # Who asked, where, and when, for one command or one background tick.
+    # Handlers get this passed in rather than reading it off MainCommand, so
+    # one awaiting discord can not see another's author or channel.
+    def __init__(self, author, channel, guild, time_now):
+        self.author = author
+        self.channel = channel
+        self.guild = guild
+        self.time_now = time_now
+
+        # Big tables may go out as a file, not where the text is reused
+        self.attach_ok = True
+
+        # Set by MainCommand.auth_level on first use
+        self.auth_level = None
+
+        # Filled in along the way, for latency stats
+        self.path = list()
+        self.timings = dict()
+
+    def path_name(self):
+        return ".".join(self.path) or "-"
+
+    def add_time(self, phase, secs):
+        self.timings[phase] = self.timings.get(phase, 0.0) + secs
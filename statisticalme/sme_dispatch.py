@@ -0,0 +1,249 @@
+# This file is part of StatisticalMe discord bot.
+#
+# Copyright 2019 by Antony Suter
+#
+# StatisticalMe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# StatisticalMe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with StatisticalMe.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import collections
+import io
+import logging
+import time
+
+import aiohttp
+import discord
+
+logger = logging.getLogger("StatisticalMe")
+
+
+class TokenBucket:
+    # rate tokens a second, up to burst saved up
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.time_last = time.monotonic()
+        self.time_paused = 0.0
+
+    def refill(self, time_now):
+        self.tokens = min(
+            float(self.burst), self.tokens + (time_now - self.time_last) * self.rate
+        )
+        self.time_last = time_now
+
+    def wait_time(self):
+        # Seconds until a token can be taken, 0.0 when one is there now
+        time_now = time.monotonic()
+        self.refill(time_now)
+
+        wait = max(0.0, self.time_paused - time_now)
+        if self.tokens < 1.0:
+            wait = max(wait, (1.0 - self.tokens) / self.rate)
+
+        return wait
+
+    def take(self):
+        self.tokens -= 1.0
+
+    def rested(self, time_now):
+        # Full again with no pause left, so no different to a new bucket
+        self.refill(time_now)
+
+        return self.tokens >= self.burst and self.time_paused <= time_now
+
+    def pause(self, secs):
+        # Told to back off, eg: a 429. Nothing saved up survives that.
+        self.tokens = 0.0
+        self.time_paused = max(self.time_paused, time.monotonic() + secs)
+
+
+def retry_delay(exc, attempt, backoff):
+    # Seconds to wait before trying again, or None for no point trying.
+    # discord.py already retries 429s and 5xx itself, and a request that
+    # may have reached discord could post twice, so only a rate limit it
+    # gave up waiting on, or a connection that was never made.
+    delay = None
+
+    if isinstance(exc, discord.RateLimited):
+        delay = float(exc.retry_after)
+    elif isinstance(exc, aiohttp.ClientConnectorError):
+        delay = backoff * 2**attempt
+
+    return delay
+
+
+class OutboundDispatcher:
+    # Messages are queued per route, a channel or a member's DMs, and sent in
+    # order by one worker per route. Routes send side by side, up to
+    # concurrency at once, each paced by its own token bucket. rate=None
+    # turns pacing off, eg: for replay.
+    def __init__(
+        self, rate=1.0, burst=5, concurrency=8, retries=4, backoff=1.0, stats=None
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.stats = stats
+
+        self.routes = dict()
+        self.workers = dict()
+        self.buckets = dict()
+        self.semaphore = None
+        self.idle = None
+
+        self.depth_max = 0
+        self.sent_count = 0
+        self.retry_count = 0
+        self.fail_count = 0
+
+        logger.info("object OutboundDispatcher built")
+
+    def depth(self):
+        return sum(len(queue) for queue in self.routes.values())
+
+    def enqueue(self, dest, content=None, file=None):
+        route_key = getattr(dest, "id", None)
+        if route_key is None:
+            route_key = id(dest)
+
+        queue = self.routes.get(route_key)
+        if queue is None:
+            queue = collections.deque()
+            self.routes[route_key] = queue
+
+        queue.append((dest, content, file, time.perf_counter()))
+
+        depth = self.depth()
+        if depth > self.depth_max:
+            self.depth_max = depth
+
+        if route_key not in self.workers:
+            if self.semaphore is None:
+                self.semaphore = asyncio.Semaphore(self.concurrency)
+                self.idle = asyncio.Event()
+
+            self.idle.clear()
+            self.workers[route_key] = asyncio.get_running_loop().create_task(
+                self.route_worker(route_key)
+            )
+
+    async def route_worker(self, route_key):
+        queue = self.routes[route_key]
+
+        bucket = None
+        if self.rate is not None:
+            bucket = self.buckets.get(route_key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst)
+                self.buckets[route_key] = bucket
+
+        try:
+            while len(queue) > 0:
+                dest, content, file, time_queued = queue[0]
+
+                if bucket is not None:
+                    wait = bucket.wait_time()
+                    while wait > 0.0:
+                        await asyncio.sleep(wait)
+                        wait = bucket.wait_time()
+
+                    bucket.take()
+
+                time_start = time.perf_counter()
+                await self.send_one(bucket, dest, content, file)
+
+                queue.popleft()
+
+                if self.stats is not None:
+                    time_now = time.perf_counter()
+                    self.stats.record("outbound", "queue", time_start - time_queued)
+                    self.stats.record("outbound", "send", time_now - time_start)
+        finally:
+            del self.routes[route_key]
+            del self.workers[route_key]
+
+            self.buckets_prune()
+
+            if len(self.workers) < 1:
+                self.idle.set()
+
+    def buckets_prune(self):
+        # Otherwise every channel and DM ever sent to keeps a bucket. Just
+        # used ones are kept, until a later worker finds them rested.
+        time_now = time.monotonic()
+
+        rested_keys = [
+            route_key
+            for route_key, bucket in self.buckets.items()
+            if route_key not in self.workers and bucket.rested(time_now)
+        ]
+        for route_key in rested_keys:
+            del self.buckets[route_key]
+
+    async def send_one(self, bucket, dest, content, file):
+        attempt = 0
+
+        while True:
+            try:
+                # Only while actually sending, not while backing off
+                async with self.semaphore:
+                    if file is not None:
+                        # A discord.File is used up by sending, so one per try
+                        await dest.send(
+                            content=content,
+                            file=discord.File(
+                                io.BytesIO(file.data), filename=file.filename
+                            ),
+                        )
+                    else:
+                        await dest.send(content)
+
+                self.sent_count += 1
+                return
+            except Exception as exc:
+                delay = None
+                if attempt < self.retries:
+                    delay = retry_delay(exc, attempt, self.backoff)
+
+                if delay is None:
+                    self.fail_count += 1
+                    logger.warning(f"Outbound send to {dest} failed: {exc!r}")
+                    return
+
+                attempt += 1
+                self.retry_count += 1
+                logger.info(f"Outbound send to {dest} retry {attempt} in {delay:.1f}s")
+
+                if bucket is not None:
+                    bucket.pause(delay)
+
+                await asyncio.sleep(delay)
+
+    async def drain(self, timeout=None):
+        # Until everything queued has been sent, or given up on
+        if self.idle is not None and len(self.workers) > 0:
+            try:
+                await asyncio.wait_for(self.idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Outbound drain timed out, {self.depth()} left")
+
+    def info_lines(self):
+        return [
+            f"outbound: {self.depth()} queued (max {self.depth_max}),"
+            f" {len(self.workers)} routes busy, {len(self.buckets)} paced",
+            f"outbound: {self.sent_count} sent, {self.retry_count} retries,"
+            f" {self.fail_count} failed",
+        ]
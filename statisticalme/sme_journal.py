@@ -0,0 +1,79 @@
+# This file is part of StatisticalMe discord bot.
+#
+# Copyright 2019 by Antony Suter
+#
+# StatisticalMe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# StatisticalMe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with StatisticalMe.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import logging
+import os
+
+logger = logging.getLogger("StatisticalMe")
+
+
+def journal_replay(filepath):
+    # Records are absolute values, so replaying a journal over a snapshot that
+    # already contains some of its changes is harmless.
+    try:
+        with open(filepath, "r") as fh:
+            for line_no, line in enumerate(fh, start=1):
+                line = line.strip()
+                if len(line) < 1:
+                    continue
+
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Most likely a torn final write
+                    logger.warning(f"Skipping bad journal record at line {line_no}")
+    except FileNotFoundError:
+        pass
+
+
+class PersdataJournal:
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.record_count = 0
+        self.fh = None
+
+    def open(self):
+        self.record_count = sum(1 for _ in journal_replay(self.filepath))
+        self.fh = open(self.filepath, "a")
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+    def append(self, record):
+        self.fh.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.fh.flush()
+        self.record_count += 1
+
+    def rotate(self, old_filepath):
+        # Moves the records to old_filepath, to be removed once the snapshot
+        # holding them is safely written
+        self.close()
+
+        if os.path.exists(old_filepath):
+            # The previous snapshot never got written, so keep both lots
+            with open(old_filepath, "a") as old_fh, open(self.filepath, "r") as fh:
+                old_fh.write(fh.read())
+
+            os.remove(self.filepath)
+        else:
+            os.replace(self.filepath, old_filepath)
+
+        self.fh = open(self.filepath, "a")
+        self.record_count = 0
@@ -0,0 +1,231 @@
+# This file is part of StatisticalMe discord bot.
+#
+# Copyright 2019 by Antony Suter
+#
+# StatisticalMe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# StatisticalMe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with StatisticalMe.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+
+import statisticalme.statisticalme as smer
+
+logger = logging.getLogger("StatisticalMe")
+
+
+def member_names(memb):
+    # Every name a member can be asked for by: nick, then account names
+    r_list = list()
+
+    for attr in ["nick", "global_name", "name"]:
+        name = getattr(memb, attr, None)
+        if name and name not in r_list:
+            r_list.append(name)
+
+    return r_list
+
+
+class TrieNode:
+    __slots__ = ["children", "ids", "name"]
+
+    def __init__(self):
+        self.children = dict()
+        self.ids = None
+        self.name = None
+
+
+class NameIndex:
+    # Member names both ways, kept current from guild events. Lookups are by
+    # normalized name, so are caseless. A trie over the normalized names
+    # answers prefix lookups, and near misses for suggestions.
+    def __init__(self):
+        self.display = dict()
+        self.raw_names = dict()
+        self.by_name = dict()
+        self.trie = TrieNode()
+
+        logger.info("object NameIndex built")
+
+    def build(self, guild):
+        self.display = dict()
+        self.raw_names = dict()
+        self.by_name = dict()
+        self.trie = TrieNode()
+
+        for memb in guild.members:
+            self.member_set(memb)
+
+    def trie_add(self, key, name):
+        node = self.trie
+        for ch in key:
+            child = node.children.get(ch)
+            if child is None:
+                child = TrieNode()
+                node.children[ch] = child
+            node = child
+
+        # The trie shares the id dict with by_name
+        node.ids = self.by_name[key]
+        node.name = name
+
+    def trie_remove(self, key):
+        path = [self.trie]
+        for ch in key:
+            node = path[-1].children.get(ch)
+            if node is None:
+                return
+            path.append(node)
+
+        path[-1].ids = None
+        path[-1].name = None
+
+        # Prune the nodes left with nothing under them
+        for nn in range(len(key), 0, -1):
+            node = path[nn]
+            if node.ids is not None or len(node.children) > 0:
+                break
+
+            del path[nn - 1].children[key[nn - 1]]
+
+    def member_set(self, memb):
+        self.member_remove(memb.id)
+
+        names = member_names(memb)
+        self.display[memb.id] = getattr(memb, "nick", None) or memb.name or ""
+        self.raw_names[memb.id] = names
+
+        for name in names:
+            key = smer.sme_utils_normalize_caseless(name)
+            ids = self.by_name.get(key)
+            if ids is None:
+                ids = dict()
+                self.by_name[key] = ids
+                self.trie_add(key, name)
+
+            ids[memb.id] = None
+
+    def member_remove(self, memb_id):
+        self.display.pop(memb_id, None)
+
+        for name in self.raw_names.pop(memb_id, list()):
+            key = smer.sme_utils_normalize_caseless(name)
+            ids = self.by_name.get(key)
+            if ids is not None:
+                ids.pop(memb_id, None)
+                if len(ids) < 1:
+                    del self.by_name[key]
+                    self.trie_remove(key)
+
+    def display_name(self, memb_id):
+        return self.display.get(memb_id)
+
+    def lookup(self, name):
+        # Member ids with this name, one asked for exactly as written first
+        ids = list(self.by_name.get(smer.sme_utils_normalize_caseless(name), ()))
+
+        for nn, memb_id in enumerate(ids):
+            if name in self.raw_names[memb_id]:
+                ids.insert(0, ids.pop(nn))
+                break
+
+        return ids
+
+    def prefix(self, prefix, limit=None):
+        # Member ids with any name starting with prefix
+        node = self.trie
+        for ch in smer.sme_utils_normalize_caseless(prefix):
+            node = node.children.get(ch)
+            if node is None:
+                return list()
+
+        ids = dict()
+        stack = [node]
+        while len(stack) > 0 and (limit is None or len(ids) < limit):
+            node = stack.pop()
+            if node.ids is not None:
+                ids.update(node.ids)
+
+            stack.extend(node.children.values())
+
+        return list(ids)
+
+    def resolve(self, name):
+        # A member id by exact name, else by a prefix only one member has
+        r_id = None
+
+        ids = self.lookup(name)
+        if len(ids) > 0:
+            r_id = ids[0]
+        else:
+            ids = self.prefix(name, limit=2)
+            if len(ids) == 1:
+                r_id = ids[0]
+
+        return r_id
+
+    def can_match(self, node, key, nn):
+        if nn < len(key):
+            return key[nn] in node.children
+
+        return node.ids is not None
+
+    def suggest(self, name, max_dist=None, limit=5):
+        # Names within max_dist edits of name, nearest first. Walks the trie
+        # in layers, one per edit, where a state is a trie node and how much
+        # of name is matched. Matches stay in the layer, edits go to the next.
+        key = smer.sme_utils_normalize_caseless(name)
+        if max_dist is None:
+            max_dist = 1 if len(key) <= 4 else 2
+
+        found = dict()
+        seen = set()
+        layer = [(self.trie, 0)]
+
+        for dist in range(max_dist + 1):
+            next_layer = list()
+
+            while len(layer) > 0:
+                node, nn = layer.pop()
+
+                state = (id(node), nn)
+                if state in seen:
+                    continue
+                seen.add(state)
+
+                if nn < len(key):
+                    child = node.children.get(key[nn])
+                    if child is not None:
+                        layer.append((child, nn + 1))
+                elif node.ids is not None and node.name not in found:
+                    found[node.name] = dist
+
+                if dist < max_dist:
+                    if nn < len(key):
+                        next_layer.append((node, nn + 1))
+
+                    # Into the last layer only states that can go on matching
+                    last = dist + 1 == max_dist
+                    for ch, child in node.children.items():
+                        if not last or self.can_match(child, key, nn):
+                            next_layer.append((child, nn))
+                        if nn < len(key) and ch != key[nn]:
+                            if not last or self.can_match(child, key, nn + 1):
+                                next_layer.append((child, nn + 1))
+
+            layer = next_layer
+
+        r_list = sorted(found, key=lambda name: (found[name], name))
+
+        return r_list[:limit]
+
+    def info_lines(self):
+        return [f"name index: {len(self.display)} members, {len(self.by_name)} names"]
@@ -36,7 +36,7 @@ class CommandParse:
             auth_fn,
         ]
 
-    async def do_command(self, param_list):
+    async def do_command(self, ctx, param_list):
         return_list = []
 
         if len(param_list) >= 1:
@@ -47,12 +47,13 @@ class CommandParse:
                 pparams = param_list[1:]
 
             if pcommand in self.params:
+                ctx.path.append(pcommand)
                 object_flag, value, auth_fn = self.params[pcommand]
-                if auth_fn is None or auth_fn():
+                if auth_fn is None or auth_fn(ctx):
                     if object_flag:
-                        return_list = return_list + await value.do_command(pparams)
+                        return_list = return_list + await value.do_command(ctx, pparams)
                     else:
-                        return_list = return_list + await value(pparams)
+                        return_list = return_list + await value(ctx, pparams)
                 else:
                     logger.warning("Command denied")
             else:
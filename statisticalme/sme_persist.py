@@ -0,0 +1,177 @@
+# This file is part of StatisticalMe discord bot.
+#
+# Copyright 2019 by Antony Suter
+#
+# StatisticalMe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# StatisticalMe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with StatisticalMe.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import os
+import sys
+import time
+import traceback
+
+logger = logging.getLogger("StatisticalMe")
+
+
+def atomic_write(filepath, data):
+    # A crash leaves either the old file or the new one, never a truncated one
+    tmp_filepath = filepath + ".tmp"
+
+    with open(tmp_filepath, "wb") as fh:
+        fh.write(data)
+        fh.flush()
+        os.fsync(fh.fileno())
+
+    os.replace(tmp_filepath, filepath)
+
+    return len(data)
+
+
+def atomic_write_all(writes):
+    nbytes = 0
+
+    for write in writes:
+        if callable(write):
+            # eg: a database transaction, kept off the event loop the same way
+            nbytes += write()
+        else:
+            filepath, data = write
+            nbytes += atomic_write(filepath, data)
+
+    return nbytes
+
+
+class PersistWorker:
+    def __init__(self, snapshot_fn, done_fn, save_window=2.0):
+        # snapshot_fn(force) runs on the event loop, so handlers can not change
+        # data while it is encoded, and returns (writes, flags). Writes are
+        # (filepath, data) pairs or callables, and run in a thread. Then
+        # done_fn(flags, ok) runs back on the event loop, with flags None when
+        # the snapshot itself failed part way.
+        self.snapshot_fn = snapshot_fn
+        self.done_fn = done_fn
+        self.save_window = save_window
+
+        self.task = None
+        self.lock = None
+        self.pending = False
+
+        self.save_count = 0
+        self.save_fail_count = 0
+        self.save_bytes = 0
+        self.save_latency = 0.0
+        self.save_latency_max = 0.0
+
+    def request(self):
+        if self.task is None or self.task.done():
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+
+            if loop is not None:
+                self.task = loop.create_task(self.debounced_flush())
+            else:
+                # Not running yet, eg: startup
+                self.flush_now()
+        else:
+            # The running task saves again, if it is already saving
+            self.pending = True
+
+    async def debounced_flush(self):
+        # Everything marked dirty during the window goes out in one save
+        self.pending = True
+
+        while self.pending:
+            await asyncio.sleep(self.save_window)
+            self.pending = False
+            await self.flush()
+
+    async def flush(self, force=False):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+
+        async with self.lock:
+            time_start = time.perf_counter()
+
+            ok = True
+            nbytes = 0
+            flags = None
+            try:
+                writes, flags = self.snapshot_fn(force)
+
+                if writes:
+                    loop = asyncio.get_running_loop()
+                    nbytes = await loop.run_in_executor(None, atomic_write_all, writes)
+            except Exception:
+                ok = False
+                self.save_failed()
+
+            self.done_fn(flags, ok)
+            self.save_done(time_start, nbytes, ok, flags)
+
+    async def write(self, writes):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, atomic_write_all, writes)
+
+    def flush_now(self, force=False):
+        time_start = time.perf_counter()
+
+        ok = True
+        nbytes = 0
+        flags = None
+        try:
+            writes, flags = self.snapshot_fn(force)
+            nbytes = atomic_write_all(writes)
+        except Exception:
+            ok = False
+            self.save_failed()
+
+        self.done_fn(flags, ok)
+        self.save_done(time_start, nbytes, ok, flags)
+
+    def save_failed(self):
+        exc_type, exc_value, exc_tb = sys.exc_info()
+        tbe = traceback.TracebackException(exc_type, exc_value, exc_tb)
+        logger.error("PersistWorker save failed\n" + "".join(tbe.format()))
+
+    def save_done(self, time_start, nbytes, ok, flags):
+        # A snapshot that failed part way has no flags, but is still a failed save
+        if flags or not ok:
+            latency = time.perf_counter() - time_start
+
+            if ok:
+                self.save_count += 1
+            else:
+                self.save_fail_count += 1
+
+            self.save_bytes = nbytes
+            self.save_latency = latency
+            if latency > self.save_latency_max:
+                self.save_latency_max = latency
+
+            if ok:
+                logger.debug(
+                    f"Saved {','.join(flags)}: {nbytes} bytes"
+                    f" in {latency * 1000.0:.1f}ms"
+                )
+
+    def info_lines(self):
+        return [
+            f"saves: {self.save_count} ({self.save_fail_count} failed)",
+            f"last save: {self.save_bytes} bytes,"
+            f" {self.save_latency * 1000.0:.1f}ms"
+            f" (max {self.save_latency_max * 1000.0:.1f}ms)",
+        ]
@@ -0,0 +1,524 @@
+# This file is part of StatisticalMe discord bot.
+#
+# Copyright 2019 by Antony Suter
+#
+# StatisticalMe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# StatisticalMe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with StatisticalMe.  If not, see <https://www.gnu.org/licenses/>.
+
+# Runs MainCommand offline. A fake guild stands in for discord, a virtual
+# clock for the time, and a driver feeds it commands and background ticks.
+#
+#   python -m statisticalme.sme_replay script.txt [--data var] [--members N]
+#       [--roles name,name]
+#
+# Script lines are "<seconds> <author id> <channel name> <message>", with
+# seconds counted from the start of the replay. Blank lines and lines
+# starting with # are skipped.
+
+import argparse
+import asyncio
+import copy
+import itertools
+import logging
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+import discord
+
+import statisticalme.statisticalme as smer
+
+from . import sme_dispatch, sme_storage, sme_table
+from .responder import MainCommand
+
+logger = logging.getLogger("StatisticalMe")
+
+control_prefix = "dented-control-message:"
+
+
+class VirtualClock:
+    # Whole seconds, like sme_time_now
+    def __init__(self, time_start=None):
+        if time_start is None:
+            time_start = int(time.time())
+
+        self.now = int(time_start)
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, secs):
+        self.now += int(secs)
+
+
+class FakeMessage:
+    def __init__(self, msg_id, channel, author, content):
+        self.id = msg_id
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.clean_content = content
+
+    async def edit(self, content=None):
+        if content is not None:
+            self.content = content
+            self.clean_content = content
+
+    async def delete(self):
+        self.channel.messages.pop(self.id, None)
+
+
+class FakeHistory:
+    def __init__(self, messages):
+        self.messages = messages
+
+    async def flatten(self):
+        return self.messages
+
+
+class FakeChannel:
+    def __init__(self, guild, channel_id, name):
+        self.guild = guild
+        self.id = channel_id
+        self.name = name
+        self.messages = dict()
+        self.send_count = 0
+
+    def __str__(self):
+        return self.name
+
+    async def send(self, content=None, file=None):
+        self.send_count += 1
+        msg = FakeMessage(self.guild.next_id(), self, self.guild.me, content)
+        self.messages[msg.id] = msg
+
+        return msg
+
+    async def fetch_message(self, msg_id):
+        msg = self.messages.get(msg_id)
+
+        if msg is None:
+            response = types.SimpleNamespace(status=404, reason="Not Found")
+            raise discord.NotFound(response, "Unknown Message")
+
+        return msg
+
+    def history(self, limit=100, oldest_first=False):
+        msgs = list(self.messages.values())
+        if not oldest_first:
+            msgs.reverse()
+
+        return FakeHistory(msgs[:limit])
+
+    async def purge(self, limit=100, after=None):
+        msgs = list(self.messages.values())
+        if after is not None:
+            msgs = [mm for mm in msgs if mm.id > after.id]
+
+        msgs = msgs[-limit:]
+        for mm in msgs:
+            self.messages.pop(mm.id, None)
+
+        return msgs
+
+
+class FakeRole:
+    def __init__(self, guild, role_id, name):
+        self.guild = guild
+        self.id = role_id
+        self.name = name
+        self.members = list()
+        self.mention = f"<@&{role_id}>"
+
+    def __str__(self):
+        return self.name
+
+
+class FakeMember:
+    def __init__(self, guild, member_id, name, nick=None):
+        self.guild = guild
+        self.id = member_id
+        self.name = name
+        self.nick = nick
+        self.roles = list()
+        self.mention = f"<@{member_id}>"
+        self.dm_messages = list()
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def display_name(self):
+        return self.nick or self.name
+
+    async def send(self, content=None, file=None):
+        msg = FakeMessage(self.guild.next_id(), None, self.guild.me, content)
+        self.dm_messages.append(msg)
+
+        return msg
+
+    async def add_roles(self, *roles, reason=None, atomic=True):
+        before = self.before()
+
+        for role in roles:
+            if role not in self.roles:
+                self.roles.append(role)
+                role.members.append(self)
+
+        self.guild.event("member_update", before, self)
+
+    async def remove_roles(self, *roles, reason=None, atomic=True):
+        before = self.before()
+
+        for role in roles:
+            if role in self.roles:
+                self.roles.remove(role)
+                role.members.remove(self)
+
+        self.guild.event("member_update", before, self)
+
+    def rename(self, name=None, nick=None):
+        before = self.before()
+
+        if name is not None:
+            self.name = name
+        self.nick = nick
+
+        self.guild.event("member_update", before, self)
+
+    def before(self):
+        before = copy.copy(self)
+        before.roles = list(self.roles)
+
+        return before
+
+
+class FakeGuild:
+    # Just the parts of discord.Guild that MainCommand uses. Changes made
+    # through it are passed to listener, as the gateway events would be.
+    def __init__(self, guild_id=1, name="Replay"):
+        self.id_counter = itertools.count(1000000)
+        self.listener = None
+
+        self.id = guild_id
+        self.name = name
+        self.members = list()
+        self.roles = list()
+        self.channels = list()
+
+        self.member_by_id = dict()
+        self.role_by_id = dict()
+        self.channel_by_id = dict()
+        self.channel_by_name = dict()
+
+        self.me = self.add_member("StatisticalMe")
+
+    def __str__(self):
+        return self.name
+
+    def next_id(self):
+        return next(self.id_counter)
+
+    def event(self, name, *args):
+        if self.listener is not None:
+            getattr(self.listener, name)(*args)
+
+    def add_member(self, name, member_id=None, nick=None):
+        if member_id is None:
+            member_id = self.next_id()
+
+        memb = FakeMember(self, member_id, name, nick=nick)
+        self.members.append(memb)
+        self.member_by_id[member_id] = memb
+        self.event("member_join", memb)
+
+        return memb
+
+    def remove_member(self, memb):
+        for role in memb.roles:
+            role.members.remove(memb)
+
+        self.members.remove(memb)
+        del self.member_by_id[memb.id]
+        self.event("member_remove", memb)
+
+    def add_role(self, name, members=(), role_id=None):
+        if role_id is None:
+            role_id = self.next_id()
+
+        role = FakeRole(self, role_id, name)
+        self.roles.append(role)
+        self.role_by_id[role_id] = role
+        self.event("role_create", role)
+
+        for memb in members:
+            before = memb.before()
+            memb.roles.append(role)
+            role.members.append(memb)
+            self.event("member_update", before, memb)
+
+        return role
+
+    def remove_role(self, role):
+        for memb in role.members:
+            memb.roles.remove(role)
+
+        self.roles.remove(role)
+        del self.role_by_id[role.id]
+        self.event("role_delete", role)
+
+    def add_channel(self, name, channel_id=None):
+        if channel_id is None:
+            channel_id = self.next_id()
+
+        chan = FakeChannel(self, channel_id, name)
+        self.channels.append(chan)
+        self.channel_by_id[channel_id] = chan
+        self.channel_by_name[name] = chan
+
+        return chan
+
+    def get_member(self, member_id):
+        return self.member_by_id.get(member_id)
+
+    def get_member_named(self, name):
+        for memb in self.members:
+            if memb.name == name or memb.nick == name:
+                return memb
+
+        return None
+
+    def get_role(self, role_id):
+        return self.role_by_id.get(role_id)
+
+    def get_channel(self, channel_id):
+        return self.channel_by_id.get(channel_id)
+
+
+class ReplayDriver:
+    # Sends commands through MainCommand the way SmeClient.on_message does,
+    # and runs a background tick every tick_seconds of virtual time while
+    # the real bot would have its background loop running.
+    def __init__(self, mainc, guild, clock, tick_seconds=5):
+        self.mainc = mainc
+        self.guild = guild
+        self.guild.listener = mainc
+        self.clock = clock
+        self.tick_seconds = tick_seconds
+        self.next_tick = clock() + tick_seconds
+
+        self.command_count = 0
+        self.ignored_count = 0
+        self.tick_count = 0
+        self.reply_count = 0
+        self.time_busy = 0.0
+
+        logger.info("object ReplayDriver built")
+
+    def member_for(self, member_id):
+        memb = self.guild.get_member(member_id)
+
+        if memb is None:
+            memb = self.guild.add_member(f"pilot{member_id}", member_id=member_id)
+
+        return memb
+
+    def channel_for(self, name):
+        chan = self.guild.channel_by_name.get(name)
+
+        if chan is None:
+            chan = self.guild.add_channel(name)
+
+        return chan
+
+    async def command(self, author, channel, content):
+        # Returns the replies queued, or None when the bot would not answer
+        time_start = time.perf_counter()
+
+        route = self.mainc.alias_router.route(content, self.guild.id)
+        if route is None or route[0] != "command":
+            self.ignored_count += 1
+            return None
+
+        ctx = self.mainc.request_context(author, channel)
+
+        time_parse = time.perf_counter()
+        params = smer.sme_utils_shellwords(content)
+        ctx.add_time("parse", time.perf_counter() - time_parse)
+
+        msg_list = await self.mainc.on_message(ctx, route[1] + params[1:])
+
+        time_send = time.perf_counter()
+        sent = list()
+        for mm in msg_list:
+            if isinstance(mm, str) and mm.startswith(control_prefix):
+                continue
+
+            if isinstance(mm, sme_table.Attachment):
+                self.mainc.dispatcher.enqueue(channel, mm.content, file=mm)
+                sent.append(mm)
+            elif len(mm) > 0:
+                self.mainc.dispatcher.enqueue(channel, mm)
+                sent.append(mm)
+
+        self.mainc.request_sent(ctx, time.perf_counter() - time_send)
+
+        self.command_count += 1
+        self.reply_count += len(sent)
+        self.time_busy += time.perf_counter() - time_start
+
+        return sent
+
+    async def tick(self):
+        time_start = time.perf_counter()
+
+        await self.mainc.background_update_all()
+
+        self.tick_count += 1
+        self.time_busy += time.perf_counter() - time_start
+
+    async def advance_to(self, time_to):
+        # Background ticks due on the way, then the clock ends at time_to
+        while self.next_tick <= time_to:
+            self.clock.now = max(self.clock.now, self.next_tick)
+            if self.mainc.test_background_update_needed():
+                await self.tick()
+
+            self.next_tick += self.tick_seconds
+
+        self.clock.now = max(self.clock.now, time_to)
+
+    async def run(self, events):
+        # events: (seconds from start, author id, channel name, message)
+        time_base = self.clock()
+
+        for at_secs, author_id, channel_name, content in events:
+            await self.advance_to(time_base + at_secs)
+            await self.command(
+                self.member_for(author_id), self.channel_for(channel_name), content
+            )
+
+        await self.mainc.dispatcher.drain()
+
+    def report_lines(self):
+        r_list = list()
+
+        rate = 0.0
+        if self.time_busy > 0.0:
+            rate = self.command_count / self.time_busy
+
+        r_list.append(
+            f"commands: {self.command_count} ({self.ignored_count} ignored),"
+            f" replies: {self.reply_count}, background ticks: {self.tick_count}"
+        )
+        r_list.append(f"busy: {self.time_busy:.3f}s, {rate:.1f} commands/s")
+
+        rows = self.mainc.stats.rows()
+        if rows:
+            r_list += smer.sme_table_render(
+                ["Command", "phase", "n", "p50ms", "p95ms", "p99ms"],
+                ["l", "l", "r", "r", "r", "r"],
+                [[str(cell) for cell in row] for row in rows],
+            )
+
+        return r_list
+
+
+def script_load(filepath):
+    events = list()
+
+    with open(filepath, "r", encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if len(line) < 1 or line[0] == "#":
+                continue
+
+            at_secs, author_id, channel_name, content = line.split(None, 3)
+            events.append((float(at_secs), int(author_id), channel_name, content))
+
+    return events
+
+
+def replay_guild(dev_author_id, members=0, roles=()):
+    guild = FakeGuild()
+    guild.add_member("dev", member_id=dev_author_id)
+
+    for nn in range(members):
+        guild.add_member(f"pilot{nn}")
+
+    # Empty, for scripts to add members to
+    for role_name in roles:
+        guild.add_role(role_name)
+
+    return guild
+
+
+async def replay_run(args, var_dir):
+    clock = VirtualClock()
+    guild = replay_guild(
+        args.dev,
+        members=args.members,
+        roles=[rr for rr in args.roles.split(",") if len(rr) > 0],
+    )
+
+    mainc = MainCommand(
+        [args.dev],
+        args.channels,
+        storage=sme_storage.storage_from_name(args.storage, var_dir),
+        save_window=args.save_window,
+        dispatcher=sme_dispatch.OutboundDispatcher(rate=None),
+        time_source=clock,
+        background_autostart=False,
+    )
+    mainc.set_guild(guild)
+
+    driver = ReplayDriver(mainc, guild, clock, tick_seconds=args.tick)
+    await driver.run(script_load(args.script))
+
+    await mainc.persist.flush(force=True)
+    await mainc.aiohttp_session.close()
+
+    return driver.report_lines()
+
+
+def main_function(argv=None):
+    parser = argparse.ArgumentParser(description="Replay commands offline")
+    parser.add_argument("script", help="file of commands to replay")
+    parser.add_argument("--data", help="var directory to copy data from")
+    parser.add_argument("--storage", default="json", help="json or sqlite")
+    parser.add_argument("--members", type=int, default=0, help="extra members")
+    parser.add_argument("--roles", default="", help="role names, comma separated")
+    parser.add_argument("--dev", type=int, default=1, help="dev author id")
+    parser.add_argument("--channels", default="", help="ok channel names")
+    parser.add_argument("--tick", type=int, default=5, help="background seconds")
+    parser.add_argument("--save-window", type=float, default=2.0)
+    args = parser.parse_args(argv)
+
+    # Never touch the data replayed from
+    var_dir = tempfile.mkdtemp(prefix="sme-replay-")
+    try:
+        if args.data is not None:
+            shutil.copytree(args.data, var_dir, dirs_exist_ok=True)
+
+        for ll in asyncio.run(replay_run(args, var_dir)):
+            print(ll)
+    finally:
+        shutil.rmtree(var_dir, ignore_errors=True)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_function())
@@ -0,0 +1,70 @@
+# This file is part of StatisticalMe discord bot.
+#
+# Copyright 2019 by Antony Suter
+#
+# StatisticalMe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# StatisticalMe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with StatisticalMe.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+
+logger = logging.getLogger("StatisticalMe")
+
+
+class RoleIndex:
+    # Member ids by role id. discord.py works out role.members by scanning
+    # every member of the guild, this is kept current from guild events.
+    # Each role's members are a dict used as an ordered set, in guild order
+    # at build and then in the order they got the role.
+    def __init__(self):
+        self.role_members = dict()
+        self.no_members = dict()
+
+        logger.info("object RoleIndex built")
+
+    def build(self, guild):
+        self.role_members = {role.id: dict() for role in guild.roles}
+
+        for memb in guild.members:
+            for role in memb.roles:
+                self.role_members.setdefault(role.id, dict())[memb.id] = None
+
+    def member_ids(self, role_id):
+        return self.role_members.get(role_id, self.no_members).keys()
+
+    def member_count(self, role_id):
+        return len(self.role_members.get(role_id, self.no_members))
+
+    def member_update(self, memb_id, role_ids_before, role_ids_after):
+        for role_id in role_ids_after - role_ids_before:
+            self.role_members.setdefault(role_id, dict())[memb_id] = None
+
+        for role_id in role_ids_before - role_ids_after:
+            self.role_members.get(role_id, self.no_members).pop(memb_id, None)
+
+    def member_join(self, memb_id, role_ids):
+        self.member_update(memb_id, set(), role_ids)
+
+    def member_remove(self, memb_id, role_ids):
+        self.member_update(memb_id, role_ids, set())
+
+    def role_create(self, role_id):
+        self.role_members.setdefault(role_id, dict())
+
+    def role_delete(self, role_id):
+        self.role_members.pop(role_id, None)
+
+    def info_lines(self):
+        return [
+            f"role index: {len(self.role_members)} roles,"
+            f" {sum([len(mm) for mm in self.role_members.values()])} memberships"
+        ]
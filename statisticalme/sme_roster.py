@@ -0,0 +1,302 @@
+# This file is part of StatisticalMe discord bot.
+#
+# Copyright 2019 by Antony Suter
+#
+# StatisticalMe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# StatisticalMe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with StatisticalMe.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+
+logger = logging.getLogger("StatisticalMe")
+
+level_min = 0
+level_max = 255
+
+
+def clamp_level(value):
+    return max(level_min, min(level_max, int(value)))
+
+
+def player_id_ok(playerid):
+    # Discord ids, which snapshots keep as u64
+    return (
+        playerid.isascii()
+        and playerid.isdigit()
+        and str(int(playerid)) == playerid
+        and int(playerid) < 2**64
+    )
+
+
+class DerivedColumn:
+    # A stat worked out from tech levels. formula is called with the levels
+    # of the input tech indexes, in order.
+    def __init__(self, name, label, inputs, formula):
+        self.name = name
+        self.label = label
+        self.inputs = tuple(inputs)
+        self.formula = formula
+
+    def value(self, matrix, base):
+        return self.formula(*[matrix[base + index] for index in self.inputs])
+
+
+class Roster:
+    # Tech levels for every player in one uint8 matrix, a row per player and
+    # a column per tech key. Player info lives in a separate table by row.
+    # An info entry that is still an int is the player's row in a snapshot,
+    # and is only read from info_reader when first wanted.
+    # Derived columns are kept in their own table by row, and only worked
+    # out again when one of their inputs is set. They are never saved.
+    def __init__(self, width):
+        self.width = width
+        self.matrix = bytearray()
+        self.row_index = dict()
+        self.row_ids = list()
+        self.info = list()
+        self.info_reader = None
+        self.zero_row = bytes(width)
+
+        self.derived = ()
+        self.derived_index = dict()
+        self.derived_by_input = dict()
+        self.derived_values = list()
+        self.derived_zero = list()
+
+    def set_derived(self, columns):
+        self.derived = tuple(columns)
+        self.derived_index = {dc.name: nn for nn, dc in enumerate(self.derived)}
+
+        by_input = dict()
+        for nn, dc in enumerate(self.derived):
+            for index in dc.inputs:
+                by_input.setdefault(index, list()).append(nn)
+        self.derived_by_input = {index: tuple(nns) for index, nns in by_input.items()}
+
+        self.derived_zero = [dc.value(self.zero_row, 0) for dc in self.derived]
+
+        self.derived_values = list()
+        for row in range(len(self.row_ids)):
+            base = row * self.width
+            self.derived_values.extend(
+                [dc.value(self.matrix, base) for dc in self.derived]
+            )
+
+    def __contains__(self, playerid):
+        return playerid in self.row_index
+
+    def __len__(self):
+        return len(self.row_ids)
+
+    def __iter__(self):
+        return iter(list(self.row_ids))
+
+    def row_of(self, playerid):
+        return self.row_index.get(playerid, -1)
+
+    def ensure_row(self, playerid):
+        row = self.row_index.get(playerid, -1)
+
+        if row < 0:
+            row = len(self.row_ids)
+            self.row_index[playerid] = row
+            self.row_ids.append(playerid)
+            self.info.append(dict())
+            self.matrix.extend(self.zero_row)
+            self.derived_values.extend(self.derived_zero)
+
+        return row
+
+    def ensure_rows(self, playerids):
+        # As ensure_row for each, growing the tables once
+        new_ids = [pid for pid in dict.fromkeys(playerids) if pid not in self.row_index]
+
+        if len(new_ids) > 0:
+            row = len(self.row_ids)
+            self.row_index.update(zip(new_ids, range(row, row + len(new_ids))))
+            self.row_ids.extend(new_ids)
+            self.info.extend([dict() for _ in new_ids])
+            self.matrix.extend(bytes(self.width * len(new_ids)))
+            self.derived_values.extend(self.derived_zero * len(new_ids))
+
+        return len(new_ids)
+
+    def remove(self, playerid):
+        row = self.row_index.pop(playerid, -1)
+
+        if row >= 0:
+            # Move the last row into the hole to keep the matrix contiguous
+            last = len(self.row_ids) - 1
+            if row != last:
+                last_id = self.row_ids[last]
+                self.row_ids[row] = last_id
+                self.info[row] = self.info[last]
+                self.row_index[last_id] = row
+                self.matrix[row * self.width : (row + 1) * self.width] = self.matrix[
+                    last * self.width :
+                ]
+
+                dw = len(self.derived)
+                self.derived_values[row * dw : (row + 1) * dw] = self.derived_values[
+                    last * dw :
+                ]
+
+            self.row_ids.pop()
+            self.info.pop()
+            del self.matrix[last * self.width :]
+            del self.derived_values[last * len(self.derived) :]
+
+    def tech_get(self, row, index):
+        r_value = 0
+
+        if row >= 0:
+            r_value = self.matrix[row * self.width + index]
+
+        return r_value
+
+    def tech_set(self, row, index, value):
+        base = row * self.width
+
+        if self.matrix[base + index] != value:
+            self.matrix[base + index] = value
+
+            dw = len(self.derived)
+            for nn in self.derived_by_input.get(index, ()):
+                self.derived_values[row * dw + nn] = self.derived[nn].value(
+                    self.matrix, base
+                )
+
+    def derived_get(self, row, name):
+        r_value = 0
+
+        nn = self.derived_index.get(name)
+        if row >= 0 and nn is not None:
+            r_value = self.derived_values[row * len(self.derived) + nn]
+
+        return r_value
+
+    def tech_row(self, row):
+        r_row = self.zero_row
+
+        if row >= 0:
+            r_row = self.matrix[row * self.width : (row + 1) * self.width]
+
+        return r_row
+
+    def column(self, index, rows):
+        width = self.width
+        matrix = self.matrix
+
+        return [matrix[row * width + index] if row >= 0 else 0 for row in rows]
+
+    def derived_column(self, name, rows):
+        nn = self.derived_index.get(name)
+        if nn is None:
+            return [0] * len(rows)
+
+        dw = len(self.derived)
+        values = self.derived_values
+
+        return [values[row * dw + nn] if row >= 0 else 0 for row in rows]
+
+    def info_row(self, row):
+        info = self.info[row]
+
+        if isinstance(info, int):
+            info = self.info_reader.info(info)
+            self.info[row] = info
+
+        return info
+
+    def info_get(self, row, infoname):
+        r_value = None
+
+        if row >= 0:
+            r_value = self.info_row(row).get(infoname)
+
+        return r_value
+
+    def info_set(self, row, infoname, infovalue):
+        self.info_row(row)[infoname] = infovalue
+
+    def to_players(self):
+        width = self.width
+        matrix = self.matrix
+
+        return {
+            playerid: {
+                "tech": list(matrix[row * width : (row + 1) * width]),
+                "info": self.info_row(row),
+            }
+            for row, playerid in enumerate(self.row_ids)
+        }
+
+    @classmethod
+    def from_players(cls, width, players, remap=None):
+        # remap, when given, lists (new index, old index) pairs for tech lists
+        # saved under a different tech key order
+        roster = cls(width)
+        flag_clamped = False
+        bad_ids = list()
+
+        for playerid, pp in players.items():
+            if not player_id_ok(playerid):
+                bad_ids.append(playerid)
+                continue
+
+            row = roster.ensure_row(playerid)
+            roster.info[row] = dict(pp.get("info", dict()))
+
+            loaded_tech = pp.get("tech", list())
+            if remap is not None:
+                tech = [0] * width
+                for new_index, old_index in remap:
+                    if old_index < len(loaded_tech):
+                        tech[new_index] = loaded_tech[old_index]
+            else:
+                tech = loaded_tech[:width]
+
+            try:
+                roster.matrix[row * width : row * width + len(tech)] = bytes(tech)
+            except (TypeError, ValueError):
+                flag_clamped = True
+                roster.matrix[row * width : row * width + len(tech)] = bytes(
+                    [clamp_level(tt) for tt in tech]
+                )
+
+        if flag_clamped:
+            logger.warning("Clamped out of range tech levels in persistant data")
+
+        if len(bad_ids) > 0:
+            logger.warning(f"Dropped bad player ids {bad_ids} in persistant data")
+
+        return roster
+
+    @classmethod
+    def from_snapshot(cls, width, reader, remap=None):
+        roster = cls(width)
+
+        roster.row_ids = [str(pid) for pid in reader.player_ids()]
+        roster.row_index = {pid: row for row, pid in enumerate(roster.row_ids)}
+        roster.info = list(range(len(roster.row_ids)))
+        roster.info_reader = reader
+
+        if remap is None:
+            roster.matrix = bytearray(reader.matrix())
+        else:
+            # Whole columns at a time
+            loaded = reader.matrix()
+            roster.matrix = bytearray(width * len(roster.row_ids))
+            for new_index, old_index in remap:
+                roster.matrix[new_index::width] = loaded[old_index :: reader.width]
+
+        return roster
@@ -0,0 +1,99 @@
+# This file is part of StatisticalMe discord bot.
+#
+# Copyright 2019 by Antony Suter
+#
+# StatisticalMe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# StatisticalMe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with StatisticalMe.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import re
+
+logger = logging.getLogger("StatisticalMe")
+
+# In match order: (words after the "!", route, command prefix list)
+builtin_routes = [
+    ("sme dev echo", "echo", []),
+    ("sme dev ping", "ping", []),
+    ("sme", "command", []),
+    ("gt", "command", ["tech", "list"]),
+    ("away", "command", ["time", "away"]),
+    ("back", "command", ["time", "back"]),
+    ("checkin", "command", ["time", "checkin"]),
+    ("dead", "command", ["ws", "ship", "dead"]),
+    ("ship", "command", ["ws", "ship"]),
+    ("st", "command", ["tech", "set"]),
+    ("tr", "command", ["tech", "report"]),
+    ("time set", "command", ["time"]),  # keeps the 'set'
+    ("time", "command", ["time", "list"]),
+]
+
+alias_name_match = re.compile(r"[a-z][a-z0-9]*$")
+
+
+class AliasRouter:
+    # Everything a guild answers to is one regex alternation, tried in
+    # order, so a message is routed in a single scan. Most messages are chat,
+    # and are turned away on their first character.
+    def __init__(self):
+        self.builtin_names = set(words.split()[0] for words, _, _ in builtin_routes)
+        self.builtin_matcher = self.compile(builtin_routes)
+        self.guild_matchers = dict()
+
+        logger.info("object AliasRouter built")
+
+    @staticmethod
+    def compile(routes):
+        alternatives = list()
+
+        for nn, (words, _, _) in enumerate(routes):
+            pattern = r"\s+".join([re.escape(ww) for ww in words.split()])
+            alternatives.append(f"(?P<r{nn}>{pattern})\\b")
+
+        pattern = re.compile(r"\s*!(?:" + "|".join(alternatives) + ")", re.IGNORECASE)
+
+        return (pattern, [(route, pre_list) for _, route, pre_list in routes])
+
+    def is_alias_name_ok(self, alias_name):
+        return (
+            alias_name_match.match(alias_name) is not None
+            and alias_name not in self.builtin_names
+        )
+
+    def set_guild_aliases(self, guild_id, aliases):
+        # aliases maps alias name to command prefix list. Built in routes
+        # come first, so an alias can never hide one.
+        if aliases:
+            self.guild_matchers[guild_id] = self.compile(
+                builtin_routes
+                + [
+                    (alias_name, "command", list(pre_list))
+                    for alias_name, pre_list in sorted(aliases.items())
+                    if self.is_alias_name_ok(alias_name)
+                ]
+            )
+        else:
+            self.guild_matchers.pop(guild_id, None)
+
+    def route(self, content, guild_id=None):
+        # Returns (route, command prefix list), or None for anything else
+        first = content[:1]
+        if first != "!" and not (first.isspace() and content.lstrip()[:1] == "!"):
+            return None
+
+        pattern, routes = self.guild_matchers.get(guild_id, self.builtin_matcher)
+
+        mm = pattern.match(content)
+        if mm is None:
+            return None
+
+        return routes[int(mm.lastgroup[1:])]
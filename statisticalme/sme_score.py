@@ -0,0 +1,315 @@
+# This file is part of StatisticalMe discord bot.
+#
+# Copyright 2019 by Antony Suter
+#
+# StatisticalMe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# StatisticalMe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with StatisticalMe.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import math
+from operator import itemgetter
+
+logger = logging.getLogger("StatisticalMe")
+
+ws_rules = ["201206", "210918"]
+extra_keys = ["relics", "entrust", "dispatch", "dart", "relicdrone"]
+first_weapon_keys = ["battery", "laser"]
+main_shield_keys = ["passiveshield", "omegashield", "mirrorshield"]
+area_shield_keys = ["areashield", "deltashield"]
+detail_keys = ["aa", "mi", "s1", "s2", "we", "sh"]
+
+
+def points_table(tweights):
+    # Points by level, level 0 scores nothing. Levels past the end of the
+    # weights raise IndexError, which scores the whole pilot as 0.
+    return (0,) + tuple(tweights)
+
+
+class CompiledWeights:
+    def __init__(self, teh, score_key, ww):
+        self.rule = score_key if score_key in ws_rules else None
+        self.dart_bonus = score_key == "210918"
+
+        weapon_keys = teh.tech_key_range_list("weapon")
+        if score_key == "201206":
+            weapon_keys = [tkey for tkey in weapon_keys if tkey not in ["dart"]]
+
+        self.extras = self.scored(teh, ww, extra_keys)
+        self.mining = self.scored(teh, ww, teh.tech_key_range_list("mining"))
+        self.support = self.scored(teh, ww, teh.tech_key_range_list("support"))
+        self.weapon = self.scored(teh, ww, weapon_keys)
+        self.shield = self.scored(teh, ww, teh.tech_key_range_list("shield"))
+        self.miner_index = teh.get_tech_index("miner")
+        self.bs_index = teh.get_tech_index("bs")
+
+        # Otherwise tech[-1] would quietly score the last tech in their place
+        if self.rule is not None and (self.miner_index < 0 or self.bs_index < 0):
+            raise ValueError(f"Weights {score_key} need miner and bs techs")
+
+        self.generic = [
+            (index, points_table(ww[tkey]))
+            for index, tkey in enumerate(teh.tech_keys)
+            if tkey in ww
+        ]
+
+    @staticmethod
+    def scored(teh, ww, keys):
+        # Keys that are not techs can only ever be level 0, so never score
+        return [
+            (tkey, teh.get_tech_index(tkey), points_table(ww[tkey]))
+            for tkey in keys
+            if tkey in ww and teh.get_tech_index(tkey) >= 0
+        ]
+
+
+class ScoreEngine:
+    # Scores many pilots at once against weight sets compiled on first use.
+    # derived_get(row, techname) supplies techs that are not roster columns.
+    # Scores are cached by player then weight key, and a player's entries
+    # must be invalidated whenever their tech changes.
+    def __init__(self, teh, weights, derived_get):
+        self.teh = teh
+        self.weights = weights
+        self.derived_get = derived_get
+        self.compiled = dict()
+
+        self.cache = dict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        logger.info("object ScoreEngine built")
+
+    def set_weights(self, weights):
+        self.weights = weights
+        self.compiled = dict()
+        self.cache = dict()
+
+    def invalidate(self, playerid):
+        self.cache.pop(playerid, None)
+
+    def info_lines(self):
+        return [
+            f"score cache: {len(self.cache)} pilots,"
+            f" {self.cache_hits} hits, {self.cache_misses} misses"
+        ]
+
+    def compiled_for(self, score_key):
+        cw = self.compiled.get(score_key)
+
+        if cw is None:
+            cw = CompiledWeights(self.teh, score_key, self.weights[score_key])
+            self.compiled[score_key] = cw
+
+        return cw
+
+    def score_players(self, roster, score_key, playerids, flag_detail=False):
+        # Like score_rows, only computing what is not cached. A cached score
+        # without detail is a miss when detail is wanted.
+        r_list = [None] * len(playerids)
+        missing = list()
+        no_scores = dict()
+
+        for nn, playerid in enumerate(playerids):
+            entry = self.cache.get(playerid, no_scores).get(score_key)
+
+            if entry is not None and (entry[1] is not None or not flag_detail):
+                r_list[nn] = entry
+            else:
+                missing.append(nn)
+
+        self.cache_hits += len(playerids) - len(missing)
+        self.cache_misses += len(missing)
+
+        if len(missing) > 0:
+            rows = [roster.row_of(playerids[nn]) for nn in missing]
+            scores = self.score_rows(roster, score_key, rows, flag_detail=flag_detail)
+
+            for nn, entry in zip(missing, scores):
+                self.cache.setdefault(playerids[nn], dict())[score_key] = entry
+                r_list[nn] = entry
+
+        return r_list
+
+    def score_rows(self, roster, score_key, rows, flag_detail=False):
+        # Returns (score, detail) per row, detail is None without flag_detail
+        cw = self.compiled_for(score_key)
+        r_list = list()
+
+        for row in rows:
+            tech = roster.tech_row(row)
+            detail = None
+            if flag_detail:
+                detail = {dkey: list() for dkey in detail_keys}
+
+            try:
+                if cw.rule is None:
+                    accum = self.score_generic(cw, tech)
+                else:
+                    accum = self.score_ws(cw, row, tech, detail)
+            except IndexError:
+                accum = 0
+
+            r_list.append((accum, detail))
+
+        return r_list
+
+    def score_generic(self, cw, tech):
+        accum = 0
+
+        for index, table in cw.generic:
+            tval = tech[index]
+            if tval > 0:
+                accum += table[tval]
+
+        return accum
+
+    def score_ws(self, cw, row, tech, detail):
+        faccum = list()
+
+        # relics, entrust, dispatch, dart, relicdrone
+        for tkey, index, table in cw.extras:
+            if index < len(tech):
+                tval = tech[index]
+            else:
+                tval = self.derived_get(row, tkey)
+
+            if tval > 0:
+                score = table[tval]
+                if cw.dart_bonus and tkey == "dart":
+                    # Special bonus for dart
+                    score = 50
+
+                faccum.append(float(score))
+                if detail is not None:
+                    detail["aa"].append(f"{tkey} {score}")
+
+        # mining
+        found = self.found(cw.mining, tech)
+        if len(found) > 0:
+            minerlvl = tech[cw.miner_index]
+            mcount = 0
+            if minerlvl >= 2 and minerlvl <= 6:
+                mcount = minerlvl - 1
+
+            fscore = float(0.0)
+            mmax = len(found)
+
+            for zz in range(0, min(mcount, mmax)):
+                fscore += self.take(found[zz], 1.0, detail, "mi")
+
+            if mcount < mmax:
+                for zz in range(mcount, min(mcount * 2 - 2, mmax)):
+                    fscore += self.take(found[zz], 0.5, detail, "mi")
+
+            faccum.append(fscore)
+
+        # support
+        bslvl = tech[cw.bs_index]
+        if bslvl >= 2 and bslvl <= 6:
+            scount = bslvl - 1
+
+            found = self.found(cw.support, tech)
+            if len(found) > 0:
+                fscore = float(0.0)
+                smax = len(found)
+
+                for zz in range(0, min(scount, smax)):
+                    fscore += self.take(found[zz], 1.0, detail, "s1")
+
+                if scount < smax:
+                    for zz in range(scount, min(scount * 2, smax)):
+                        fscore += self.take(found[zz], 0.75, detail, "s1")
+
+                    for zz in range(scount * 2, smax):
+                        fscore += self.take(found[zz], 0.25, detail, "s2")
+
+                faccum.append(fscore)
+
+        # weapons, only the best of battery and laser counts
+        found = self.found(cw.weapon, tech)
+        if len(found) > 0:
+            got_first = False
+            wt2 = list()
+
+            for weapon_tuple in found:
+                if weapon_tuple[0] in first_weapon_keys:
+                    if not got_first:
+                        wt2.append(weapon_tuple)
+                        got_first = True
+                else:
+                    wt2.append(weapon_tuple)
+
+            if len(wt2) > 0:
+                fscore = float(0.0)
+
+                for weapon_tuple, factor in zip(wt2, [1.0, 0.75, 0.5]):
+                    fscore += self.take(weapon_tuple, factor, detail, "we")
+
+                faccum.append(fscore)
+
+        # shields
+        found = self.found(cw.shield, tech)
+        if len(found) > 0:
+            gotmain = False
+            gotareadelta = False
+            st2 = list()
+
+            for ss in found:
+                skey = ss[0]
+
+                if skey in main_shield_keys:
+                    if not gotmain:
+                        st2.append(ss)
+                        gotmain = True
+
+                elif skey in area_shield_keys:
+                    if not gotareadelta:
+                        st2.append(ss)
+                        gotareadelta = True
+                    else:
+                        st2.append((skey, ss[1] * 0.5))
+
+                elif skey in ["blastshield"]:
+                    st2.append(ss)
+
+            fscore = float(0.0)
+
+            for ss in st2:
+                fscore += self.take(ss, 1.0, detail, "sh")
+
+            faccum.append(fscore)
+
+        #
+        faccum.append(0.5)
+        return int(math.floor(math.fsum(faccum)))
+
+    @staticmethod
+    def found(entries, tech):
+        # Scoring techs, best first, ties kept in tech order
+        r_list = [
+            (tkey, score)
+            for tkey, index, table in entries
+            if (score := table[tech[index]]) > 0
+        ]
+        r_list.sort(key=itemgetter(1), reverse=True)
+
+        return r_list
+
+    @staticmethod
+    def take(entry, factor, detail, dkey):
+        iscore = float(entry[1]) * factor
+
+        if detail is not None:
+            detail[dkey].append(f"{entry[0]} {iscore}")
+
+        return iscore
@@ -0,0 +1,112 @@
+# This file is part of StatisticalMe discord bot.
+#
+# Copyright 2019 by Antony Suter
+#
+# StatisticalMe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# StatisticalMe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with StatisticalMe.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import logging
+import mmap
+import struct
+
+logger = logging.getLogger("StatisticalMe")
+
+# Layout, all integers little endian:
+#   header      magic, version, key count, player count
+#   keys        per key: u16 length, utf-8 tech key
+#   player ids  u64 per player
+#   tech matrix one byte per player per key, row major
+#   info index  u64 offset per player, plus one for the end of the last
+#   info        JSON object per player, utf-8
+snapshot_magic = b"SMEB"
+snapshot_version = 1
+header_struct = struct.Struct("<4sHxxII")
+
+
+def snapshot_encode(tech_keys, roster):
+    parts = list()
+
+    parts.append(
+        header_struct.pack(
+            snapshot_magic, snapshot_version, len(tech_keys), len(roster.row_ids)
+        )
+    )
+
+    for key in tech_keys:
+        key_bytes = key.encode("utf-8")
+        parts.append(struct.pack("<H", len(key_bytes)))
+        parts.append(key_bytes)
+
+    parts.append(
+        struct.pack(f"<{len(roster.row_ids)}Q", *[int(pid) for pid in roster.row_ids])
+    )
+    parts.append(bytes(roster.matrix))
+
+    # Rows never loaded are copied as they are, not parsed and encoded again
+    info_parts = list()
+    offsets = [0]
+    for info in roster.info:
+        if isinstance(info, int):
+            info_bytes = roster.info_reader.info_bytes(info)
+        else:
+            info_bytes = json.dumps(info).encode("utf-8")
+        info_parts.append(info_bytes)
+        offsets.append(offsets[-1] + len(info_bytes))
+
+    parts.append(struct.pack(f"<{len(offsets)}Q", *offsets))
+    parts.extend(info_parts)
+
+    return b"".join(parts)
+
+
+class SnapshotReader:
+    def __init__(self, filepath):
+        with open(filepath, "rb") as fh:
+            # The mapping stays valid after the file is closed or replaced
+            self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, n_keys, n_players = header_struct.unpack_from(self.mm, 0)
+        if magic != snapshot_magic or version != snapshot_version:
+            raise ValueError(f"Not a version {snapshot_version} snapshot: {filepath}")
+
+        offset = header_struct.size
+
+        self.tech_keys = list()
+        for _ in range(n_keys):
+            (key_len,) = struct.unpack_from("<H", self.mm, offset)
+            offset += 2
+            self.tech_keys.append(self.mm[offset : offset + key_len].decode("utf-8"))
+            offset += key_len
+
+        self.width = n_keys
+        self.n_players = n_players
+
+        self.ids_offset = offset
+        self.matrix_offset = self.ids_offset + 8 * n_players
+        self.index_offset = self.matrix_offset + n_keys * n_players
+        self.info_offset = self.index_offset + 8 * (n_players + 1)
+
+    def player_ids(self):
+        return struct.unpack_from(f"<{self.n_players}Q", self.mm, self.ids_offset)
+
+    def matrix(self):
+        return self.mm[self.matrix_offset : self.index_offset]
+
+    def info_bytes(self, row):
+        start, end = struct.unpack_from("<QQ", self.mm, self.index_offset + 8 * row)
+
+        return self.mm[self.info_offset + start : self.info_offset + end]
+
+    def info(self, row):
+        return json.loads(self.info_bytes(row))
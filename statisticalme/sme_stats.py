@@ -0,0 +1,95 @@
+# This file is part of StatisticalMe discord bot.
+#
+# Copyright 2019 by Antony Suter
+#
+# StatisticalMe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# StatisticalMe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with StatisticalMe.  If not, see <https://www.gnu.org/licenses/>.
+
+import collections
+import logging
+import math
+
+logger = logging.getLogger("StatisticalMe")
+
+# A dotted phase is a stage within the phase before the dot
+phases = [
+    "parse",
+    "parse.who",
+    "parse.what",
+    "parse.players",
+    "compute",
+    "render",
+    "queue",
+    "send",
+]
+
+
+def percentile(sorted_samples, pct):
+    # Nearest rank
+    index = max(0, math.ceil(pct / 100.0 * len(sorted_samples)) - 1)
+    return sorted_samples[index]
+
+
+class LatencyStats:
+    # Per command path and phase, a call count and the most recent samples,
+    # which is what the percentiles are taken over
+    def __init__(self, sample_max=512):
+        self.sample_max = sample_max
+        self.samples = dict()
+        self.counts = dict()
+
+        logger.info("object LatencyStats built")
+
+    def record(self, path, phase, secs):
+        key = (path, phase)
+        samples = self.samples.get(key)
+
+        if samples is None:
+            samples = collections.deque(maxlen=self.sample_max)
+            self.samples[key] = samples
+            self.counts[key] = 0
+
+        samples.append(secs)
+        self.counts[key] += 1
+
+    def record_request(self, ctx, total, timed_before=0.0):
+        # Whatever of total was not parsing or rendering was compute.
+        # timed_before is time already in ctx.timings before total started.
+        path = ctx.path_name()
+        timed = 0.0
+
+        for phase, secs in ctx.timings.items():
+            if "." not in phase:
+                timed += secs
+            if phase != "send":
+                self.record(path, phase, secs)
+
+        self.record(path, "compute", max(0.0, total - (timed - timed_before)))
+
+    def reset(self):
+        self.samples = dict()
+        self.counts = dict()
+
+    def rows(self):
+        r_list = list()
+
+        for path, phase in sorted(
+            self.samples, key=lambda key: (key[0], phases.index(key[1]))
+        ):
+            samples = sorted(self.samples[(path, phase)])
+            r_list.append(
+                [path, phase, self.counts[(path, phase)]]
+                + [f"{percentile(samples, pct) * 1000.0:.1f}" for pct in [50, 95, 99]]
+            )
+
+        return r_list
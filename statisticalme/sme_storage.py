@@ -0,0 +1,491 @@
+# This file is part of StatisticalMe discord bot.
+#
+# Copyright 2019 by Antony Suter
+#
+# StatisticalMe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# StatisticalMe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with StatisticalMe.  If not, see <https://www.gnu.org/licenses/>.
+
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from . import sme_journal, sme_roster, sme_snapshot
+
+logger = logging.getLogger("StatisticalMe")
+
+
+def storage_from_name(storage_name, var_dir):
+    storage = None
+
+    if storage_name == "json":
+        storage = JsonStorage(var_dir)
+    elif storage_name == "sqlite":
+        storage = SqliteStorage(var_dir)
+    else:
+        raise ValueError(f"Unknown storage backend {storage_name}")
+
+    return storage
+
+
+class JsonStorage:
+    # Whole-blob JSON files, except pilot data which is a binary snapshot with
+    # changes journaled in between. persdata.json is only an export, or read
+    # when there is no snapshot yet.
+    def __init__(self, var_dir):
+        self.config_filepath = os.path.join(var_dir, "config.json")
+        self.persdata_filepath = os.path.join(var_dir, "persdata.json")
+        self.snapshot_filepath = os.path.join(var_dir, "persdata.smeb")
+        self.journal_filepath = os.path.join(var_dir, "persdata.journal")
+        self.journal_old_filepath = os.path.join(var_dir, "persdata.journal.old")
+        self.weights_filepath = os.path.join(var_dir, "weights.json")
+        self.wsstate_filepath = os.path.join(var_dir, "wsstate.json")
+
+        self.journal = None
+        self.compact_records = 2000
+        self.compact_interval = 3600
+        self.next_compact = time.monotonic() + self.compact_interval
+
+        logger.info("object JsonStorage built")
+
+    def config_load(self):
+        with open(self.config_filepath, "r") as fh:
+            return json.load(fh)
+
+    def config_snapshot(self, config):
+        return [(self.config_filepath, json.dumps(config).encode("utf-8"))]
+
+    def weights_load(self):
+        with open(self.weights_filepath, "r") as fh:
+            return json.load(fh)
+
+    def wsstate_load(self):
+        with open(self.wsstate_filepath, "r") as fh:
+            return json.load(fh)
+
+    def wsstate_snapshot(self, wsstate):
+        return [(self.wsstate_filepath, json.dumps(wsstate).encode("utf-8"))]
+
+    def persdata_load(self, tech_keys):
+        if os.path.exists(self.snapshot_filepath):
+            return sme_snapshot.SnapshotReader(self.snapshot_filepath)
+
+        with open(self.persdata_filepath, "r") as fh:
+            return json.load(fh)
+
+    def persdata_replay(self):
+        # An old journal is only left behind if its snapshot never got written
+        return itertools.chain(
+            sme_journal.journal_replay(self.journal_old_filepath),
+            sme_journal.journal_replay(self.journal_filepath),
+        )
+
+    def persdata_open(self):
+        self.journal = sme_journal.PersdataJournal(self.journal_filepath)
+        self.journal.open()
+
+    def persdata_record(self, record):
+        self.journal.append(record)
+
+    def persdata_snapshot(self, tech_keys, roster):
+        data = sme_snapshot.snapshot_encode(tech_keys, roster)
+
+        # Records appended while the snapshot is being written go to a fresh
+        # journal, so only the rotated one is covered by this snapshot
+        if self.journal is not None:
+            self.journal.rotate(self.journal_old_filepath)
+
+        self.next_compact = time.monotonic() + self.compact_interval
+
+        return [(self.snapshot_filepath, data)]
+
+    def persdata_export(self, tech_keys, roster):
+        persdata = {"tech_keys": tech_keys, "players": roster.to_players()}
+
+        return [(self.persdata_filepath, json.dumps(persdata).encode("utf-8"))]
+
+    def persdata_saved(self):
+        try:
+            os.remove(self.journal_old_filepath)
+        except FileNotFoundError:
+            pass
+
+    def writes_done(self):
+        pass
+
+    def persdata_compact_due(self):
+        due = False
+
+        if self.journal is not None:
+            if self.journal.record_count >= self.compact_records:
+                due = True
+            elif self.journal.record_count > 0 and self.next_compact < time.monotonic():
+                due = True
+
+        return due
+
+    def players_updated_since(self, time_str):
+        # Not indexed here, the caller scans its in-memory players instead
+        return None
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+
+
+class SqliteStorage:
+    # One row per change, so there is never a snapshot to compact
+    schema = [
+        "CREATE TABLE IF NOT EXISTS players (pid TEXT PRIMARY KEY) WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS player_tech ("
+        " pid TEXT NOT NULL, tech_key TEXT NOT NULL, level INTEGER NOT NULL,"
+        " PRIMARY KEY (pid, tech_key)) WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS player_info ("
+        " pid TEXT NOT NULL, name TEXT NOT NULL, value TEXT,"
+        " PRIMARY KEY (pid, name)) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS player_info_by_value ON player_info (name, value)",
+        "CREATE TABLE IF NOT EXISTS groups ("
+        " name TEXT PRIMARY KEY, defn TEXT NOT NULL, members TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS ws (name TEXT PRIMARY KEY, data TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS weights (key TEXT PRIMARY KEY, data TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS ws_state ("
+        " name TEXT PRIMARY KEY, data TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS aliases ("
+        " guild TEXT NOT NULL, name TEXT NOT NULL, words TEXT NOT NULL,"
+        " PRIMARY KEY (guild, name)) WITHOUT ROWID",
+    ]
+    schema_version = 1
+
+    def __init__(self, var_dir):
+        self.db_filepath = os.path.join(var_dir, "statisticalme.db")
+        self.weights_filepath = os.path.join(var_dir, "weights.json")
+        self.legacy = JsonStorage(var_dir)
+        self.legacy_replay = False
+
+        # Held back while a snapshot write runs in the save thread
+        self.pending_records = None
+
+        self.conn = self.connect()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+
+        db_version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        with self.conn:
+            for stmt in self.schema:
+                self.conn.execute(stmt)
+
+            self.conn.execute(f"PRAGMA user_version={self.schema_version}")
+
+        if db_version == 0:
+            self.import_legacy()
+
+        logger.info("object SqliteStorage built")
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_filepath)
+        conn.execute("PRAGMA synchronous=NORMAL")
+
+        return conn
+
+    def thread_write(self, write_fn, *args):
+        # Snapshots are written by the save thread, on a connection of its own
+        # as sqlite connections stay in the thread that made them. Records
+        # made meanwhile wait for writes_done, so they land after the snapshot
+        # and never wait on its lock in the event loop.
+        if self.pending_records is None:
+            self.pending_records = list()
+
+        def write():
+            conn = self.connect()
+            try:
+                with conn:
+                    write_fn(conn, *args)
+            finally:
+                conn.close()
+
+            # Rows, not files, so there is no byte count
+            return 0
+
+        return write
+
+    def writes_done(self):
+        pending = self.pending_records
+        self.pending_records = None
+
+        if pending:
+            with self.conn:
+                for record in pending:
+                    self.record_write(self.conn, record)
+
+    def import_legacy(self):
+        try:
+            with self.conn:
+                self.config_write(self.conn, self.config_rows(self.legacy.config_load()))
+            logger.info("Imported config into sqlite")
+        except Exception:
+            logger.debug("Exception importing config file")
+
+        try:
+            loaded = self.legacy.persdata_load(None)
+
+            if isinstance(loaded, sme_snapshot.SnapshotReader):
+                roster = sme_roster.Roster.from_snapshot(len(loaded.tech_keys), loaded)
+                tech_keys, players = loaded.tech_keys, roster.to_players()
+            else:
+                tech_keys, players = loaded["tech_keys"], loaded["players"]
+
+            with self.conn:
+                self.persdata_write(self.conn, self.persdata_rows(tech_keys, players))
+
+            self.legacy_replay = True
+            logger.info("Imported persistant data into sqlite")
+        except Exception:
+            logger.debug("Exception importing persdata file")
+
+    def config_load(self):
+        groups = dict()
+        for name, defn, members in self.conn.execute(
+            "SELECT name, defn, members FROM groups"
+        ):
+            groups[name] = {"defn": defn, "members": json.loads(members)}
+
+        ws = dict()
+        for name, data in self.conn.execute("SELECT name, data FROM ws"):
+            ws[name] = json.loads(data)
+
+        aliases = dict()
+        for guild, name, words in self.conn.execute(
+            "SELECT guild, name, words FROM aliases"
+        ):
+            aliases.setdefault(guild, dict())[name] = json.loads(words)
+
+        return {"groups": groups, "ws": ws, "aliases": aliases}
+
+    def config_snapshot(self, config):
+        return [self.thread_write(self.config_write, self.config_rows(config))]
+
+    def config_rows(self, config):
+        # Encoded on the event loop, where handlers can not change it
+        group_rows = [
+            (name, grp["defn"], json.dumps(list(grp["members"])))
+            for name, grp in config.get("groups", dict()).items()
+        ]
+        ws_rows = [
+            (name, json.dumps(ws_struct))
+            for name, ws_struct in config.get("ws", dict()).items()
+        ]
+        alias_rows = [
+            (guild, name, json.dumps(words))
+            for guild, guild_aliases in config.get("aliases", dict()).items()
+            for name, words in guild_aliases.items()
+        ]
+
+        return (group_rows, ws_rows, alias_rows)
+
+    def config_write(self, conn, rows):
+        group_rows, ws_rows, alias_rows = rows
+
+        conn.execute("DELETE FROM groups")
+        conn.executemany(
+            "INSERT INTO groups (name, defn, members) VALUES (?, ?, ?)", group_rows
+        )
+
+        conn.execute("DELETE FROM ws")
+        conn.executemany("INSERT INTO ws (name, data) VALUES (?, ?)", ws_rows)
+
+        conn.execute("DELETE FROM aliases")
+        conn.executemany(
+            "INSERT INTO aliases (guild, name, words) VALUES (?, ?, ?)", alias_rows
+        )
+
+    def weights_load(self):
+        # A weights.json dropped into var/ replaces the stored weights
+        weights = None
+
+        try:
+            with open(self.weights_filepath, "r") as fh:
+                weights = json.load(fh).get("weights", dict())
+
+            with self.conn:
+                self.conn.execute("DELETE FROM weights")
+                self.conn.executemany(
+                    "INSERT INTO weights (key, data) VALUES (?, ?)",
+                    [(key, json.dumps(val)) for key, val in weights.items()],
+                )
+        except FileNotFoundError:
+            weights = dict()
+            for key, data in self.conn.execute("SELECT key, data FROM weights"):
+                weights[key] = json.loads(data)
+
+        return {"weights": weights}
+
+    def wsstate_load(self):
+        wsstate = dict()
+        for name, data in self.conn.execute("SELECT name, data FROM ws_state"):
+            wsstate[name] = json.loads(data)
+
+        return wsstate
+
+    def wsstate_snapshot(self, wsstate):
+        rows = [(name, json.dumps(board)) for name, board in wsstate.items()]
+
+        return [self.thread_write(self.wsstate_write, rows)]
+
+    def wsstate_write(self, conn, rows):
+        conn.execute("DELETE FROM ws_state")
+        conn.executemany("INSERT INTO ws_state (name, data) VALUES (?, ?)", rows)
+
+    def persdata_load(self, tech_keys):
+        tech_index = {key: index for index, key in enumerate(tech_keys)}
+
+        players = dict()
+        for (pid,) in self.conn.execute("SELECT pid FROM players"):
+            players[pid] = {"tech": [0] * len(tech_keys), "info": dict()}
+
+        unk_tech = set()
+        for pid, tech_key, level in self.conn.execute(
+            "SELECT pid, tech_key, level FROM player_tech"
+        ):
+            if tech_key in tech_index:
+                players[pid]["tech"][tech_index[tech_key]] = level
+            else:
+                unk_tech.add(tech_key)
+
+        if len(unk_tech) > 0:
+            logger.debug(f"Unknown techs {unk_tech} in sqlite data")
+
+        for pid, name, value in self.conn.execute(
+            "SELECT pid, name, value FROM player_info"
+        ):
+            players[pid]["info"][name] = json.loads(value)
+
+        # Stored by tech key, so always in the order asked for
+        return {"tech_keys": list(tech_keys), "players": players}
+
+    def persdata_replay(self):
+        # Only a freshly imported JSON snapshot can have journal records to catch up on
+        if self.legacy_replay:
+            self.legacy_replay = False
+            return self.legacy.persdata_replay()
+
+        return iter(())
+
+    def persdata_open(self):
+        pass
+
+    def persdata_record(self, record):
+        if self.pending_records is not None:
+            self.pending_records.append(record)
+        else:
+            with self.conn:
+                self.record_write(self.conn, record)
+
+    def record_write(self, conn, record):
+        op = record["op"]
+        pid = record["pid"]
+
+        if op == "tech":
+            conn.execute("INSERT OR IGNORE INTO players (pid) VALUES (?)", (pid,))
+            conn.execute(
+                "INSERT OR REPLACE INTO player_tech (pid, tech_key, level)"
+                " VALUES (?, ?, ?)",
+                (pid, record["key"], record["val"]),
+            )
+        elif op == "info":
+            conn.execute("INSERT OR IGNORE INTO players (pid) VALUES (?)", (pid,))
+            conn.execute(
+                "INSERT OR REPLACE INTO player_info (pid, name, value)"
+                " VALUES (?, ?, ?)",
+                (pid, record["key"], json.dumps(record["val"])),
+            )
+        elif op == "drop":
+            conn.execute("DELETE FROM player_tech WHERE pid = ?", (pid,))
+            conn.execute("DELETE FROM player_info WHERE pid = ?", (pid,))
+            conn.execute("DELETE FROM players WHERE pid = ?", (pid,))
+        else:
+            raise ValueError(f"Unknown record op {op}")
+
+    def persdata_snapshot(self, tech_keys, roster):
+        rows = self.persdata_rows(tech_keys, roster.to_players())
+
+        return [self.thread_write(self.persdata_write, rows)]
+
+    def persdata_export(self, tech_keys, roster):
+        return self.legacy.persdata_export(tech_keys, roster)
+
+    def persdata_rows(self, tech_keys, players):
+        # Encoded on the event loop, as info dicts are the live roster ones
+        player_rows = [(pid,) for pid in players]
+        tech_rows = [
+            (pid, tech_key, level)
+            for pid, pp in players.items()
+            for tech_key, level in zip(tech_keys, pp["tech"])
+            if level != 0
+        ]
+        info_rows = [
+            (pid, name, json.dumps(value))
+            for pid, pp in players.items()
+            for name, value in pp["info"].items()
+        ]
+
+        return (player_rows, tech_rows, info_rows)
+
+    def persdata_write(self, conn, rows):
+        player_rows, tech_rows, info_rows = rows
+
+        conn.execute("DELETE FROM player_tech")
+        conn.execute("DELETE FROM player_info")
+        conn.execute("DELETE FROM players")
+
+        conn.executemany("INSERT INTO players (pid) VALUES (?)", player_rows)
+        conn.executemany(
+            "INSERT INTO player_tech (pid, tech_key, level) VALUES (?, ?, ?)",
+            tech_rows,
+        )
+        conn.executemany(
+            "INSERT INTO player_info (pid, name, value) VALUES (?, ?, ?)", info_rows
+        )
+
+    def persdata_saved(self):
+        pass
+
+    def persdata_compact_due(self):
+        return False
+
+    def players_updated_since(self, time_str):
+        # Info values are stored JSON encoded, which keeps time strings in order.
+        # Only the updated side, as roster rows never updated may have no row yet.
+        updated = set(
+            pid
+            for (pid,) in self.conn.execute(
+                "SELECT pid FROM player_info"
+                " WHERE name = 'last_tech_update' AND value >= ?",
+                (json.dumps(time_str),),
+            )
+        )
+
+        for record in self.pending_records or ():
+            if record["op"] == "drop":
+                updated.discard(record["pid"])
+            elif (
+                record["op"] == "info"
+                and record["key"] == "last_tech_update"
+                and record["val"] >= time_str
+            ):
+                updated.add(record["pid"])
+
+        return updated
+
+    def close(self):
+        self.conn.close()
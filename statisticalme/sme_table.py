@@ -15,27 +15,41 @@
 # You should have received a copy of the GNU General Public License
 # along with StatisticalMe.  If not, see <https://www.gnu.org/licenses/>.
 
+import io
+
 import statisticalme.statisticalme as smer
 
+# Past this many characters, a table goes out as one file rather than
+# several messages
+attach_min_chars = 4000
+
+
+class Attachment:
+    # A file to upload in place of message text
+    def __init__(self, filename, data, content=None):
+        self.filename = filename
+        self.data = data
+        self.content = content
+
 
-def draw(header, data_align, data, flag_csv=False):
+def draw(header, data_align, data, flag_csv=False, flag_attach=False):
     return_list = []
     msg_lines = list()
 
     if flag_csv:
-        # csv style
-        csv_line = str(header[0])
-        for hh in header[1:]:
-            csv_line += "," + str(hh)
-
-        msg_lines.append(csv_line)
+        # csv style, straight into a buffer
+        buf = io.StringIO()
+        buf.write(",".join([str(hh) for hh in header]))
+        buf.write("\n")
 
         for ditem in data:
-            csv_line = str(ditem[0])
-            for dd in ditem[1:]:
-                csv_line += "," + str(dd)
+            buf.write(",".join([str(dd) for dd in ditem]))
+            buf.write("\n")
+
+        if flag_attach and buf.tell() > attach_min_chars:
+            return [Attachment("table.csv", buf.getvalue().encode("utf-8"))]
 
-            msg_lines.append(csv_line)
+        msg_lines = buf.getvalue().splitlines()
     else:
         # pretty text table
         data2 = list()
@@ -48,6 +62,14 @@ def draw(header, data_align, data, flag_csv=False):
             data2,
         )
 
+        if flag_attach and sum([len(ll) + 1 for ll in msg_lines]) > attach_min_chars:
+            buf = io.StringIO()
+            for ll in msg_lines:
+                buf.write(ll.rstrip())
+                buf.write("\n")
+
+            return [Attachment("table.txt", buf.getvalue().encode("utf-8"))]
+
     flag_truncated = False
     next_out = list()
     noout_len = 7
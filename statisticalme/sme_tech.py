@@ -236,6 +236,48 @@ class TechHandler:
         self.shield_range = (33, 39)
         self.support_range = (39, 64)
 
+        # Lookup tables, all built here and never changed after, bar derived
+        # techs added by register_derived
+
+        # category id to category name, and its tech keys
+        self.category_names = (
+            "other",
+            "ship",
+            "trade",
+            "mining",
+            "weapon",
+            "shield",
+            "support",
+            "unknown",
+        )
+        category_ranges = (
+            self.other_range,
+            self.ships_range,
+            self.trade_range,
+            self.mining_range,
+            self.weapon_range,
+            self.shield_range,
+            self.support_range,
+        )
+        self.category_unknown = len(category_ranges)
+
+        # tech index to category id
+        self.tech_category = [self.category_unknown] * len(self.tech_keys)
+        for cat_id, cat_range in enumerate(category_ranges):
+            for li in range(cat_range[0], min(cat_range[1], len(self.tech_keys))):
+                self.tech_category[li] = cat_id
+        self.tech_category = tuple(self.tech_category)
+
+        # category name, or plural, to tuple of tech keys
+        self.category_keys = dict()
+        for cat_id, cat_range in enumerate(category_ranges):
+            cat_name = self.category_names[cat_id]
+            self.category_keys[cat_name] = tuple(
+                self.tech_keys[cat_range[0] : cat_range[1]]
+            )
+        for cat_name in ["ship", "weapon", "shield"]:
+            self.category_keys[cat_name + "s"] = self.category_keys[cat_name]
+
         # tech key or tech alias to tech index
         self.tech_key_index = dict()
 
@@ -248,6 +290,18 @@ class TechHandler:
             for la in la_val:
                 self.tech_key_index[la] = int(li)
 
+        # tech key or tech alias, or derived tech, to
+        # (tech index, tech name, category id)
+        self.tech_info = dict()
+
+        for tkey, li in self.tech_key_index.items():
+            self.tech_info[tkey] = (li, self.tech_names[li], self.tech_category[li])
+
+        # derived tech name to its tech index
+        self.derived_index = dict()
+
+        self.no_tech_info = (-1, "", self.category_unknown)
+
         logger.info("object TechHandler built")
 
     # @staticmethod
@@ -259,82 +313,35 @@ class TechHandler:
 
     #     return r_index
 
-    def get_tech_index(self, tech_key):
-        li = -1
+    def register_derived(self, name, label):
+        # Indexed past the tech keys, so known but never a roster column
+        tech_index = len(self.tech_keys) + len(self.derived_index)
+        self.derived_index[name] = tech_index
+        self.tech_info[name] = (tech_index, label, self.category_unknown)
 
-        if tech_key in self.tech_key_index:
-            li = self.tech_key_index[tech_key]
-        elif tech_key == "relics":
-            li = 9900
-        elif tech_key == "totalcargo":
-            li = 9901
+    def is_derived(self, tech_key):
+        return tech_key in self.derived_index
 
-        return li
+    def get_tech_index(self, tech_key):
+        return self.tech_info.get(tech_key, self.no_tech_info)[0]
 
     def get_tech_name(self, tech_key):
-        tech_fullname = ""
-
-        tindex = self.get_tech_index(tech_key)
-        if tindex >= 0 and tindex < 9900:
-            tech_fullname = self.tech_names[tindex]
-        elif tindex == 9900:
-            tech_fullname = "Relics"
-        elif tindex == 9901:
-            tech_fullname = "Total Cargo"
+        return self.tech_info.get(tech_key, self.no_tech_info)[1]
 
-        return tech_fullname
+    def get_tech_category(self, tech_key):
+        return self.tech_info.get(tech_key, self.no_tech_info)[2]
 
     def tech_key_range_list(self, range_name):
-        range_list = list()
-
-        if range_name == "other":
-            range_list = self.tech_keys[self.other_range[0] : self.other_range[1]]
-        elif range_name in ["ship", "ships"]:
-            range_list = self.tech_keys[self.ships_range[0] : self.ships_range[1]]
-        elif range_name == "trade":
-            range_list = self.tech_keys[self.trade_range[0] : self.trade_range[1]]
-        elif range_name == "mining":
-            range_list = self.tech_keys[self.mining_range[0] : self.mining_range[1]]
-        elif range_name in ["weapon", "weapons"]:
-            range_list = self.tech_keys[self.weapon_range[0] : self.weapon_range[1]]
-        elif range_name in ["shield", "shields"]:
-            range_list = self.tech_keys[self.shield_range[0] : self.shield_range[1]]
-        elif range_name == "support":
-            range_list = self.tech_keys[self.support_range[0] : self.support_range[1]]
-
-        # logger.debug(f"tech_key_range_list() range_list {range_list}")
-
-        return range_list
+        return self.category_keys.get(range_name, ())
 
     def _get_tech_range_name(self, tech_key):
-        range_name = "unknown"
-
-        tech_id = self.get_tech_index(tech_key)
-
-        if tech_id >= self.other_range[0] and tech_id < self.other_range[1]:
-            range_name = "other"
-        elif tech_id >= self.ships_range[0] and tech_id < self.ships_range[1]:
-            range_name = "ship"
-        elif tech_id >= self.trade_range[0] and tech_id < self.trade_range[1]:
-            range_name = "trade"
-        elif tech_id >= self.mining_range[0] and tech_id < self.mining_range[1]:
-            range_name = "mining"
-        elif tech_id >= self.weapon_range[0] and tech_id < self.weapon_range[1]:
-            range_name = "weapon"
-        elif tech_id >= self.shield_range[0] and tech_id < self.shield_range[1]:
-            range_name = "shield"
-        elif tech_id >= self.support_range[0] and tech_id < self.support_range[1]:
-            range_name = "support"
-
-        return range_name
+        return self.category_names[self.get_tech_category(tech_key)]
 
     def is_range_change2(self, tech_key1, tech_key2):
         result = False
 
         if tech_key1 is not None and tech_key2 is not None:
-            if self._get_tech_range_name(tech_key1) != self._get_tech_range_name(
-                tech_key2
-            ):
+            if self.get_tech_category(tech_key1) != self.get_tech_category(tech_key2):
                 result = True
 
         return result
@@ -0,0 +1,249 @@
+# This file is part of StatisticalMe discord bot.
+#
+# Copyright 2019 by Antony Suter
+#
+# StatisticalMe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# StatisticalMe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with StatisticalMe.  If not, see <https://www.gnu.org/licenses/>.
+
+# ScoreEngine against the per-pilot scoring it replaced, over random rosters
+
+import math
+import random
+
+import pytest
+
+from statisticalme import sme_roster, sme_score, sme_tech
+
+teh = sme_tech.TechHandler()
+teh.register_derived("relics", "Relics")
+
+weight_keys = ["201206", "210918", "generic"]
+
+
+def baseline_score(score_key, ww, tech_get):
+    # command_score as it was, less the detail output. tech_get(tkey) is
+    # player_tech_get for one pilot.
+    accum = 0
+
+    try:
+        if score_key in sme_score.ws_rules:
+            faccum = list()
+
+            for tkey in ["relics", "entrust", "dispatch", "dart", "relicdrone"]:
+                if tkey in ww:
+                    tval = tech_get(tkey)
+                    if tval > 0:
+                        score = ww[tkey][tval - 1]
+                        if score_key == "210918" and tkey == "dart":
+                            score = 50
+
+                        faccum.append(float(score))
+
+            def found_sorted(techlist):
+                found = list()
+                for tkey in techlist:
+                    score = 0
+                    if tkey in ww:
+                        tval = tech_get(tkey)
+                        if tval > 0:
+                            score = ww[tkey][tval - 1]
+
+                    if score > 0:
+                        found.append([tkey, score])
+
+                found.sort(key=lambda x: x[1], reverse=True)
+
+                return found
+
+            # mining
+            found = found_sorted(teh.tech_key_range_list("mining"))
+            if len(found) > 0:
+                minerlvl = tech_get("miner")
+                mcount = 0
+                if minerlvl >= 2 and minerlvl <= 6:
+                    mcount = minerlvl - 1
+
+                fscore = float(0.0)
+                mmax = len(found)
+                for zz in range(0, min(mcount, mmax)):
+                    fscore += float(found[zz][1])
+
+                if mcount < mmax:
+                    for zz in range(mcount, min(mcount * 2 - 2, mmax)):
+                        fscore += float(found[zz][1]) * 0.5
+
+                faccum.append(fscore)
+
+            # support
+            bslvl = tech_get("bs")
+            if bslvl >= 2 and bslvl <= 6:
+                scount = bslvl - 1
+
+                found = found_sorted(teh.tech_key_range_list("support"))
+                if len(found) > 0:
+                    fscore = float(0.0)
+                    smax = len(found)
+                    for zz in range(0, min(scount, smax)):
+                        fscore += float(found[zz][1])
+
+                    if scount < smax:
+                        for zz in range(scount, min(scount * 2, smax)):
+                            fscore += float(found[zz][1]) * 0.75
+
+                        for zz in range(scount * 2, smax):
+                            fscore += float(found[zz][1]) * 0.25
+
+                    faccum.append(fscore)
+
+            # weapons
+            techlist = teh.tech_key_range_list("weapon")
+            if score_key == "201206":
+                techlist = [tt for tt in techlist if tt not in ["dart"]]
+
+            found = found_sorted(techlist)
+            if len(found) > 0:
+                got_first = False
+                wt2 = list()
+                for weapon_tuple in found:
+                    if weapon_tuple[0] in ["battery", "laser"]:
+                        if not got_first:
+                            wt2.append(weapon_tuple)
+                            got_first = True
+                    else:
+                        wt2.append(weapon_tuple)
+
+                whi = min(3, len(wt2))
+                if 0 < whi:
+                    fscore = float(wt2[0][1])
+                    if 1 < whi:
+                        fscore += float(wt2[1][1]) * 0.75
+                        if 2 < whi:
+                            fscore += float(wt2[2][1]) * 0.5
+
+                    faccum.append(fscore)
+
+            # shields
+            found = found_sorted(teh.tech_key_range_list("shield"))
+            if len(found) > 0:
+                gotmain = False
+                gotareadelta = False
+                st2 = list()
+                for ss in found:
+                    skey = ss[0]
+                    if skey in ["passiveshield", "omegashield", "mirrorshield"]:
+                        if not gotmain:
+                            st2.append(ss)
+                            gotmain = True
+                    elif skey in ["areashield", "deltashield"]:
+                        if not gotareadelta:
+                            st2.append(ss)
+                            gotareadelta = True
+                        else:
+                            st2.append([skey, ss[1] * 0.5])
+                    elif skey in ["blastshield"]:
+                        st2.append(ss)
+
+                fscore = float(0.0)
+                for ss in st2:
+                    fscore += float(ss[1])
+
+                faccum.append(fscore)
+
+            faccum.append(0.5)
+            accum = int(math.floor(math.fsum(faccum)))
+        else:
+            for tkey in teh.tech_keys:
+                tval = tech_get(tkey)
+                if tval > 0 and tkey in ww:
+                    accum += ww[tkey][tval - 1]
+    except IndexError:
+        accum = 0
+
+    return accum
+
+
+def random_weights(rng):
+    # One weight list runs short of the levels used, which scores pilots
+    # with a higher level as 0
+    ww = dict()
+
+    for tkey in teh.tech_keys + ["relics"]:
+        if rng.random() < 0.8:
+            ww[tkey] = [rng.randint(0, 120) for _ in range(10)]
+
+    short_key = rng.choice(sorted(ww))
+    ww[short_key] = ww[short_key][:8]
+
+    return ww
+
+
+def random_roster(rng, n_pilots):
+    roster = sme_roster.Roster(len(teh.tech_keys))
+    roster.set_derived(
+        [
+            sme_roster.DerivedColumn(
+                "relics",
+                "Relics",
+                [
+                    teh.get_tech_index("cargobayextension"),
+                    teh.get_tech_index("transport"),
+                ],
+                lambda cbe, ts: (cbe + ts) // 2,
+            )
+        ]
+    )
+
+    for nn in range(n_pilots):
+        row = roster.ensure_row(str(1000 + nn))
+        for index in range(len(teh.tech_keys)):
+            if rng.random() < 0.6:
+                roster.tech_set(row, index, rng.randint(1, 10))
+
+    return roster
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("score_key", weight_keys)
+def test_score_rows_matches_baseline(score_key, seed):
+    rng = random.Random(f"{score_key}-{seed}")
+    ww = random_weights(rng)
+    roster = random_roster(rng, 40)
+
+    engine = sme_score.ScoreEngine(teh, {score_key: ww}, roster.derived_get)
+    rows = list(range(len(roster)))
+    got = [score for score, _ in engine.score_rows(roster, score_key, rows)]
+
+    def tech_getter(row):
+        def tech_get(tkey):
+            if teh.is_derived(tkey):
+                return roster.derived_get(row, tkey)
+
+            return roster.tech_get(row, teh.get_tech_index(tkey))
+
+        return tech_get
+
+    expected = [baseline_score(score_key, ww, tech_getter(row)) for row in rows]
+
+    assert got == expected
+
+
+def test_ws_rules_need_miner_and_bs():
+    class NoMinerTechHandler(sme_tech.TechHandler):
+        def get_tech_index(self, tech_key):
+            if tech_key == "miner":
+                return -1
+
+            return super().get_tech_index(tech_key)
+
+    with pytest.raises(ValueError):
+        sme_score.CompiledWeights(NoMinerTechHandler(), "210918", dict())